@@ -15,8 +15,27 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import collections
+import contextlib
+import datetime
+import functools
+import itertools
+import os
+import warnings
 
-from autopkgtest_results_formatter import results_formatter
+from autopkgtest_results_formatter import (
+    history_report,
+    http_client,
+    results_cache,
+    results_formatter,
+    results_index,
+    results_store,
+    run_metrics
+)
+
+
+_DEFAULT_PPA_USER = 'snappy-dev'
+_DEFAULT_PPA_NAME = 'snapcraft-daily'
 
 
 def main():
@@ -27,16 +46,270 @@ def main():
         '--distros', help='The names of the distros, for example: xenial',
         nargs='+')
     parser.add_argument(
-        '--day', help='The day of the results, with format yyyymmdd')
+        '--ppa', dest='ppas', action='append', type=_parse_ppa,
+        metavar='USER/NAME[:DISTRO,...]',
+        help=('A PPA to format, with the distros of its results. Default '
+              'distros are the ones of --distros. It can be repeated to '
+              'format many PPAs in the same run, each one to the directory '
+              'USER/NAME in the destination directory. Default is '
+              '{}/{}'.format(_DEFAULT_PPA_USER, _DEFAULT_PPA_NAME)))
+    parser.add_argument(
+        '--ppas-file', type=argparse.FileType('r'),
+        help=('The path to a file with a PPA to format on each line, with '
+              'the same format as --ppa. Empty lines and lines starting with '
+              '# are ignored'))
+    days_group = parser.add_mutually_exclusive_group(required=True)
+    days_group.add_argument(
+        '--day', type=_parse_day,
+        help='The day of the results, with format yyyymmdd')
+    days_group.add_argument(
+        '--from', dest='from_day', type=_parse_day,
+        help=('The first day of a range of results, with format yyyymmdd. '
+              'A report is written for each day in the range'))
+    days_group.add_argument(
+        '--last-days', type=int, metavar='DAYS',
+        help=('The number of days of results until the current day, in UTC. '
+              'With --watch, the days follow the current day while it runs'))
+    parser.add_argument(
+        '--to', dest='to_day', type=_parse_day,
+        help=('The last day of a range of results, with format yyyymmdd. '
+              'Default is the day of --from'))
+    parser.add_argument(
+        '--workers', help='The number of results to download concurrently',
+        type=int)
+    parser.add_argument(
+        '--connections',
+        help='The maximum number of connections open to the results server',
+        type=int)
+    parser.add_argument(
+        '--timeout', help='The timeout of the downloads, in seconds',
+        type=float)
+    parser.add_argument(
+        '--retries', help='The number of times to retry a failed download',
+        type=int)
+    parser.add_argument(
+        '--decode-processes', type=int,
+        help=('The number of processes to read the downloaded results. '
+              'Default is to read them in the download workers'))
+    parser.add_argument(
+        '--parallel-indexes', action='store_true',
+        help='Download the indexes of all the distros at the same time')
+    parser.add_argument(
+        '--cache-dir',
+        help=('The path to the directory to cache the downloaded results. '
+              'Default is $XDG_CACHE_HOME/autopkgtest_results_formatter'))
+    parser.add_argument(
+        '--cache-size', help='The maximum size of the cache, in MiB',
+        type=int)
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help=('Do not cache the results. They are read while they are being '
+              'downloaded, and only the needed parts are downloaded'))
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help=('Keep the processed entries in a state file in the destination '
+              'directory, and only process new entries in the next run'))
+    parser.add_argument(
+        '--jsonl', action='store_true',
+        help=('Also write the entries of each day to a JSON Lines file, with '
+              'one object per entry'))
+    parser.add_argument(
+        '--store',
+        help=('The path to a SQLite database where the records of all the '
+              'entries are kept, to query the history of the results'))
+    parser.add_argument(
+        '--history-days', type=int,
+        help=('Also write a report with the slowest and flakiest tests of '
+              'this number of days until the last day, read from --store'))
+    parser.add_argument(
+        '--history-top', type=int,
+        help='The number of tests in each section of the history report')
+    parser.add_argument(
+        '--metrics-json',
+        help='The path to a JSON file to write the metrics of the run')
+    parser.add_argument(
+        '--metrics-prometheus',
+        help=('The path to a file to write the metrics of the run in the '
+              'Prometheus text format, for the node exporter textfile '
+              'collector'))
+    parser.add_argument(
+        '--watch', type=float, metavar='SECONDS',
+        help=('Keep running, polling the indexes at this interval, and '
+              'update the reports of the days with new entries. The metrics '
+              'are written after each poll'))
     args = parser.parse_args()
-    run(args.destination, args.distros, args.day)
+    if args.to_day and not args.from_day:
+        parser.error('--to requires --from')
+    if args.last_days is not None:
+        if args.last_days < 1:
+            parser.error('--last-days must be at least 1')
+        # The days are computed by run, so they follow the current day.
+        days = None
+    elif args.from_day:
+        days = list(_get_days(args.from_day, args.to_day or args.from_day))
+        if not days:
+            parser.error('--to is before --from')
+    else:
+        days = [args.day]
+    if args.history_days and not args.store:
+        parser.error('--history-days requires --store')
+    ppas = list(args.ppas or [])
+    if args.ppas_file:
+        with args.ppas_file:
+            for line in args.ppas_file:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    try:
+                        ppas.append(_parse_ppa(line))
+                    except argparse.ArgumentTypeError as e:
+                        parser.error('{}: {}'.format(args.ppas_file.name, e))
+    ppas = [ppa._replace(distros=ppa.distros or args.distros) for ppa in ppas]
+    if not all(ppa.distros for ppa in ppas) or not (ppas or args.distros):
+        parser.error('the distros of all the PPAs are required')
+    cache_size = None
+    if args.cache_size:
+        cache_size = args.cache_size * 1024 * 1024
+    run(args.destination, args.distros, days, ppas=ppas,
+        workers=args.workers,
+        connections=args.connections, timeout=args.timeout,
+        retries=args.retries, decode_processes=args.decode_processes,
+        parallel_indexes=args.parallel_indexes,
+        use_cache=not args.no_cache, cache_path=args.cache_dir,
+        cache_size=cache_size, incremental=args.incremental,
+        jsonl=args.jsonl, store_path=args.store,
+        history_days=args.history_days, history_top=args.history_top,
+        metrics_json_path=args.metrics_json,
+        metrics_prometheus_path=args.metrics_prometheus,
+        watch_interval=args.watch, last_days=args.last_days)
+
+
+def _parse_ppa(value):
+    ppa, _, distros = value.partition(':')
+    user, _, name = ppa.partition('/')
+    if not user or not name:
+        raise argparse.ArgumentTypeError(
+            'invalid PPA {!r}, the format is USER/NAME[:DISTRO,...]'.format(
+                value))
+    return results_formatter.PPA(
+        user=user.lstrip('~'), name=name,
+        distros=[distro for distro in distros.split(',') if distro])
+
+
+def _parse_day(value):
+    try:
+        datetime.datetime.strptime(value, '%Y%m%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'invalid day {!r}, the format is yyyymmdd'.format(value))
+    return value
+
+
+def _get_days(first_day, last_day):
+    day = datetime.datetime.strptime(first_day, '%Y%m%d').date()
+    last_day = datetime.datetime.strptime(last_day, '%Y%m%d').date()
+    while day <= last_day:
+        yield day.strftime('%Y%m%d')
+        day += datetime.timedelta(days=1)
+
+
+def _get_last_days(days):
+    last_day = datetime.datetime.now(datetime.timezone.utc).date()
+    first_day = last_day - datetime.timedelta(days=days - 1)
+    return list(_get_days(
+        first_day.strftime('%Y%m%d'), last_day.strftime('%Y%m%d')))
+
+
+def run(destination_path, distros, days, *, ppas=None, workers=None,
+        connections=None, timeout=None, retries=None, decode_processes=None,
+        parallel_indexes=False, use_cache=True, cache_path=None,
+        cache_size=None, incremental=False, jsonl=False, store_path=None,
+        history_days=None, history_top=None,
+        metrics_json_path=None, metrics_prometheus_path=None,
+        watch_interval=None, last_days=None):
+    get_days = None
+    if last_days:
+        get_days = functools.partial(_get_last_days, last_days)
+        days = get_days()
+    elif isinstance(days, str):
+        warnings.warn(
+            'Passing a single day to run is deprecated, pass a list of days',
+            DeprecationWarning, stacklevel=2)
+        days = [days]
+    metrics = run_metrics.Metrics()
+    cache = None
+    if use_cache:
+        cache = results_cache.ResultsCache(
+            path=cache_path, max_size=cache_size)
+    client = http_client.HTTPClient(
+        max_connections_per_host=connections, timeout=timeout,
+        retries=retries)
+    # The counters of the cache already added to the metrics, that can be
+    # written many times in watch mode.
+    counted_cache = collections.Counter()
+
+    def write_metrics():
+        if cache:
+            for name, value in (('cache_hits', cache.hits),
+                                ('cache_misses', cache.misses)):
+                metrics.count(name, value - counted_cache[name])
+                counted_cache[name] = value
+        if metrics_json_path:
+            metrics.write_json(metrics_json_path)
+        if metrics_prometheus_path:
+            metrics.write_prometheus(metrics_prometheus_path)
+
+    with contextlib.ExitStack() as stack:
+        stack.callback(client.close)
+        store = None
+        if store_path:
+            store = stack.enter_context(
+                results_store.ResultsStore(path=store_path))
+        # All the PPAs are formatted by the same formatter, that shares the
+        # client, the cache and the workers.
+        formatter = results_formatter.ResultsFormatter(
+            destination_path=destination_path, distros=distros,
+            ppa_user=_DEFAULT_PPA_USER, ppa_name=_DEFAULT_PPA_NAME,
+            ppas=ppas, days=days, workers=workers,
+            parallel_indexes=parallel_indexes, cache=cache,
+            incremental=incremental, client=client, jsonl=jsonl, store=store,
+            metrics=metrics, decode_processes=decode_processes)
+        if watch_interval:
+            try:
+                formatter.watch(
+                    interval=watch_interval, get_days=get_days,
+                    on_poll=write_metrics)
+            except KeyboardInterrupt:
+                pass
+            if get_days:
+                days = get_days()
+        else:
+            formatter.format()
+        if store and history_days:
+            # Each PPA has its own history, in its directory.
+            for ppa, ppa_destination_path in formatter.targets:
+                _print_history(
+                    store, ppa, ppa_destination_path, max(days),
+                    history_days, history_top)
+    write_metrics()
+    print(metrics.get_summary())
 
 
-def run(destination_path, distros, day):
-    formatter = results_formatter.ResultsFormatter(
-        destination_path=destination_path, distros=distros,
-        ppa_user='snappy-dev', ppa_name='snapcraft-daily', day=day)
-    formatter.format()
+def _print_history(store, ppa, destination_path, last_day, days, top):
+    first_day = (
+        datetime.datetime.strptime(last_day, '%Y%m%d').date() -
+        datetime.timedelta(days=days - 1)).strftime('%Y%m%d')
+    records = itertools.chain.from_iterable(
+        store.iter_records(
+            first_day, last_day, index_url=results_index.get_index_url(
+                distro=distro, ppa_user=ppa.user, ppa_name=ppa.name))
+        for distro in ppa.distros)
+    printer = history_report.HistoryPrinter(
+        destination_path=os.path.join(
+            destination_path, 'history-{}-{}.md'.format(first_day, last_day)),
+        first_day=first_day, last_day=last_day,
+        histories=history_report.compute_histories(records),
+        top=top)
+    printer.print_report()
 
 
 if __name__ == "__main__":
@@ -47,3 +47,35 @@ class ResultsIndexNotDownloadedError(AutopkgtestResultsFormatterError):
 
     fmt = ('Failed to {action}: The results index has not been downloaded. '
            'Use the ResultsIndex class as a context manager.')
+
+
+class DownloadError(AutopkgtestResultsFormatterError):
+    """Exception raised when a file could not be downloaded."""
+
+    fmt = 'Failed to download {url}: {reason}.'
+
+
+class DownloadStatusError(DownloadError):
+    """Exception raised when the server returned an error status."""
+
+    fmt = 'Failed to download {url}: HTTP status {status}.'
+
+
+class HostUnavailableError(DownloadError):
+    """Exception raised when a host is not used because it keeps failing."""
+
+    fmt = ('Failed to download {url}: {host} failed {failures} times in a '
+           'row, it will not be used for a while.')
+
+
+class ResultReadError(AutopkgtestResultsFormatterError):
+    """Exception raised when a result archive could not be read."""
+
+    fmt = 'Failed to read {url}: {reason}.'
+
+
+class InvalidGroupError(AutopkgtestResultsFormatterError):
+    """Exception raised when the results are grouped by an unknown column."""
+
+    fmt = ('Failed to group the results by {column}: The results can only be '
+           'grouped by {columns}.')
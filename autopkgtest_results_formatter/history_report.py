@@ -0,0 +1,198 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import array
+import collections
+import math
+
+
+_DEFAULT_TOP = 10
+
+
+class TestHistory(collections.namedtuple(
+        'TestHistory',
+        ['index_url', 'package', 'distro', 'architecture', 'runs', 'passes',
+         'pass_rate', 'flips', 'p50_duration', 'p95_duration'])):
+    """The history of the results of a package in a distro and architecture.
+
+    The index URL identifies the distro and the PPA of the results.
+
+    The runs with an unknown exit code are counted in the runs, but not in
+    the pass rate nor in the flips. The pass rate is None if no run has a
+    known exit code.
+
+    The flips are the number of times that the result changed from passed to
+    failed, or from failed to passed, between consecutive runs. The duration
+    percentiles are in seconds, or None if no run has a duration.
+    """
+
+    __slots__ = ()
+
+
+class _Accumulator():
+
+    __slots__ = (
+        'runs', 'known_runs', 'passes', 'flips', 'last_success', 'durations')
+
+    def __init__(self):
+        self.runs = 0
+        self.known_runs = 0
+        self.passes = 0
+        self.flips = 0
+        self.last_success = None
+        self.durations = array.array('q')
+
+    def add(self, record):
+        self.runs += 1
+        if record.duration is not None:
+            self.durations.append(record.duration)
+        if record.exitcode is None:
+            # It is not known if it passed.
+            return
+        success = record.exitcode == 0
+        self.known_runs += 1
+        self.passes += success
+        if self.last_success is not None and success != self.last_success:
+            self.flips += 1
+        self.last_success = success
+
+
+def compute_histories(records):
+    """Compute the history of every package, distro and architecture.
+
+    The results of different PPAs are kept in different histories.
+
+    The records are read only once, and only the durations are kept in
+    memory, so it can be used with the records of long windows.
+
+    :param records: The records of the results, sorted by day and
+        identifier.
+    :type records: iterator of results_store.StoredRecord.
+    :return: A list of TestHistory, sorted by index URL, package, distro and
+        architecture.
+    """
+    accumulators = collections.defaultdict(_Accumulator)
+    for record in records:
+        # The records of old stores might not have the index URL.
+        accumulators[(
+            record.index_url or '', record.package, record.distro,
+            record.architecture)].add(record)
+    histories = []
+    for (index_url, package, distro, architecture), accumulator in sorted(
+            accumulators.items()):
+        durations = sorted(accumulator.durations)
+        pass_rate = None
+        if accumulator.known_runs:
+            pass_rate = accumulator.passes / accumulator.known_runs
+        histories.append(TestHistory(
+            index_url=index_url or None, package=package, distro=distro,
+            architecture=architecture,
+            runs=accumulator.runs, passes=accumulator.passes,
+            pass_rate=pass_rate,
+            flips=accumulator.flips,
+            p50_duration=_get_percentile(durations, 50),
+            p95_duration=_get_percentile(durations, 95)))
+    return histories
+
+
+def _get_percentile(sorted_values, percent):
+    """Return the nearest-rank percentile of a sorted list."""
+    if not sorted_values:
+        return None
+    rank = math.ceil(percent / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+class HistoryPrinter():
+    """Print the slowest and flakiest tests of a window to a markdown file."""
+
+    def __init__(
+            self, *, destination_path, first_day, last_day, histories,
+            top=None):
+        """Printer constructor.
+
+        :param str destination_path: The path to the markdown file to print.
+        :param str first_day: The first day of the window, with format
+            yyyymmdd.
+        :param str last_day: The last day of the window, with format
+            yyyymmdd.
+        :param histories: The histories of the tests in the window.
+        :type histories: list of TestHistory.
+        :param int top: The number of tests to print in each section. Default
+            is 10.
+        """
+        self._markdown_file_path = destination_path
+        self._first_day = first_day
+        self._last_day = last_day
+        self._histories = histories
+        if not top:
+            top = _DEFAULT_TOP
+        self._top = top
+
+    def print_report(self):
+        """Print the report to the markdown file."""
+        slowest = sorted(
+            (history for history in self._histories
+             if history.p95_duration is not None),
+            key=lambda history: (
+                -history.p95_duration, history.package, history.distro,
+                history.architecture))
+        flakiest = sorted(
+            (history for history in self._histories if history.flips),
+            key=lambda history: (
+                -history.flips, history.pass_rate, history.package,
+                history.distro, history.architecture))
+        with open(self._markdown_file_path, 'w') as markdown_file:
+            markdown_file.write('# {} - {}\n\n'.format(
+                self._first_day, self._last_day))
+            markdown_file.write('## Slowest tests\n\n')
+            _print_table(slowest[:self._top], markdown_file)
+            markdown_file.write('## Flakiest tests\n\n')
+            _print_table(flakiest[:self._top], markdown_file)
+
+
+def _print_table(histories, markdown_file):
+    if not histories:
+        markdown_file.write('None.\n\n')
+        return
+    markdown_file.write(
+        '| package | distro | architecture | runs | pass rate | flips | p50 '
+        '| p95 |\n'
+        '| --- | --- | --- | ---: | ---: | ---: | ---: | ---: |\n')
+    for history in histories:
+        markdown_file.write(
+            '| {package} | {distro} | {architecture} | {runs} | '
+            '{pass_rate} | {flips} | {p50} | {p95} |\n'.format(
+                package=history.package, distro=history.distro,
+                architecture=history.architecture,
+                runs=history.runs,
+                pass_rate=_format_pass_rate(history.pass_rate),
+                flips=history.flips,
+                p50=_format_duration(history.p50_duration),
+                p95=_format_duration(history.p95_duration)))
+    markdown_file.write('\n')
+
+
+def _format_pass_rate(pass_rate):
+    if pass_rate is None:
+        return '-'
+    return '{:.0%}'.format(pass_rate)
+
+
+def _format_duration(duration):
+    if duration is None:
+        return '-'
+    return '{}s'.format(duration)
@@ -0,0 +1,427 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import base64
+import email
+import http.client
+import itertools
+import random
+import shutil
+import threading
+import time
+from urllib import (
+    error,
+    parse,
+    request
+)
+
+from autopkgtest_results_formatter import errors
+
+
+_DEFAULT_MAX_CONNECTIONS_PER_HOST = 8
+_DEFAULT_TIMEOUT = 60
+_DEFAULT_RETRIES = 3
+_DEFAULT_BACKOFF = 1
+_DEFAULT_CIRCUIT_BREAKER_THRESHOLD = 5
+_DEFAULT_CIRCUIT_BREAKER_COOLDOWN = 60
+_MAX_REDIRECTS = 5
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client():
+    """Return the HTTP client shared by the objects that don't get one."""
+    global _default_client
+    with _default_client_lock:
+        if not _default_client:
+            _default_client = HTTPClient()
+        return _default_client
+
+
+class Response():
+    """The response to a request made with the HTTPClient.
+
+    It must be closed, or used as a context manager, to release the
+    connection.
+    """
+
+    def __init__(self, *, url, status, headers, body, release=None):
+        """Response constructor.
+
+        :param str url: The URL of the response, after the redirects.
+        :param int status: The HTTP status code.
+        :param headers: The headers of the response.
+        :type headers: email.message.Message
+        :param body: A file object with the body of the response.
+        :param release: The function to call when the response is closed,
+            with a bool argument that is True if the body was read completely.
+        """
+        super().__init__()
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self._body = body
+        self._release = release
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, size=-1):
+        """Read up to size bytes of the body, or all of it by default.
+
+        :raises errors.DownloadError: If the body could not be read.
+        """
+        try:
+            if size is None or size < 0:
+                return self._body.read()
+            return self._body.read(size)
+        except (http.client.HTTPException, OSError) as e:
+            raise errors.DownloadError(url=self.url, reason=e)
+
+    def close(self):
+        if self._release:
+            release = self._release
+            self._release = None
+            release(self._body.isclosed())
+        else:
+            self._body.close()
+
+
+class HTTPClient():
+    """An HTTP client that keeps its connections open to reuse them.
+
+    A pool with a maximum number of connections is kept for each host, so the
+    requests to the same host don't have to open a new TCP and TLS connection.
+    It can be shared by multiple threads. URLs of other schemes, like file,
+    are opened with urllib.
+
+    The proxies of the http_proxy, https_proxy and no_proxy environment
+    variables are used, like urllib does. The connections to https URLs go
+    through a tunnel in the proxy.
+
+    The failed requests are retried, waiting an exponential time with random
+    jitter between them. When a host fails too many times in a row, the
+    requests to it fail immediately for a while.
+    """
+
+    def __init__(
+            self, *, max_connections_per_host=None, timeout=None,
+            retries=None, backoff=None, circuit_breaker_threshold=None,
+            circuit_breaker_cooldown=None):
+        """HTTPClient constructor.
+
+        :param int max_connections_per_host: The maximum number of connections
+            open at the same time to a host. The requests wait until a
+            connection is available. Default is 8.
+        :param float timeout: The timeout for the socket operations, in
+            seconds. Default is 60.
+        :param int retries: The number of times to retry a failed request.
+            Default is 3.
+        :param float backoff: The maximum time to wait before the first retry,
+            in seconds. It is doubled for every retry. Default is 1.
+        :param int circuit_breaker_threshold: The number of failures in a row
+            of a host after which the requests to it are not sent. Default
+            is 5.
+        :param float circuit_breaker_cooldown: The time to wait before sending
+            requests again to a failing host, in seconds. Default is 60.
+        """
+        super().__init__()
+        if not max_connections_per_host:
+            max_connections_per_host = _DEFAULT_MAX_CONNECTIONS_PER_HOST
+        self._max_connections_per_host = max_connections_per_host
+        if not timeout:
+            timeout = _DEFAULT_TIMEOUT
+        self._timeout = timeout
+        if retries is None:
+            retries = _DEFAULT_RETRIES
+        self._retries = retries
+        if backoff is None:
+            backoff = _DEFAULT_BACKOFF
+        self._backoff = backoff
+        if not circuit_breaker_threshold:
+            circuit_breaker_threshold = _DEFAULT_CIRCUIT_BREAKER_THRESHOLD
+        self._circuit_breaker_threshold = circuit_breaker_threshold
+        if circuit_breaker_cooldown is None:
+            circuit_breaker_cooldown = _DEFAULT_CIRCUIT_BREAKER_COOLDOWN
+        self._circuit_breaker_cooldown = circuit_breaker_cooldown
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def open(self, url, *, headers=None):
+        """Send a GET request.
+
+        The redirects are followed, and the server errors are retried. The
+        client error statuses are returned in the response, not raised.
+
+        :param str url: The URL to request.
+        :param dict headers: The headers of the request.
+        :rtype: Response
+        :raises errors.DownloadError: If the request could not be sent, or if
+            the server kept returning errors.
+        """
+        return self._retry(lambda: self._open_once(url, headers or {}))
+
+    def retrieve(self, url, file_path):
+        """Download a file.
+
+        The download is retried if it fails.
+
+        :param str url: The URL of the file.
+        :param str file_path: The path to the local file to write.
+        :raises errors.DownloadError: If the download failed.
+        """
+        self._retry(lambda: self._retrieve_once(url, file_path))
+
+    def _retry(self, function):
+        for attempt in itertools.count():
+            try:
+                return function()
+            except errors.HostUnavailableError:
+                raise
+            except errors.DownloadStatusError as e:
+                if (e.status not in _RETRY_STATUSES or
+                        attempt >= self._retries):
+                    raise
+            except errors.DownloadError:
+                if attempt >= self._retries:
+                    raise
+            # Wait a random time up to the exponential backoff, so the
+            # requests that failed together are not retried together.
+            time.sleep(random.uniform(0, self._backoff * 2 ** attempt))
+
+    def _open_once(self, url, headers):
+        for _ in range(_MAX_REDIRECTS + 1):
+            response = self._open(url, headers)
+            if response.status in _RETRY_STATUSES:
+                response.close()
+                raise errors.DownloadStatusError(
+                    url=url, status=response.status)
+            if response.status not in _REDIRECT_STATUSES:
+                return response
+            with response:
+                url = parse.urljoin(url, response.headers['Location'])
+        raise errors.DownloadError(url=url, reason='too many redirects')
+
+    def _retrieve_once(self, url, file_path):
+        with self._open_once(url, {}) as response:
+            if response.status != 200:
+                raise errors.DownloadStatusError(
+                    url=url, status=response.status)
+            with open(file_path, 'wb') as file_:
+                shutil.copyfileobj(response, file_)
+
+    def close(self):
+        """Close the idle connections."""
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
+
+    def _open(self, url, headers):
+        parsed_url = parse.urlsplit(url)
+        if parsed_url.scheme not in ('http', 'https'):
+            return self._open_with_urllib(url, headers)
+        proxy = _get_proxy(parsed_url)
+        if proxy and proxy.scheme != 'http':
+            # The pools only connect to proxies with plain HTTP.
+            return self._open_with_urllib(url, headers)
+        pool = self._get_pool(parsed_url.scheme, parsed_url.netloc, proxy)
+        pool.check_available(url)
+        path, headers = pool.get_request(parsed_url, headers)
+        connection, reused = pool.acquire()
+        try:
+            try:
+                http_response = _request(connection, path, headers)
+            except (http.client.RemoteDisconnected, ConnectionError):
+                if not reused:
+                    raise
+                # The server closed the idle connection, try a new one.
+                connection.close()
+                http_response = _request(connection, path, headers)
+        except (http.client.HTTPException, OSError) as e:
+            pool.release(connection, reusable=False)
+            pool.record_result(success=False)
+            raise errors.DownloadError(url=url, reason=e)
+        pool.record_result(success=http_response.status < 500)
+
+        def _release(read_completely):
+            if not read_completely and http_response.length == 0:
+                # Responses without body, like 304, are read completely.
+                http_response.read()
+                read_completely = True
+            reusable = read_completely and not http_response.will_close
+            if not reusable:
+                http_response.close()
+            pool.release(connection, reusable=reusable)
+
+        return Response(
+            url=url, status=http_response.status, headers=http_response.msg,
+            body=http_response, release=_release)
+
+    def _open_with_urllib(self, url, headers):
+        try:
+            response = request.urlopen(
+                request.Request(url, headers=headers), timeout=self._timeout)
+        except error.HTTPError as e:
+            return Response(
+                url=url, status=e.code, headers=e.headers, body=e)
+        except error.URLError as e:
+            raise errors.DownloadError(url=url, reason=e.reason)
+        response_headers = response.info() or email.message.Message()
+        return Response(
+            url=url, status=response.getcode() or 200,
+            headers=response_headers, body=_URLLibBody(response))
+
+    def _get_pool(self, scheme, netloc, proxy):
+        with self._lock:
+            key = (scheme, netloc, proxy)
+            if key not in self._pools:
+                self._pools[key] = _HostPool(
+                    scheme=scheme, netloc=netloc, proxy=proxy,
+                    max_connections=self._max_connections_per_host,
+                    timeout=self._timeout,
+                    circuit_breaker_threshold=(
+                        self._circuit_breaker_threshold),
+                    circuit_breaker_cooldown=self._circuit_breaker_cooldown)
+            return self._pools[key]
+
+
+def _get_proxy(parsed_url):
+    """Return the proxy of a URL, split, or None to connect directly."""
+    proxy = request.getproxies().get(parsed_url.scheme)
+    if not proxy or request.proxy_bypass(parsed_url.netloc):
+        return None
+    if '://' not in proxy:
+        proxy = 'http://{}'.format(proxy)
+    return parse.urlsplit(proxy)
+
+
+def _request(connection, path, headers):
+    connection.request('GET', path, headers=headers)
+    return connection.getresponse()
+
+
+class _URLLibBody():
+
+    def __init__(self, response):
+        self._response = response
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self._response.read()
+        return self._response.read(size)
+
+    def isclosed(self):
+        return True
+
+    def close(self):
+        self._response.close()
+
+
+class _HostPool():
+
+    def __init__(
+            self, *, scheme, netloc, max_connections, timeout,
+            circuit_breaker_threshold, circuit_breaker_cooldown,
+            proxy=None):
+        if scheme == 'https':
+            self._connection_class = http.client.HTTPSConnection
+        else:
+            self._connection_class = http.client.HTTPConnection
+        self._scheme = scheme
+        self._netloc = netloc
+        self._proxy = proxy
+        self._proxy_headers = {}
+        if proxy and proxy.username:
+            credentials = '{}:{}'.format(
+                parse.unquote(proxy.username),
+                parse.unquote(proxy.password or ''))
+            self._proxy_headers['Proxy-Authorization'] = 'Basic {}'.format(
+                base64.b64encode(credentials.encode()).decode())
+        self._timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(max_connections)
+        self._idle_connections = []
+        self._circuit_breaker_threshold = circuit_breaker_threshold
+        self._circuit_breaker_cooldown = circuit_breaker_cooldown
+        self._failures = 0
+        self._unavailable_until = 0
+        self._lock = threading.Lock()
+
+    def check_available(self, url):
+        """Raise an error if the host failed too many times in a row."""
+        with self._lock:
+            if (self._failures >= self._circuit_breaker_threshold and
+                    time.monotonic() < self._unavailable_until):
+                raise errors.HostUnavailableError(
+                    url=url, host=self._netloc, failures=self._failures)
+
+    def record_result(self, *, success):
+        with self._lock:
+            if success:
+                self._failures = 0
+                return
+            self._failures += 1
+            if self._failures >= self._circuit_breaker_threshold:
+                self._unavailable_until = (
+                    time.monotonic() + self._circuit_breaker_cooldown)
+
+    def get_request(self, parsed_url, headers):
+        """Return the target and the headers of the request of a URL."""
+        path = parse.urlunsplit(
+            ('', '', parsed_url.path or '/', parsed_url.query, ''))
+        if not self._proxy or self._scheme == 'https':
+            return path, headers
+        # The requests sent to the proxy have the absolute URL.
+        headers = dict(headers)
+        headers.update(self._proxy_headers)
+        return parse.urlunsplit(
+            (self._scheme, self._netloc, path, '', '')), headers
+
+    def acquire(self):
+        """Return an open connection, and True if it was used before."""
+        self._semaphore.acquire()
+        with self._lock:
+            if self._idle_connections:
+                return self._idle_connections.pop(), True
+        if not self._proxy:
+            return self._connection_class(
+                self._netloc, timeout=self._timeout), False
+        connection = self._connection_class(
+            self._proxy.netloc.rpartition('@')[2], timeout=self._timeout)
+        if self._scheme == 'https':
+            connection.set_tunnel(self._netloc, headers=self._proxy_headers)
+        return connection, False
+
+    def release(self, connection, *, reusable):
+        if reusable:
+            with self._lock:
+                self._idle_connections.append(connection)
+        else:
+            connection.close()
+        self._semaphore.release()
+
+    def close(self):
+        with self._lock:
+            connections = self._idle_connections
+            self._idle_connections = []
+        for connection in connections:
+            connection.close()
@@ -0,0 +1,98 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+from autopkgtest_results_formatter import markdown_printer
+
+
+class JSONLWriter():
+    """Write result entries to a JSON Lines file, one object per entry.
+
+    The objects have the same information as the markdown reports: the
+    identifier, day, distro and architecture of the entry, and the version,
+    result, duration and links of the execution. The entries that could not
+    be downloaded have an error instead of the execution.
+
+    The entries are written in the order they are received, and the file is
+    flushed after every entry. It must be used as a context manager.
+    """
+
+    def __init__(self, *, destination_path, append=False):
+        """Writer constructor.
+
+        :param str destination_path: The path to the JSON Lines file.
+        :param bool append: If True, add the entries to the end of the
+            existing file. Otherwise, replace it. When an entry appears
+            more than once, the last object is the current one. The failed
+            entries are not appended, because they are retried later, and
+            appended when they are downloaded.
+        """
+        self._jsonl_file_path = destination_path
+        self._append = append
+        self._jsonl_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._jsonl_file:
+            self._jsonl_file.close()
+            self._jsonl_file = None
+
+    def write_result(self, entry):
+        """Write an entry with its result.
+
+        :param entry: The entry, with its result already fetched.
+        :type entry: result_entry.ResultEntry
+        """
+        self._write(entry, markdown_printer.parse_entry(entry))
+
+    def write_failure(self, entry, error):
+        """Write an entry that could not be downloaded.
+
+        :param entry: The entry that failed.
+        :type entry: result_entry.ResultEntry
+        :param errors.DownloadError error: The error of the download.
+        """
+        if self._append:
+            return
+        self._write(entry, markdown_printer.parse_failed_entry(entry, error))
+
+    def skip(self, entry):
+        """Don't write an entry.
+
+        It is here to have the same interface as the markdown writer.
+        """
+
+    def _write(self, entry, parsed_entry):
+        if not self._jsonl_file:
+            self._jsonl_file = open(
+                self._jsonl_file_path, 'a' if self._append else 'w')
+        record = {
+            'identifier': entry.identifier,
+            'day': entry.day,
+            'distro': entry.distro,
+            'architecture': entry.architecture
+        }
+        record.update(parsed_entry)
+        record['links'] = dict(parsed_entry['links'])
+        self._jsonl_file.write(json.dumps(record, sort_keys=True))
+        self._jsonl_file.write('\n')
+        self._jsonl_file.flush()
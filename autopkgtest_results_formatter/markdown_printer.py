@@ -14,68 +14,211 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+
+from autopkgtest_results_formatter import run_metrics
+
 
 class MarkdownPrinter():
     """Print result entries to a markdown file."""
 
-    def __init__(self, *, destination_path, result_entries):
+    def __init__(
+            self, *, destination_path, result_entries, failed_entries=(),
+            metrics=None):
         """Printer constructor.
 
         :parm str destination_path: The path to the markdown file to print.
         :param result_entries: The result entries to print.
         :type result_etries: List of result_entry.ResultEntry objects.
+        :param failed_entries: The result entries that could not be
+            downloaded, with the error.
+        :type failed_entries: List of tuples (result_entry.ResultEntry,
+            errors.DownloadError).
+        :param metrics: The metrics of the run, where the writes are
+            measured. Default is the metrics shared by all the objects.
+        :type metrics: run_metrics.Metrics
         """
         self._markdown_file_path = destination_path
         self._result_entries = result_entries
+        self._failed_entries = failed_entries
+        self._metrics = metrics
 
     def print_results(self):
         """Print the result entries to the markdown file."""
-        parsed_dictionary = self._parse()
-        if not parsed_dictionary:
-            return
-        with open(self._markdown_file_path, 'w') as markdown_file:
-            for day in parsed_dictionary:
-                markdown_file.write('# {}\n\n'.format(day))
-                for distro in parsed_dictionary[day]:
-                    markdown_file.write('## {}\n\n'.format(distro))
-                    for arch in parsed_dictionary[day][distro]:
-                        markdown_file.write('### {}\n\n'.format(arch))
-                        for entry_id in parsed_dictionary[day][distro][arch]:
-                            self._print_result(
-                                parsed_dictionary[day][distro][arch][entry_id],
-                                markdown_file
-                            )
-
-    def _parse(self):
-        parsed_dictionary = {}
-        for entry in self._result_entries:
-            day = entry.day
-            if day not in parsed_dictionary:
-                parsed_dictionary[day] = {}
-            distro = entry.distro
-            if distro not in parsed_dictionary[day]:
-                parsed_dictionary[day][distro] = {}
-            architecture = entry.architecture
-            if architecture not in parsed_dictionary[day][distro]:
-                parsed_dictionary[day][distro][architecture] = {}
-            parsed_dictionary[day][distro][architecture].update({
-                entry.identifier: {
-                    'version': entry.get_test_package(),
-                    'result': entry.is_success(),
-                    'duration': entry.get_duration(),
-                    'links': entry.get_links()
-                }
-            })
-        return parsed_dictionary
-
-    def _print_result(self, entry, markdown_file):
+        entries = list(self._result_entries) + [
+            entry for entry, _ in self._failed_entries]
+        with MarkdownWriter(
+                destination_path=self._markdown_file_path,
+                entries=entries, metrics=self._metrics) as writer:
+            for entry in self._result_entries:
+                writer.write_result(entry)
+            for entry, error in self._failed_entries:
+                writer.write_failure(entry, error)
+
+
+class MarkdownWriter():
+    """Write result entries to a markdown file as soon as they are ready.
+
+    The entries are written grouped by day, distro and architecture. The
+    groups are in the order of their first entries, so the distros and the
+    architectures are in the order of the indexes, like the entries of each
+    group. An entry that is ready before the entries that go before it
+    is kept until they are ready too, so only the entries that arrive out of
+    order are kept in memory. The file is flushed after every write, so if the
+    run is interrupted it has all the entries written until then.
+
+    The file is not written if no entry is written. It must be used as a
+    context manager.
+    """
+
+    def __init__(self, *, destination_path, entries, metrics=None):
+        """Writer constructor.
+
+        :param str destination_path: The path to the markdown file to write.
+        :param entries: All the entries that will be written or skipped, in
+            the order of the indexes.
+        :type entries: List of result_entry.ResultEntry objects.
+        :param metrics: The metrics of the run, where the writes are
+            measured. Default is the metrics shared by all the objects.
+        :type metrics: run_metrics.Metrics
+        """
+        self._markdown_file_path = destination_path
+        self._order = _get_order(entries)
+        self._next = 0
+        self._ready = {}
+        self._markdown_file = None
+        self._headers = (None, None, None)
+        if not metrics:
+            metrics = run_metrics.get_default_metrics()
+        self._metrics = metrics
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._markdown_file:
+            self._markdown_file.close()
+            self._markdown_file = None
+
+    def write_result(self, entry):
+        """Write an entry with its result.
+
+        :param entry: The entry, with its result already fetched.
+        :type entry: result_entry.ResultEntry
+        """
+        self._add(entry.url, (_get_headers(entry), parse_entry(entry)))
+
+    def write_failure(self, entry, error):
+        """Write an entry that could not be downloaded.
+
+        :param entry: The entry that failed.
+        :type entry: result_entry.ResultEntry
+        :param errors.DownloadError error: The error of the download.
+        """
+        self._add(
+            entry.url,
+            (_get_headers(entry), parse_failed_entry(entry, error)))
+
+    def skip(self, entry):
+        """Don't write an entry, so the entries after it are not kept waiting.
+
+        :param entry: The entry to skip.
+        :type entry: result_entry.ResultEntry
+        """
+        self._add(entry.url, None)
+
+    def _add(self, url, item):
+        self._ready[url] = item
+        with self._metrics.time('markdown_write'):
+            while (self._next < len(self._order) and
+                   self._order[self._next] in self._ready):
+                item = self._ready.pop(self._order[self._next])
+                self._next += 1
+                if item:
+                    self._write(*item)
+                    self._metrics.count('markdown_entries')
+            if self._markdown_file:
+                self._markdown_file.flush()
+
+    def _write(self, headers, parsed_entry):
+        if not self._markdown_file:
+            self._markdown_file = open(self._markdown_file_path, 'w')
+        changed = False
+        for level, header in enumerate(headers):
+            # A new day or distro starts all the sections below it again.
+            if changed or header != self._headers[level]:
+                changed = True
+                self._markdown_file.write(
+                    '{} {}\n\n'.format('#' * (level + 1), header))
+        self._headers = headers
+        _print_result(parsed_entry, self._markdown_file)
+
+
+def _get_order(entries):
+    """Return the URLs of the entries in the order to write them."""
+    groups = collections.OrderedDict()
+    for entry in entries:
+        groups.setdefault(
+            entry.day, collections.OrderedDict()).setdefault(
+                entry.distro, collections.OrderedDict()).setdefault(
+                    entry.architecture, []).append(entry.url)
+    return [
+        url for distros in groups.values()
+        for architectures in distros.values()
+        for urls in architectures.values()
+        for url in urls]
+
+
+def _get_headers(entry):
+    return (entry.day, entry.distro, entry.architecture)
+
+
+def parse_entry(entry):
+    """Return a dictionary with the information of an entry to report.
+
+    :param entry: The entry, with its result already fetched.
+    :type entry: result_entry.ResultEntry
+    """
+    return {
+        'version': entry.get_test_package(),
+        'result': entry.is_success(),
+        'duration': entry.get_duration(),
+        'links': entry.get_links()
+    }
+
+
+def parse_failed_entry(entry, error):
+    """Return a dictionary with the information of a failed entry to report.
+
+    :param entry: The entry that could not be downloaded.
+    :type entry: result_entry.ResultEntry
+    :param errors.DownloadError error: The error of the download.
+    """
+    return {
+        'error': str(error),
+        'links': entry.get_links()
+    }
+
+
+def _print_result(entry, markdown_file):
+    if 'error' in entry:
         markdown_file.write(
-            '{}\n\n'.format(entry['version']))
-        if entry['result']:
-            markdown_file.write(':white_check_mark: passed ')
-        else:
-            markdown_file.write(':x: failed ')
-        markdown_file.write('in {}s\n\n'.format(entry['duration']))
-        markdown_file.write(' | '.join(
-            ['[{}]({})'.format(name, url) for name, url in entry['links']]))
-        markdown_file.write('\n\n')
+            ':warning: {}\n\n'.format(entry['error']))
+    else:
+        _print_execution(entry, markdown_file)
+    markdown_file.write(' | '.join(
+        ['[{}]({})'.format(name, url) for name, url in entry['links']]))
+    markdown_file.write('\n\n')
+
+
+def _print_execution(entry, markdown_file):
+    markdown_file.write(
+        '{}\n\n'.format(entry['version']))
+    if entry['result']:
+        markdown_file.write(':white_check_mark: passed ')
+    else:
+        markdown_file.write(':x: failed ')
+    markdown_file.write('in {}s\n\n'.format(entry['duration']))
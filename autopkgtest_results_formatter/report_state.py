@@ -0,0 +1,88 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+
+from autopkgtest_results_formatter import result_entry
+
+
+# The version of the format of the state file. It has to be increased when
+# the fields of the records change, so the old files are not restored.
+_STATE_VERSION = 1
+
+
+class ReportState():
+    """The result entries already processed for a report.
+
+    It is saved to a JSON file with the record of every entry, so the next
+    run only has to download the entries that appeared after this one. A
+    state file that can't be read, or that was saved with a different format,
+    is ignored, and all the entries are processed again.
+    """
+
+    def __init__(self, *, path):
+        """ReportState constructor.
+
+        :param str path: The path to the state file. If it exists, the state
+            saved by the previous run is loaded.
+        """
+        super().__init__()
+        self._path = path
+        self._records = {}
+        try:
+            with open(self._path) as state_file:
+                state = json.load(state_file)
+            if state.get('version') != _STATE_VERSION:
+                return
+            records = {
+                url: result_entry.ResultRecord(*fields)
+                for url, fields in state['records'].items()}
+        except (FileNotFoundError, ValueError, KeyError, TypeError,
+                AttributeError):
+            return
+        self._records = records
+
+    def restore(self, entry):
+        """Restore the record of an entry processed by a previous run.
+
+        :param entry: The entry to restore.
+        :type entry: result_entry.ResultEntry
+        :return: True if the entry was processed by a previous run,
+            otherwise, False.
+        """
+        record = self._records.get(entry.url)
+        if record is None:
+            return False
+        entry.restore_record(record)
+        return True
+
+    def add(self, entry):
+        """Add a processed entry to the state.
+
+        :param entry: The entry, with its result already fetched.
+        :type entry: result_entry.ResultEntry
+        """
+        self._records[entry.url] = entry.record
+
+    def save(self):
+        """Save the state to the file."""
+        temp_path = '{}.tmp'.format(self._path)
+        with open(temp_path, 'w') as state_file:
+            json.dump(
+                {'version': _STATE_VERSION, 'records': self._records},
+                state_file)
+        os.replace(temp_path, self._path)
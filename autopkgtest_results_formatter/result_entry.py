@@ -14,35 +14,94 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import contextlib
+import io
 import json
 import os
-import shutil
 import tarfile
 import tempfile
-from urllib import request
+
+from autopkgtest_results_formatter import (
+    errors,
+    http_client,
+    run_metrics
+)
+
+
+# The files of the result archive used by the entry.
+_RESULT_MEMBERS = ('testinfo.json', 'testpkg-version', 'exitcode', 'duration')
+# The number of bytes at the beginning of the result archive requested to
+# find out if it is of a pull request.
+_PULL_REQUEST_PROBE_SIZE = 64 * 1024
+
+
+class ResultRecord(collections.namedtuple(
+        'ResultRecord',
+        ['test_package', 'exitcode', 'duration', 'pull_request'])):
+    """The information of a result entry read from its result archive.
+
+    It is immutable. The fields are None when the archive does not have the
+    file with the information. For pull requests, that are not reported, only
+    the pull_request field is guaranteed to be set.
+    """
+
+    __slots__ = ()
+
+
+_DirectoryInfo = collections.namedtuple(
+    '_DirectoryInfo',
+    ['distro', 'architecture', 'package', 'day', 'identifier'])
 
 
 class ResultEntry():
     """A result entry in the autopkgtest results index.
 
-    It should be used as a context manager, otherwise the caller has to call
-    the `cleanup` method.
+    It doesn't allocate any resources until its result is downloaded to a
+    file. It should be used as a context manager, otherwise the caller has to
+    call the `cleanup` method to remove that file.
     """
 
-    def __init__(self, *, index_url, directory):
+    def __init__(
+            self, *, index_url, directory, cache=None, client=None,
+            scratch_path=None, metrics=None, decode=None):
         """ResultEntry constructor.
 
         :param str index_url: The URL to the results index.
         :param str directory: The directory of this result entry.
+        :param cache: The cache of result archives. If None, the result is
+            always downloaded, and it is read while it is being downloaded.
+        :type cache: results_cache.ResultsCache
+        :param client: The HTTP client to download the result. Default is the
+            client shared by all the objects.
+        :type client: http_client.HTTPClient
+        :param str scratch_path: The path to the directory where the result
+            is downloaded before it is moved to the cache. Default is the
+            system temporary directory.
+        :param metrics: The metrics of the run, where the downloads are
+            measured. Default is the metrics shared by all the objects.
+        :type metrics: run_metrics.Metrics
+        :param decode: The function that reads the record from the contents
+            of the complete result archive, for example, one that runs
+            `parse_result` in a pool of processes. If None, the archive is
+            read in the calling thread, and without cache it is read while it
+            is being downloaded.
+        :type decode: function that takes bytes and returns a ResultRecord.
         """
         self._index_url = index_url
         self._directory = directory
-        self._temp_dir = tempfile.mkdtemp()
-        self._result_dir_path = None
-        self._distro = None
-        self._architecture = None
-        self._day = None
-        self._identifier = None
+        self._cache = cache
+        if not client:
+            client = http_client.get_default_client()
+        self._client = client
+        self._scratch_path = scratch_path
+        if not metrics:
+            metrics = run_metrics.get_default_metrics()
+        self._metrics = metrics
+        self._decode = decode
+        self._result_file_path = None
+        self._record = None
+        self._directory_info = None
 
     def __eq__(self, other):
         return (
@@ -56,95 +115,256 @@ class ResultEntry():
         self.cleanup()
 
     def cleanup(self):
-        request.urlcleanup()
-        if self._temp_dir:
-            shutil.rmtree(self._temp_dir)
-            self._temp_dir = None
+        if self._result_file_path:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._result_file_path)
+            self._result_file_path = None
+
+    @property
+    def index_url(self):
+        """The URL of the results index of this entry."""
+        return self._index_url
+
+    @property
+    def url(self):
+        """The URL of the directory of this result entry."""
+        return '{index}/{directory}'.format(
+            index=self._index_url, directory=self._directory)
 
     @property
     def distro(self):
-        if not self._distro:
-            return self._get_info_from_directory()[0]
-        return self._distro
+        return self._get_directory_info().distro
 
     @property
     def architecture(self):
-        if not self._architecture:
-            return self._get_info_from_directory()[1]
-        return self._architecture
+        return self._get_directory_info().architecture
+
+    @property
+    def package(self):
+        """The name of the source package tested."""
+        return self._get_directory_info().package
 
     @property
     def day(self):
-        if not self._day:
-            return self._get_info_from_directory()[2]
-        return self._day
+        return self._get_directory_info().day
 
     @property
     def identifier(self):
-        if not self._identifier:
-            return self._get_info_from_directory()[3]
-        return self._identifier
-
-    def _get_info_from_directory(self):
-        dir_parts = self._directory.split('/')[-5:]
-        self._distro, self._architecture, _, _, day_time_id = dir_parts
-        self._day, time, identifier = day_time_id.split('_')
-        self._identifier = (
-            self._distro + self._architecture + self._day + time +
-            identifier.rstrip('@'))
-        return (self._distro, self._architecture, self._day, self._identifier)
+        return self._get_directory_info().identifier
 
-    def is_pull_request(self):
-        """Return True if this entry is a pull request, otherwise, False."""
-        test_info = self._get_test_info()
-        return (
-            'custom_environment' in test_info and
-            [x for x in test_info['custom_environment'] if
-             x.startswith('UPSTREAM_PULL_REQUEST=')] != [])
+    def _get_directory_info(self):
+        if self._directory_info is None:
+            dir_parts = self._directory.split('/')[-5:]
+            distro, architecture, _, package, day_time_id = dir_parts
+            day, time, identifier = day_time_id.split('_')
+            self._directory_info = _DirectoryInfo(
+                distro, architecture, package, day,
+                distro + architecture + day + time + identifier.rstrip('@'))
+        return self._directory_info
+
+    @property
+    def record(self):
+        """The information read from the result archive of this entry.
+
+        The archive is downloaded and read only the first time.
 
-    def _get_test_info(self):
-        result_dir_path = self._get_result()
-        with open(os.path.join(result_dir_path, 'testinfo.json')) as test_info:
-            return json.load(test_info)
+        :rtype: ResultRecord
+        """
+        self._load_record()
+        return self._record
+
+    def _load_record(self):
+        if self._record is None:
+            with self._reading_result():
+                self._record = self._read_record()
+            self._save_pull_request(self._record.pull_request)
 
-    def _get_result(self):
-        if not self._result_dir_path:
+    def _read_record(self):
+        if self._decode:
+            result_data = self._read_result()
+            with self._metrics.time('result_extraction'):
+                return self._decode(result_data)
+        elif self._cache:
             result_tar_path = self._download_result()
-            self._result_dir_path = tempfile.mkdtemp(dir=self._temp_dir)
-            result_tar = tarfile.TarFile(result_tar_path)
-            result_tar.extractall(self._result_dir_path)
-        return self._result_dir_path
+            try:
+                with self._metrics.time('result_extraction'):
+                    with tarfile.open(result_tar_path) as result_tar:
+                        return _make_record(_read_result_members(result_tar))
+            finally:
+                self._release_result(result_tar_path)
+        else:
+            # The archive is extracted while it is downloaded, so the
+            # extraction is part of the download time.
+            with self._metrics.time('result_download'):
+                return _make_record(self._stream_result())
+
+    @contextlib.contextmanager
+    def _reading_result(self):
+        """Raise the errors of an invalid archive as ResultReadError."""
+        try:
+            yield
+        except (tarfile.TarError, EOFError, ValueError) as e:
+            raise errors.ResultReadError(
+                url=self._get_result_url(),
+                reason=str(e) or type(e).__name__) from e
+
+    def restore_record(self, record):
+        """Set the information of this entry, read by a previous run.
+
+        The result archive will not be downloaded.
+
+        :param ResultRecord record: The information of this entry.
+        """
+        self._record = record
+
+    def fetch(self):
+        """Download and read the result of this entry, if needed.
+
+        The other methods fetch the result on demand, this one can be used to
+        do it in advance, for example, from a worker thread.
+        """
+        self._load_record()
+
+    def is_pull_request(self):
+        """Return True if this entry is a pull request, otherwise, False.
+
+        The status is taken from the cache, or read from the beginning of the
+        result archive. The complete archive is only downloaded if the status
+        is not there, or if the entry is not a pull request.
+        """
+        if self._record is None:
+            self._probe_pull_request()
+        return self.record.pull_request
+
+    def _probe_pull_request(self):
+        url = self._get_result_url()
+        if self._cache:
+            pull_request = self._cache.get_pull_request(url)
+            if pull_request is not None:
+                if pull_request:
+                    self._record = ResultRecord(
+                        test_package=None, exitcode=None, duration=None,
+                        pull_request=True)
+                return
+        members, complete = self._read_result_prefix()
+        if 'testinfo.json' not in members:
+            return
+        with self._reading_result():
+            record = _make_record(members)
+        if record.pull_request or complete:
+            self._record = record
+        self._save_pull_request(record.pull_request)
+
+    def _read_result_prefix(self):
+        """Read the members at the beginning of the result archive.
+
+        :return: A tuple with the dictionary of members read, and True if the
+            complete archive was read.
+        """
+        url = self._get_result_url()
+        headers = {
+            'Range': 'bytes=0-{}'.format(_PULL_REQUEST_PROBE_SIZE - 1)}
+        with self._metrics.time('result_probe'), self._client.open(
+                url, headers=headers) as response:
+            if response.status not in (200, 206):
+                raise errors.DownloadStatusError(
+                    url=url, status=response.status)
+            prefix = response.read(_PULL_REQUEST_PROBE_SIZE)
+        self._metrics.count('result_bytes', len(prefix))
+        members = {}
+        try:
+            with tarfile.open(
+                    fileobj=io.BytesIO(prefix), mode='r|') as result_tar:
+                for name, contents in _iter_result_members(result_tar):
+                    members[name] = contents
+        except (tarfile.TarError, EOFError):
+            # The prefix ends in the middle of a member.
+            pass
+        return members, len(prefix) < _PULL_REQUEST_PROBE_SIZE
+
+    def _save_pull_request(self, pull_request):
+        if self._cache:
+            self._cache.save_pull_request(
+                self._get_result_url(), pull_request)
+
+    def _stream_result(self):
+        """Read the result archive directly from the download.
+
+        The download stops as soon as all the files needed have been read.
+        """
+        url = self._get_result_url()
+        with self._client.open(url) as response:
+            if response.status != 200:
+                raise errors.DownloadStatusError(
+                    url=url, status=response.status)
+            counting_response = _CountingReader(response)
+            try:
+                with tarfile.open(
+                        fileobj=counting_response, mode='r|') as result_tar:
+                    return _read_result_members(result_tar)
+            finally:
+                self._metrics.count(
+                    'result_bytes', counting_response.bytes_read)
+
+    def _read_result(self):
+        """Return the contents of the complete result archive."""
+        result_tar_path = self._download_result()
+        try:
+            with open(result_tar_path, 'rb') as result_file:
+                return result_file.read()
+        finally:
+            # The contents are in memory, the downloaded file is not needed.
+            self._release_result(result_tar_path)
+
+    def _get_result_url(self):
+        return '{}/result.tar'.format(self.url)
 
     def _download_result(self):
-        result_file_path = os.path.join(self._temp_dir, 'result.tar')
-        request.urlretrieve(
-            '{index}/{directory}/result.tar'.format(
-                index=self._index_url, directory=self._directory),
-            filename=result_file_path)
+        """Return the path to the result archive, downloading it if needed.
+
+        The archive in the cache is pinned until it is released with
+        `_release_result`.
+        """
+        url = self._get_result_url()
+        if self._cache:
+            cached_file_path = self._cache.get(url)
+            if cached_file_path:
+                return cached_file_path
+        temp_fd, result_file_path = tempfile.mkstemp(
+            suffix='.tar', dir=self._scratch_path)
+        os.close(temp_fd)
+        try:
+            with self._metrics.time('result_download'):
+                self._client.retrieve(url, result_file_path)
+        except Exception:
+            os.remove(result_file_path)
+            raise
+        self._metrics.count(
+            'result_bytes', os.path.getsize(result_file_path))
+        if self._cache:
+            return self._cache.add(url, result_file_path)
+        self.cleanup()
+        self._result_file_path = result_file_path
         return result_file_path
 
+    def _release_result(self, result_tar_path):
+        """Release the result archive returned by `_download_result`."""
+        if self._cache:
+            self._cache.release(result_tar_path)
+        else:
+            self.cleanup()
+
     def get_test_package(self):
         """Return the package name and version used for this test."""
-        result_dir_path = self._get_result()
-        with open(os.path.join(
-                result_dir_path, 'testpkg-version')) as testpkg_version:
-            return testpkg_version.read().strip()
+        return self.record.test_package
 
     def is_success(self):
         """Return True if this entry is exited with 0, otherwise, False."""
-        return self._get_exitcode().strip() == '0'
-
-    def _get_exitcode(self):
-        result_dir_path = self._get_result()
-        with open(os.path.join(result_dir_path, 'exitcode')) as exitcode:
-            return exitcode.read()
+        return self.record.exitcode == '0'
 
     def get_duration(self):
         """Return the duration of the test execution."""
-        result_dir_path = self._get_result()
-        with open(os.path.join(
-                result_dir_path, 'duration')) as duration:
-            return duration.read().strip()
+        return self.record.duration
 
     def get_links(self):
         """Return the execution output as a list of tuples (name, url)."""
@@ -155,3 +375,60 @@ class ResultEntry():
                  file_name=file_name)) for
             file_name in ('result.tar', 'log.gz', 'artifacts.tar.gz')
         ]
+
+
+class _CountingReader():
+
+    def __init__(self, file_):
+        self._file = file_
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def parse_result(result_data):
+    """Return the record read from the contents of a result archive.
+
+    It only uses its argument, so it can be run in another process.
+
+    :param bytes result_data: The contents of the result archive.
+    :rtype: ResultRecord
+    """
+    with tarfile.open(
+            fileobj=io.BytesIO(result_data), mode='r|') as result_tar:
+        return _make_record(_read_result_members(result_tar))
+
+
+def _read_result_members(result_tar):
+    return dict(_iter_result_members(result_tar))
+
+
+def _iter_result_members(result_tar):
+    found = set()
+    for member in result_tar:
+        name = os.path.normpath(member.name)
+        if name in _RESULT_MEMBERS and member.isfile():
+            yield name, result_tar.extractfile(member).read()
+            found.add(name)
+            if len(found) == len(_RESULT_MEMBERS):
+                break
+
+
+def _make_record(members):
+    def _get_text(name):
+        if name in members:
+            return members[name].decode().strip()
+        return None
+
+    test_info = json.loads(_get_text('testinfo.json') or '{}')
+    pull_request = any(
+        variable.startswith('UPSTREAM_PULL_REQUEST=') for variable in
+        test_info.get('custom_environment', []))
+    return ResultRecord(
+        test_package=_get_text('testpkg-version'),
+        exitcode=_get_text('exitcode'),
+        duration=_get_text('duration'),
+        pull_request=pull_request)
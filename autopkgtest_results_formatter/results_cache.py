@@ -0,0 +1,247 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+
+_DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+
+def get_default_path():
+    """Return the path to the cache directory of the current user.
+
+    It follows the XDG base directory specification.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME')
+    if not cache_home:
+        cache_home = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'autopkgtest_results_formatter')
+
+
+def _get_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+class ResultsCache():
+    """A directory to keep the downloaded result archives between runs.
+
+    The results of an autopkgtest execution don't change once they are
+    published, so they can be kept forever. When the cache grows over its
+    maximum size, the least recently used archives are removed.
+
+    It also keeps a copy of the results indexes, that are refreshed instead of
+    downloaded again, and the pull request status of the results, so they
+    don't have to be downloaded to be filtered. They are not removed by the
+    size limit.
+
+    It can be shared by multiple threads. The archives returned by `get` and
+    `add` are pinned, so they are not removed while they are read, until they
+    are released with `release`.
+    """
+
+    def __init__(self, *, path=None, max_size=None):
+        """ResultsCache constructor.
+
+        :param str path: The path to the cache directory. Default is the
+            autopkgtest_results_formatter directory in the XDG cache home.
+        :param int max_size: The maximum size of the cache, in bytes. Default
+            is 1 GiB.
+        """
+        super().__init__()
+        if not path:
+            path = get_default_path()
+        self._results_path = os.path.join(path, 'results')
+        self._indexes_path = os.path.join(path, 'indexes')
+        self._pull_requests_path = os.path.join(path, 'pull_requests')
+        if not max_size:
+            max_size = _DEFAULT_MAX_SIZE
+        self._max_size = max_size
+        self._size = None
+        self._pull_requests = None
+        self._pinned = collections.Counter()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url):
+        """Return the path to the cached copy of a result archive.
+
+        The file is not removed from the cache until it is released.
+
+        :param str url: The URL of the result archive.
+        :return: The path to the cached file, or None if the archive is not
+            in the cache.
+        """
+        file_path = self._get_file_path(url)
+        with self._lock:
+            try:
+                # Update the access time, used to find the least recently
+                # used archives.
+                os.utime(file_path)
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._pinned[file_path] += 1
+            return file_path
+
+    def add(self, url, file_path):
+        """Move a downloaded result archive to the cache.
+
+        The file is not removed from the cache until it is released.
+
+        :param str url: The URL of the result archive.
+        :param str file_path: The path to the downloaded archive.
+        :return: The path to the cached file.
+        """
+        os.makedirs(self._results_path, exist_ok=True)
+        cached_file_path = self._get_file_path(url)
+        # Move the file first to the cache directory, and then rename it, so
+        # other threads or processes never see an incomplete archive.
+        temp_fd, temp_file_path = tempfile.mkstemp(dir=self._results_path)
+        os.close(temp_fd)
+        shutil.move(file_path, temp_file_path)
+        with self._lock:
+            # Pin it before it is visible, so other threads don't evict it.
+            self._pinned[cached_file_path] += 1
+            os.replace(temp_file_path, cached_file_path)
+            if self._size is None:
+                self._size = self._get_size()
+            else:
+                self._size += os.path.getsize(cached_file_path)
+            if self._size > self._max_size:
+                self._evict()
+        return cached_file_path
+
+    def release(self, file_path):
+        """Release a result archive returned by `get` or `add`.
+
+        It can be removed from the cache when it is not used anymore.
+
+        :param str file_path: The path to the cached file.
+        """
+        with self._lock:
+            self._pinned[file_path] -= 1
+            if self._pinned[file_path] <= 0:
+                del self._pinned[file_path]
+
+    def get_index_file_path(self, url):
+        """Return the path to the local copy of a results index.
+
+        The file might not exist yet.
+
+        :param str url: The URL of the results index.
+        """
+        os.makedirs(self._indexes_path, exist_ok=True)
+        return os.path.join(self._indexes_path, _get_key(url))
+
+    def load_index_validators(self, url):
+        """Return the HTTP validators of the local copy of a results index.
+
+        :param str url: The URL of the results index.
+        :return dict: The ETag and Last-Modified headers of the last response,
+            empty if the index has not been downloaded.
+        """
+        try:
+            with open(self._get_index_validators_path(url)) as validators:
+                return json.load(validators)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save_index_validators(self, url, validators):
+        """Save the HTTP validators of the local copy of a results index.
+
+        :param str url: The URL of the results index.
+        :param dict validators: The ETag and Last-Modified headers of the
+            last response.
+        """
+        with open(self._get_index_validators_path(url), 'w') as validators_:
+            json.dump(validators, validators_)
+
+    def _get_index_validators_path(self, url):
+        return self.get_index_file_path(url) + '.json'
+
+    def get_pull_request(self, url):
+        """Return the pull request status saved for a result archive.
+
+        :param str url: The URL of the result archive.
+        :return: True if the result is of a pull request, False if it is not,
+            or None if the status has not been saved.
+        """
+        with self._lock:
+            return self._load_pull_requests().get(_get_key(url))
+
+    def save_pull_request(self, url, pull_request):
+        """Save the pull request status of a result archive.
+
+        :param str url: The URL of the result archive.
+        :param bool pull_request: True if the result is of a pull request.
+        """
+        key = _get_key(url)
+        with self._lock:
+            pull_requests = self._load_pull_requests()
+            if pull_requests.get(key) == pull_request:
+                return
+            pull_requests[key] = pull_request
+            os.makedirs(os.path.dirname(self._pull_requests_path),
+                        exist_ok=True)
+            # The file is only appended to, with a short line for each
+            # status, so the writes of other processes are not mixed.
+            with open(self._pull_requests_path, 'a') as pull_requests_file:
+                pull_requests_file.write(
+                    '{} {}\n'.format(key, int(pull_request)))
+
+    def _load_pull_requests(self):
+        if self._pull_requests is None:
+            self._pull_requests = {}
+            try:
+                with open(self._pull_requests_path) as pull_requests_file:
+                    for line in pull_requests_file:
+                        key, _, pull_request = line.strip().partition(' ')
+                        if pull_request in ('0', '1'):
+                            self._pull_requests[key] = pull_request == '1'
+            except FileNotFoundError:
+                pass
+        return self._pull_requests
+
+    def _get_file_path(self, url):
+        return os.path.join(
+            self._results_path, '{}.tar'.format(_get_key(url)))
+
+    def _get_size(self):
+        return sum(entry.stat().st_size for entry in self._scan())
+
+    def _scan(self):
+        return [
+            entry for entry in os.scandir(self._results_path)
+            if entry.name.endswith('.tar')]
+
+    def _evict(self):
+        entries = sorted(self._scan(), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self._size <= self._max_size:
+                break
+            if entry.path in self._pinned:
+                continue
+            size = entry.stat().st_size
+            os.remove(entry.path)
+            self._size -= size
@@ -14,20 +14,54 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import contextlib
+import itertools
 import os
+import tempfile
+import time
+import warnings
+from concurrent import futures
+from concurrent.futures import process
 
 from autopkgtest_results_formatter import (
+    errors,
+    jsonl_writer,
     markdown_printer,
-    results_index
+    report_state,
+    result_entry,
+    results_index,
+    run_metrics
 )
 
 
+_DEFAULT_WORKERS = 8
+
+
+class PPA(collections.namedtuple('PPA', ['user', 'name', 'distros'])):
+    """A PPA with autopkgtest results, and the distros to format.
+
+    The user is the Launchpad user or team that owns the PPA, without the `~`.
+    """
+
+    __slots__ = ()
+
+
 class ResultsFormatter():
-    """Format the test results to a directory of markdown files."""
+    """Format the test results to a directory of markdown files.
+
+    The entries are written to the markdown files as soon as they are
+    downloaded. The entries that could not be downloaded are reported in the
+    markdown files, instead of stopping the run.
+    """
 
     def __init__(
-            self, *, destination_path, distros, ppa_user, ppa_name, day,
-            base_results_url=None):
+            self, *, destination_path, days=None, distros=None,
+            ppa_user=None, ppa_name=None, ppas=None, day=None,
+            base_results_url=None, workers=None,
+            parallel_indexes=False, cache=None, incremental=False,
+            client=None, jsonl=False, store=None, metrics=None,
+            decode_processes=None):
         """Formatter constructor.
 
         :parm str destination_path: The path to the destination directory.
@@ -36,33 +70,385 @@ class ResultsFormatter():
         :param str ppa_user: The name of the owner of the PPA. A Launchpad user
             or team, without the `~`.
         :param str ppa_name: The name of the PPA.
-        :param str day: The day of the results, with format yyyymmdd.
+        :param ppas: The PPAs to format, instead of ppa_user, ppa_name and
+            distros. The reports of each PPA are written to the directory
+            {ppa.user}/{ppa.name} in the destination directory. All the
+            PPAs share the same workers.
+        :type ppas: list of PPA.
+        :param days: The days of the results, with format yyyymmdd. A report
+            is written for each day.
+        :type days: list of strings.
+        :param str day: Deprecated, use days. The day of the results.
         :param str base_results_url: The URL where the index is stored. Default
             is the URL to Canonical's prodstack server where Ubuntu autopkgtest
             results are stored. autopkgtest-{distro}-{ppa_user}-{ppa_name} will
             be appended to this string to form the complete URL to the results
             index.
+        :param int workers: The maximum number of result archives to download
+            at the same time. Default is 8.
+        :param bool parallel_indexes: If True, download the indexes of all the
+            distros at the same time. Otherwise, download them one after the
+            other.
+        :param cache: The cache of result archives. If None, all the results
+            are downloaded.
+        :type cache: results_cache.ResultsCache
+        :param bool incremental: If True, keep a state file next to each
+            report with the entries already processed, and only process the
+            new entries in the next run.
+        :param client: The HTTP client to download the indexes and results.
+            Default is the client shared by all the objects.
+        :type client: http_client.HTTPClient
+        :param bool jsonl: If True, also write the entries of each day to a
+            JSON Lines file next to the markdown report. In incremental mode,
+            only the new entries are appended to it.
+        :param store: The store where the records of the entries are added.
+            If None, the records are not kept.
+        :type store: results_store.ResultsStore
+        :param metrics: The metrics of the run, where the stages are
+            measured. Default is the metrics shared by all the objects.
+        :type metrics: run_metrics.Metrics
+        :param int decode_processes: The number of processes to read the
+            result archives, after they are downloaded by the workers. If
+            None, the archives are read by the workers, that can only use one
+            CPU at the same time.
         """
         super().__init__()
-        self._destination_path = destination_path
-        self._distros = distros
-        self._ppa_user = ppa_user
-        self._ppa_name = ppa_name
-        self._day = day
+        if day is not None:
+            if days is not None:
+                raise TypeError('day and days are mutually exclusive')
+            warnings.warn(
+                'The day argument is deprecated, use days',
+                DeprecationWarning, stacklevel=2)
+            days = [day]
+        if days is None or isinstance(days, str):
+            raise TypeError('days must be a list of days')
+        if ppas:
+            self._targets = [
+                (ppa, os.path.join(destination_path, ppa.user, ppa.name))
+                for ppa in ppas]
+        else:
+            self._targets = [
+                (PPA(user=ppa_user, name=ppa_name, distros=distros),
+                 destination_path)]
+        self._days = days
         self._base_results_url = base_results_url
+        if not workers:
+            workers = _DEFAULT_WORKERS
+        self._workers = workers
+        self._parallel_indexes = parallel_indexes
+        self._cache = cache
+        self._incremental = incremental
+        self._client = client
+        self._jsonl = jsonl
+        self._store = store
+        if not metrics:
+            metrics = run_metrics.get_default_metrics()
+        self._metrics = metrics
+        self._decode_processes = decode_processes
+
+    @property
+    def targets(self):
+        """The PPAs formatted, as a list of tuples (PPA, destination_path).
+
+        The destination path is the directory of the reports of the PPA.
+        """
+        return list(self._targets)
 
     def format(self):
-        result_entries = []
-        for distro in self._distros:
-            with results_index.ResultsIndex(
-                    distro=distro, ppa_user=self._ppa_user,
-                    ppa_name=self._ppa_name,
-                    base_results_url=self._base_results_url) as results:
-                result_entries += [
-                    entry for entry in results.filter_by_day(self._day)
-                    if not entry.is_pull_request()]
-        printer = markdown_printer.MarkdownPrinter(
-            destination_path=os.path.join(
-                self._destination_path, '{}.md'.format(self._day)),
-            result_entries=result_entries)
-        printer.print_results()
+        with self._metrics.time('format'), contextlib.ExitStack() as stack:
+            indexes = self._make_indexes(stack)
+            with contextlib.ExitStack() as index_stack:
+                self._enter_indexes(indexes, index_stack)
+                entries_by_report = self._filter_indexes(indexes)
+            self._write_reports(entries_by_report)
+
+    def watch(self, *, interval, polls=None, get_days=None, on_poll=None):
+        """Keep the reports updated, polling the indexes for new entries.
+
+        The indexes and the entries are kept in memory between polls. Only
+        the entries added to the indexes since the previous poll are
+        downloaded, and only the reports of their days are written again.
+
+        :param float interval: The time to wait between polls, in seconds.
+        :param int polls: The number of polls after the first format. Default
+            is to poll until the process is interrupted.
+        :param get_days: A function that returns the list of days to report,
+            called on each poll, so the days can follow the current day.
+            The entries of the days that are no longer reported are dropped
+            from memory. Default is to report the days of the formatter.
+        :param on_poll: A function called after each poll, for example, to
+            write the metrics of the run while it keeps running.
+        """
+        with contextlib.ExitStack() as stack:
+            indexes = self._make_indexes(stack)
+            self._enter_indexes(indexes, stack)
+            entries = {}
+            done_urls = set()
+            for poll in itertools.count():
+                if poll:
+                    if polls is not None and poll > polls:
+                        break
+                    time.sleep(interval)
+                    self._refresh_indexes(indexes)
+                days = get_days() if get_days else self._days
+                with self._metrics.time('poll'):
+                    changed_entries_by_report = collections.OrderedDict()
+                    poll_entries = {}
+                    for report, report_entries in self._filter_indexes(
+                            indexes, days).items():
+                        # Use the entries of the previous polls, that have
+                        # their results in memory.
+                        report_entries = [
+                            entries.get(entry.url, entry)
+                            for entry in report_entries]
+                        poll_entries.update(
+                            (entry.url, entry) for entry in report_entries)
+                        if any(entry.url not in done_urls
+                               for entry in report_entries):
+                            changed_entries_by_report[report] = (
+                                report_entries)
+                    entries = poll_entries
+                    done_urls &= entries.keys()
+                    done_urls |= self._write_reports(
+                        changed_entries_by_report, done_urls=done_urls,
+                        append_jsonl=self._incremental or poll > 0)
+                if on_poll:
+                    on_poll()
+
+    def _refresh_indexes(self, indexes):
+        for index in indexes:
+            try:
+                index.refresh()
+            except errors.DownloadError:
+                # Keep using the previous copy, and try again next poll.
+                self._metrics.count('failed_index_refreshes')
+
+    def _write_reports(
+            self, entries_by_report, *, done_urls=frozenset(),
+            append_jsonl=None):
+        """Write the reports of the days, fetching the entries needed.
+
+        :param entries_by_report: An ordered dictionary with tuples
+            (destination_path, day) as keys, and the lists of entries of that
+            report as values.
+        :param done_urls: The URLs of the entries processed before, that are
+            only written to the markdown reports.
+        :type done_urls: set of strings.
+        :param bool append_jsonl: If True, append the new entries to the JSON
+            Lines files. Default is to append in incremental mode.
+        :return: The set of URLs of the entries processed, without the ones
+            that failed.
+        """
+        if append_jsonl is None:
+            append_jsonl = self._incremental
+        processed_urls = set()
+        with contextlib.ExitStack() as stack:
+            writers = {}
+            states = {}
+            new_entries = []
+            reports = {}
+            for report, report_entries in entries_by_report.items():
+                destination_path, day = report
+                os.makedirs(destination_path, exist_ok=True)
+                markdown_writer = stack.enter_context(
+                    markdown_printer.MarkdownWriter(
+                        destination_path=os.path.join(
+                            destination_path, '{}.md'.format(day)),
+                        entries=report_entries, metrics=self._metrics))
+                writers[report] = [markdown_writer]
+                # The writers of the entries processed before.
+                done_writers = [markdown_writer]
+                if self._jsonl:
+                    jsonl_path = os.path.join(
+                        destination_path, '{}.jsonl'.format(day))
+                    # If the JSON Lines file doesn't exist, for example,
+                    # because it was not enabled before, it is written with
+                    # all the entries.
+                    append = append_jsonl and os.path.exists(jsonl_path)
+                    writers[report].append(stack.enter_context(
+                        jsonl_writer.JSONLWriter(
+                            destination_path=jsonl_path, append=append)))
+                    if not append:
+                        done_writers = writers[report]
+                if self._incremental:
+                    states[report] = report_state.ReportState(
+                        path=os.path.join(
+                            destination_path, '.{}.json'.format(day)))
+                for entry in report_entries:
+                    reports[entry.url] = report
+                    if entry.url in done_urls:
+                        # Already counted when it was fetched.
+                        self._write(done_writers, entry, None, count=False)
+                        processed_urls.add(entry.url)
+                    elif (report in states and
+                          states[report].restore(entry)):
+                        self._metrics.count('restored_entries')
+                        self._write(done_writers, entry, None)
+                        self._add_to_store(entry)
+                        processed_urls.add(entry.url)
+                    else:
+                        new_entries.append(entry)
+            # Fetch the entries of all the reports with the same pool of
+            # workers, and write each one as soon as it is ready.
+            for entry, error in self._fetch(new_entries):
+                report = reports[entry.url]
+                self._write(writers[report], entry, error)
+                # The failed entries are not saved, to retry them next run.
+                if not error:
+                    self._add_to_store(entry)
+                    processed_urls.add(entry.url)
+                    if report in states:
+                        states[report].add(entry)
+        for state in states.values():
+            state.save()
+        if self._store:
+            self._store.save()
+        return processed_urls
+
+    def _add_to_store(self, entry):
+        if self._store:
+            self._store.add(entry)
+
+    def _write(self, writers, entry, error, *, count=True):
+        if count and error:
+            self._metrics.count('failed_entries')
+        elif count and entry.is_pull_request():
+            self._metrics.count('pull_requests')
+        for writer in writers:
+            if error:
+                writer.write_failure(entry, error)
+            elif entry.is_pull_request():
+                writer.skip(entry)
+            else:
+                writer.write_result(entry)
+
+    def _make_indexes(self, stack):
+        """Return the indexes of all the distros of all the PPAs.
+
+        The resources shared by the indexes and their entries are pushed to
+        the exit stack, so they are released at the end of the run.
+
+        :return: An ordered dictionary with the indexes as keys, and the paths
+            to the destination directories of their reports as values.
+        """
+        # All the temporary files of the run are kept in the same directory,
+        # that is removed at the end even if the entries are not cleaned up.
+        scratch_path = stack.enter_context(tempfile.TemporaryDirectory(
+            prefix='autopkgtest_results_formatter-'))
+        decode = self._make_decode(stack)
+        return collections.OrderedDict(
+            (results_index.ResultsIndex(
+                distro=distro, ppa_user=ppa.user, ppa_name=ppa.name,
+                base_results_url=self._base_results_url, cache=self._cache,
+                client=self._client, scratch_path=scratch_path,
+                metrics=self._metrics, decode=decode),
+             destination_path)
+            for ppa, destination_path in self._targets
+            for distro in ppa.distros)
+
+    def _make_decode(self, stack):
+        """Return the function to read the result archives in processes.
+
+        :return: A function that takes the contents of a result archive, and
+            returns its record. None if the archives are read by the workers.
+        """
+        if not self._decode_processes:
+            return None
+        executor = stack.enter_context(futures.ProcessPoolExecutor(
+            max_workers=self._decode_processes))
+        # Start the processes now, before the threads of the workers, so they
+        # are not forked while the threads hold any lock.
+        executor.submit(int).result()
+
+        def _decode(result_data):
+            return executor.submit(
+                result_entry.parse_result, result_data).result()
+
+        return _decode
+
+    def _enter_indexes(self, indexes, stack):
+        if self._parallel_indexes:
+            self._enter_concurrently(indexes, stack)
+        else:
+            for index in indexes:
+                stack.enter_context(index)
+
+    def _filter_indexes(self, indexes, days=None):
+        """Return the entries of the days from the indexes of all the distros.
+
+        Each index is scanned only once for all the days.
+
+        :param days: The days of the reports. Default is the days of the
+            formatter.
+        :type days: list of strings.
+
+        :return: An ordered dictionary with tuples (destination_path, day) as
+            keys, sorted by PPA and day, and the lists of entries of that
+            report as values.
+        """
+        if days is None:
+            days = self._days
+        entries_by_report = collections.OrderedDict(
+            ((destination_path, day), [])
+            for _, destination_path in self._targets
+            for day in sorted(days))
+        for index, destination_path in indexes.items():
+            for day, day_entries in index.filter_by_days(days).items():
+                entries_by_report[(destination_path, day)] += day_entries
+        return entries_by_report
+
+    def _enter_concurrently(self, indexes, stack):
+        """Download the indexes at the same time.
+
+        The indexes that were downloaded are pushed to the exit stack, even if
+        the download of other indexes failed.
+        """
+        with futures.ThreadPoolExecutor(
+                max_workers=len(indexes)) as executor:
+            index_futures = [
+                executor.submit(index.__enter__) for index in indexes]
+        for index, future in zip(indexes, index_futures):
+            if not future.exception():
+                stack.push(index)
+        for future in index_futures:
+            future.result()
+
+    def _fetch(self, result_entries):
+        """Download the results of the entries using a pool of workers.
+
+        The pull requests are filtered first, and their complete results are
+        not downloaded because they are not reported.
+
+        :return: An iterator of tuples (entry, error) in the order the
+            downloads finish. The error is None if the entry was downloaded
+            and read.
+        """
+        def _fetch_entry(entry):
+            try:
+                if not entry.is_pull_request():
+                    entry.fetch()
+            except (errors.DownloadError, errors.ResultReadError) as e:
+                return entry, e
+            except process.BrokenProcessPool:
+                return entry, errors.ResultReadError(
+                    url=entry.url,
+                    reason='the pool of decode processes is broken')
+            return entry, None
+
+        with futures.ThreadPoolExecutor(
+                max_workers=self._workers) as executor:
+            entry_futures = [
+                executor.submit(_fetch_entry, entry)
+                for entry in result_entries]
+            try:
+                # The time includes writing the entries, as they are written
+                # while the rest are downloaded.
+                with self._metrics.time('fetch'):
+                    for future in futures.as_completed(entry_futures):
+                        yield future.result()
+            finally:
+                # If the caller stops early, for example, when it is
+                # interrupted, don't wait for the pending downloads when
+                # the pool is shut down.
+                for future in entry_futures:
+                    future.cancel()
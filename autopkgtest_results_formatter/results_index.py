@@ -14,12 +14,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import array
+import bisect
+import collections
+import os
 import re
-from urllib import request
+import shutil
+import tempfile
 
 from autopkgtest_results_formatter import (
     errors,
-    result_entry
+    http_client,
+    result_entry,
+    run_metrics
 )
 
 
@@ -27,6 +34,33 @@ _BASE_RESULTS_URL = (
     'https://objectstorage.prodstack4-5.canonical.com/v1/'
     'AUTH_77e2ada1e7a84929a74ba3b87153c0ac')
 
+# An entry in the index is the path to one of the files of a result, for
+# example: xenial/amd64/s/snapcraft/20171114_134152_41f31@/result.tar
+_ENTRY_PATTERN = re.compile(
+    r'(?P<directory>[^/\s]+/(?P<architecture>[^/\s]+)/[^/\s]+/[^/\s]+/'
+    r'(?P<day>[^/_\s]+)_[^/\s]+_[^/\s]+@)/\S+')
+# The same pattern, to match the lines of the index file read as bytes.
+_ENTRY_BYTES_PATTERN = re.compile(_ENTRY_PATTERN.pattern.encode())
+# The number of bytes at the end of the local copy of the index that are
+# downloaded again, to check that the remote index only grew.
+_INDEX_CHECK_SIZE = 4 * 1024
+
+
+def get_index_url(*, distro, ppa_user, ppa_name, base_results_url=None):
+    """Return the URL of the results index of a distro in a PPA.
+
+    :param str distro: The name of the distro, for example: xenial.
+    :param str ppa_user: The name of the owner of the PPA.
+    :param str ppa_name: The name of the PPA.
+    :param str base_results_url: The URL where the index is stored. Default
+        is the URL to Canonical's prodstack server.
+    """
+    if not base_results_url:
+        base_results_url = _BASE_RESULTS_URL
+    return '{base_url}/autopkgtest-{distro}-{ppa_user}-{ppa_name}'.format(
+        base_url=base_results_url, distro=distro, ppa_user=ppa_user,
+        ppa_name=ppa_name)
+
 
 class ResultsIndex():
     """The index of a PPA autopkgtest results for distro version.
@@ -36,7 +70,8 @@ class ResultsIndex():
 
     def __init__(
             self, *, distro, ppa_user, ppa_name,
-            base_results_url=None):
+            base_results_url=None, cache=None, client=None,
+            scratch_path=None, metrics=None, decode=None):
         """Index constructor.
 
         :param str distro: The name of the distro, for example: xenial.
@@ -48,6 +83,24 @@ class ResultsIndex():
             results are stored. autopkgtest-{distro}-{ppa_user}-{ppa_name} will
             be appended to this string to form the complete URL to the results
             index.
+        :param cache: The cache of result archives, passed to the entries. It
+            also keeps the index between runs, so only the new entries are
+            downloaded. If None, the full index is always downloaded.
+        :type cache: results_cache.ResultsCache
+        :param client: The HTTP client to download the index and the results
+            of the entries. Default is the client shared by all the objects.
+        :type client: http_client.HTTPClient
+        :param str scratch_path: The path to the directory for the temporary
+            files of the index and its entries. Default is the system
+            temporary directory.
+        :param metrics: The metrics of the run, passed to the entries.
+            Default is the metrics shared by all the objects.
+        :type metrics: run_metrics.Metrics
+        :param decode: The function that reads the records of the entries
+            from the contents of their result archives, passed to the
+            entries. If None, the entries read their archives themselves.
+        :type decode: function that takes bytes and returns a
+            result_entry.ResultRecord.
         """
         super().__init__()
         self._distro = distro
@@ -56,33 +109,194 @@ class ResultsIndex():
         if not base_results_url:
             base_results_url = _BASE_RESULTS_URL
         self._base_results_url = base_results_url
+        self._cache = cache
+        if not client:
+            client = http_client.get_default_client()
+        self._client = client
+        self._scratch_path = scratch_path
+        if not metrics:
+            metrics = run_metrics.get_default_metrics()
+        self._metrics = metrics
+        self._decode = decode
         self._index_file_path = None
+        self._temp_index_file_path = None
+        self._day_index = None
+        self._days = None
+        self._scanned_size = 0
+        self._index_replaced = False
         self._url = None
 
     @property
     def url(self):
         """The URL of the results index."""
         if not self._url:
-            self._url = (
-                '{base_url}/autopkgtest-{distro}-{ppa_user}-{ppa_name}'.format(
-                    base_url = self._base_results_url, distro=self._distro,
-                    ppa_user=self._ppa_user, ppa_name=self._ppa_name))
+            self._url = get_index_url(
+                distro=self._distro, ppa_user=self._ppa_user,
+                ppa_name=self._ppa_name,
+                base_results_url=self._base_results_url)
         return self._url
 
     def __enter__(self):
-        self._index_file_path = self._download_index()
+        with self._metrics.time('index_download'):
+            self._index_file_path = self._download_index()
+        self._metrics.count(
+            'index_file_bytes', os.path.getsize(self._index_file_path))
+        self._day_index = None
+        self._days = None
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         self._index_file_path = None
-        request.urlcleanup()
+        self._day_index = None
+        self._days = None
+        if self._temp_index_file_path:
+            os.remove(self._temp_index_file_path)
+            self._temp_index_file_path = None
 
     def _download_index(self):
         """Download the index file.
 
         :return str: The path to a local file with the results index.
         """
-        return request.urlretrieve(self.url)[0]
+        if not self._cache:
+            temp_fd, temp_index_file_path = tempfile.mkstemp(
+                dir=self._scratch_path)
+            os.close(temp_fd)
+            try:
+                self._client.retrieve(self.url, temp_index_file_path)
+            except Exception:
+                os.remove(temp_index_file_path)
+                raise
+            # Keep the previous copy until the new one is complete, so it can
+            # still be used if the download fails.
+            if self._temp_index_file_path:
+                os.remove(self._temp_index_file_path)
+            self._temp_index_file_path = temp_index_file_path
+            self._index_replaced = True
+            return self._temp_index_file_path
+        return self._refresh_index()
+
+    def refresh(self):
+        """Download the index again, to get the entries added to it.
+
+        The positions of the entries already scanned are kept. If the index
+        only grew, just the new lines are scanned. If the download fails, the
+        previous copy of the index is kept.
+
+        :raises errors.ResultsIndexNotDownloadedError: If called before the
+            index has been downloaded.
+        """
+        if not self._index_file_path:
+            raise errors.ResultsIndexNotDownloadedError(
+                action='refresh index')
+        self._index_replaced = False
+        with self._metrics.time('index_download'):
+            self._index_file_path = self._download_index()
+        if self._day_index is None:
+            return
+        if self._is_appended():
+            self._scan_index()
+        else:
+            self._day_index = None
+            self._days = None
+
+    def _is_appended(self):
+        """Return True if the index file is the scanned file, with new lines.
+
+        The local copy of the index kept in the cache is modified in place
+        only when the remote index grew and its tail matches the local copy,
+        otherwise it is replaced.
+        """
+        if (self._index_replaced or
+                os.path.getsize(self._index_file_path) < self._scanned_size):
+            return False
+        if not self._scanned_size:
+            return True
+        with open(self._index_file_path, 'rb') as index_file:
+            index_file.seek(self._scanned_size - 1)
+            # The last line scanned must be complete.
+            return index_file.read(1) == b'\n'
+
+    def _refresh_index(self):
+        """Update the local copy of the index kept in the cache.
+
+        The index is downloaded only if it changed since the last run, and
+        then only the bytes appended to it are transferred.
+
+        :return str: The path to the local copy of the index.
+        """
+        index_file_path = self._cache.get_index_file_path(self.url)
+        try:
+            size = os.path.getsize(index_file_path)
+        except FileNotFoundError:
+            size = 0
+        headers = {}
+        check_size = 0
+        if size:
+            validators = self._cache.load_index_validators(self.url)
+            if 'etag' in validators:
+                headers['If-None-Match'] = validators['etag']
+            if 'last_modified' in validators:
+                headers['If-Modified-Since'] = validators['last_modified']
+            # The index only grows, so request the bytes appended since the
+            # last run. The tail of the local copy is requested again to check
+            # that it is still the start of the remote index. The range is
+            # not conditional on the validators, because they change every
+            # time the index grows, and then the server would send it
+            # complete.
+            check_size = min(size, _INDEX_CHECK_SIZE)
+            headers['Range'] = 'bytes={}-'.format(size - check_size)
+        with self._client.open(self.url, headers=headers) as response:
+            if response.status == 304:
+                return index_file_path
+            elif response.status == 416:
+                # The remote index is smaller than the local copy.
+                appended = False
+            elif response.status == 206:
+                appended = self._append_index(
+                    response, index_file_path, size, check_size)
+            elif response.status == 200:
+                self._replace_index(response, index_file_path)
+                appended = True
+            else:
+                raise errors.DownloadStatusError(
+                    url=self.url, status=response.status)
+            validators = {}
+            if response.headers.get('ETag'):
+                validators['etag'] = response.headers['ETag']
+            if response.headers.get('Last-Modified'):
+                validators['last_modified'] = (
+                    response.headers['Last-Modified'])
+        if not appended:
+            # The local copy is not the start of the remote index.
+            self._discard_index(index_file_path)
+            return self._refresh_index()
+        self._cache.save_index_validators(self.url, validators)
+        return index_file_path
+
+    def _discard_index(self, index_file_path):
+        self._cache.save_index_validators(self.url, {})
+        os.remove(index_file_path)
+
+    def _append_index(self, response, index_file_path, size, check_size):
+        start = size - check_size
+        content_range = response.headers.get('Content-Range', '')
+        if not content_range.startswith('bytes {}-'.format(start)):
+            return False
+        with open(index_file_path, 'r+b') as index_file:
+            index_file.seek(start)
+            if index_file.read(check_size) != response.read(check_size):
+                return False
+            shutil.copyfileobj(response, index_file)
+        return True
+
+    def _replace_index(self, response, index_file_path):
+        self._index_replaced = True
+        temp_fd, temp_file_path = tempfile.mkstemp(
+            dir=os.path.dirname(index_file_path))
+        with open(temp_fd, 'wb') as temp_file:
+            shutil.copyfileobj(response, temp_file)
+        os.replace(temp_file_path, index_file_path)
 
     def read(self):
         """Return the contents of the index.
@@ -96,24 +310,137 @@ class ResultsIndex():
         with open(self._index_file_path, 'r') as index_file:
             return index_file.read()
 
-    def filter_by_day(self, day):
+    def iter_entries(self):
+        """Iterate over the entries of the index.
+
+        The index file is read one line at a time, so the memory used does not
+        depend on the size of the index.
+
+        :raises errors.ResultsIndexNotDownloadedError: If called before the
+            index has been downloaded.
+        """
+        if not self._index_file_path:
+            raise errors.ResultsIndexNotDownloadedError(
+                action='iterate index')
+        with open(self._index_file_path, 'r') as index_file:
+            for line in index_file:
+                entry = line.strip()
+                if entry:
+                    yield entry
+
+    def filter_by_day(self, day, *, architecture=None):
         """Iterate over the entries in the index of the specified day.
 
         The value returned by each iteration is the directory that contains the
         files with the results other information of the test execution.
 
         :param str day: The day to filter results, with format yyyymmdd.x
+        :param str architecture: If not None, return only the entries of this
+            architecture.
+        :raises errors.ResultsIndexNotDownloadedError: If called before the
+            index has been downloaded.
+        """
+        yield from self.filter_by_days(
+            [day], architecture=architecture)[str(day)]
+
+    def filter_by_days(self, days, *, architecture=None):
+        """Return the entries in the index of the specified days.
+
+        The first query scans the index once, one line at a time, to find the
+        position of the entries of each day. Then, every query reads only the
+        lines of the requested days.
+
+        :param days: The days to filter results, with format yyyymmdd. For
+            example, a set of strings or a range of integers.
+        :param str architecture: If not None, return only the entries of this
+            architecture.
+        :return: An ordered dictionary with the days as keys, sorted, and the
+            lists of result_entry.ResultEntry of that day as values, in the
+            order of the index.
         :raises errors.ResultsIndexNotDownloadedError: If called before the
             index has been downloaded.
         """
-        index_contents = self.read()
+        day_index = self._get_day_index()
+        entries = collections.OrderedDict()
+        with open(self._index_file_path, 'rb') as index_file:
+            for day in sorted({str(day) for day in days}):
+                architectures = day_index.get(day, {})
+                if architecture:
+                    offsets = architectures.get(architecture, [])
+                else:
+                    offsets = sorted(
+                        offset for architecture_offsets in
+                        architectures.values()
+                        for offset in architecture_offsets)
+                entries[day] = self._read_entries(index_file, offsets)
+        return entries
+
+    def filter_by_range(self, first_day, last_day, *, architecture=None):
+        """Return the entries in the index between two days, inclusive.
+
+        :param str first_day: The first day of the range, with format
+            yyyymmdd.
+        :param str last_day: The last day of the range, with format yyyymmdd.
+        :param str architecture: If not None, return only the entries of this
+            architecture.
+        :return: An ordered dictionary with the days that have entries as
+            keys, sorted, and the lists of result_entry.ResultEntry of that day
+            as values, in the order of the index.
+        :raises errors.ResultsIndexNotDownloadedError: If called before the
+            index has been downloaded.
+        """
+        self._get_day_index()
+        first = bisect.bisect_left(self._days, str(first_day))
+        last = bisect.bisect_right(self._days, str(last_day))
+        return self.filter_by_days(
+            self._days[first:last], architecture=architecture)
+
+    def _get_day_index(self):
+        """Return the position of the entries in the index file.
+
+        :return: A dictionary with the days as keys, and dictionaries as
+            values, with the architectures as keys and arrays with the offsets
+            of the lines in the index file as values.
+        """
+        if not self._index_file_path:
+            raise errors.ResultsIndexNotDownloadedError(action='filter index')
+        if self._day_index is None:
+            self._day_index = {}
+            self._scanned_size = 0
+            self._scan_index()
+        return self._day_index
+
+    def _scan_index(self):
+        """Add the positions of the lines after the part already scanned."""
+        offset = self._scanned_size
+        with self._metrics.time('index_scan'), open(
+                self._index_file_path, 'rb') as index_file:
+            index_file.seek(offset)
+            for line in index_file:
+                match = _ENTRY_BYTES_PATTERN.fullmatch(line.strip())
+                if match:
+                    self._day_index.setdefault(
+                        match.group('day').decode(), {}).setdefault(
+                            match.group('architecture').decode(),
+                            array.array('q')).append(offset)
+                offset += len(line)
+        self._scanned_size = offset
+        self._days = sorted(self._day_index)
+
+    def _read_entries(self, index_file, offsets):
+        entries = []
         seen = set()
-        for entry in index_contents.split():
-            pattern = '.+/.+/.+/.+/{}_.+_.+@/.+'.format(day)
-            match = re.fullmatch(pattern, entry)
-            if match:
-                directory = entry[:entry.rfind('/')]
-                if directory not in seen:
-                    seen.add(directory)
-                    yield result_entry.ResultEntry(
-                        index_url=self.url, directory=directory)
+        for offset in offsets:
+            index_file.seek(offset)
+            match = _ENTRY_PATTERN.fullmatch(
+                index_file.readline().decode().strip())
+            directory = match.group('directory')
+            if directory not in seen:
+                seen.add(directory)
+                entries.append(result_entry.ResultEntry(
+                    index_url=self.url, directory=directory,
+                    cache=self._cache, client=self._client,
+                    scratch_path=self._scratch_path, metrics=self._metrics,
+                    decode=self._decode))
+        self._metrics.count('index_entries', len(entries))
+        return entries
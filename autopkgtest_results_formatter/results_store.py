@@ -0,0 +1,244 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import sqlite3
+
+from autopkgtest_results_formatter import errors
+
+
+# The columns that the statistics can be grouped by.
+_GROUP_COLUMNS = (
+    'index_url', 'distro', 'architecture', 'package', 'day')
+# The number of entries added between commits, so an interrupted run keeps
+# most of the entries it added.
+_COMMIT_INTERVAL = 100
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    url TEXT PRIMARY KEY,
+    distro TEXT NOT NULL,
+    architecture TEXT NOT NULL,
+    package TEXT NOT NULL,
+    day TEXT NOT NULL,
+    identifier TEXT NOT NULL,
+    test_package TEXT,
+    exitcode INTEGER,
+    duration INTEGER,
+    pull_request INTEGER NOT NULL,
+    index_url TEXT
+);
+CREATE INDEX IF NOT EXISTS results_day ON results (day);
+'''
+
+# The stores made before the index URL was kept don't have its column. The
+# index URL is the beginning of the URL of the entry, before the distro.
+_ADD_INDEX_URL = '''
+ALTER TABLE results ADD COLUMN index_url TEXT;
+UPDATE results
+    SET index_url = substr(url, 1, instr(url, '/' || distro || '/') - 1);
+'''
+
+
+class StoredRecord(collections.namedtuple(
+        'StoredRecord',
+        ['index_url', 'distro', 'architecture', 'package', 'day',
+         'identifier', 'test_package', 'exitcode', 'duration',
+         'pull_request'])):
+    """The record of an entry saved in the results store.
+
+    The index URL identifies the distro and the PPA of the entry. The exitcode
+    and duration are integers, or None if they are unknown.
+    """
+
+    __slots__ = ()
+
+
+class ResultStats(collections.namedtuple(
+        'ResultStats',
+        ['group', 'runs', 'failures', 'failure_rate', 'mean_duration'])):
+    """The statistics of a group of results.
+
+    The group is a tuple with the values of the columns used to group the
+    results. The failures are the results with an exit code that is known and
+    is not 0. The failure rate is a fraction between 0 and 1 of the results
+    with a known exit code, or None if none of them is known.
+    """
+
+    __slots__ = ()
+
+
+class ResultsStore():
+    """A SQLite database with the records of all the entries processed.
+
+    The formatter adds the entries of every run, so the history of the results
+    can be queried later without downloading them again. The entries added
+    are committed periodically, and when the store is closed, even if the run
+    failed.
+
+    It must be used as a context manager, from a single thread.
+    """
+
+    def __init__(self, *, path):
+        """ResultsStore constructor.
+
+        :param str path: The path to the database file. It is created if it
+            doesn't exist.
+        """
+        super().__init__()
+        self._path = path
+        self._connection = None
+        self._uncommitted = 0
+
+    def __enter__(self):
+        self._connection = sqlite3.connect(self._path)
+        self._connection.executescript(_SCHEMA)
+        columns = [
+            row[1] for row in
+            self._connection.execute('PRAGMA table_info(results)')]
+        if 'index_url' not in columns:
+            self._connection.executescript(_ADD_INDEX_URL)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # The records are complete when they are added, so they are kept
+        # even if the run was interrupted.
+        self.save()
+        self._connection.close()
+        self._connection = None
+
+    def add(self, entry):
+        """Add an entry to the store, replacing it if it was already there.
+
+        :param entry: The entry, with its result already fetched.
+        :type entry: result_entry.ResultEntry
+        """
+        record = entry.record
+        self._connection.execute(
+            'INSERT OR REPLACE INTO results (url, index_url, distro, '
+            'architecture, package, day, identifier, test_package, exitcode, '
+            'duration, pull_request) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (entry.url, entry.index_url, entry.distro, entry.architecture,
+             entry.package, entry.day, entry.identifier, record.test_package,
+             _to_int(record.exitcode), _to_int(record.duration),
+             record.pull_request))
+        self._uncommitted += 1
+        if self._uncommitted >= _COMMIT_INTERVAL:
+            self.save()
+
+    def save(self):
+        """Commit the entries added to the database file."""
+        self._connection.commit()
+        self._uncommitted = 0
+
+    def iter_records(
+            self, first_day, last_day, *, index_url=None, distro=None,
+            architecture=None, package=None, include_pull_requests=False):
+        """Return the records of the entries between two days, inclusive.
+
+        :param str first_day: The first day, with format yyyymmdd.
+        :param str last_day: The last day, with format yyyymmdd.
+        :param str index_url: If set, only return the records of this results
+            index.
+        :param str distro: If set, only return the records of this distro.
+        :param str architecture: If set, only return the records of this
+            architecture.
+        :param str package: If set, only return the records of this package.
+        :param bool include_pull_requests: If True, also return the records of
+            the pull requests.
+        :return: An iterator of StoredRecord sorted by day and identifier.
+        """
+        where, parameters = _get_conditions(
+            first_day, last_day, include_pull_requests,
+            index_url=index_url, distro=distro, architecture=architecture,
+            package=package)
+        cursor = self._connection.execute(
+            'SELECT index_url, distro, architecture, package, day, '
+            'identifier, test_package, exitcode, duration, pull_request '
+            'FROM results WHERE {} ORDER BY day, identifier'.format(where),
+            parameters)
+        for row in cursor:
+            yield StoredRecord(*row[:-1], pull_request=bool(row[-1]))
+
+    def get_stats(
+            self, first_day, last_day, *, group_by=('architecture',),
+            include_pull_requests=False):
+        """Return the statistics of the results between two days, inclusive.
+
+        The statistics are computed by the database, without reading the
+        records.
+
+        :param str first_day: The first day, with format yyyymmdd.
+        :param str last_day: The last day, with format yyyymmdd.
+        :param group_by: The columns to group the results by. They can be
+            index_url, distro, architecture, package and day. If empty, the
+            statistics of all the results are returned in a single group.
+        :type group_by: list of strings.
+        :param bool include_pull_requests: If True, also count the pull
+            requests.
+        :return: A list of ResultStats, sorted by group.
+        :raises errors.InvalidGroupError: If a column to group by is unknown.
+        """
+        for column in group_by:
+            if column not in _GROUP_COLUMNS:
+                raise errors.InvalidGroupError(
+                    column=column, columns=', '.join(_GROUP_COLUMNS))
+        where, parameters = _get_conditions(
+            first_day, last_day, include_pull_requests)
+        query = (
+            'SELECT {select}COUNT(*), COUNT(exitcode), SUM(exitcode <> 0), '
+            'AVG(duration) FROM results WHERE {where}')
+        if group_by:
+            query += ' GROUP BY {columns} ORDER BY {columns}'
+        columns = ', '.join(group_by)
+        cursor = self._connection.execute(
+            query.format(
+                select=''.join(column + ', ' for column in group_by),
+                where=where, columns=columns),
+            parameters)
+        stats = []
+        for row in cursor:
+            runs, known_runs, failures, mean_duration = row[-4:]
+            if not runs:
+                continue
+            # The results with an unknown exit code are not failures.
+            failures = failures or 0
+            failure_rate = None
+            if known_runs:
+                failure_rate = failures / known_runs
+            stats.append(ResultStats(
+                group=tuple(row[:-4]), runs=runs, failures=failures,
+                failure_rate=failure_rate, mean_duration=mean_duration))
+        return stats
+
+
+def _get_conditions(first_day, last_day, include_pull_requests, **columns):
+    conditions = ['day BETWEEN ? AND ?']
+    parameters = [first_day, last_day]
+    if not include_pull_requests:
+        conditions.append('pull_request = 0')
+    for column, value in sorted(columns.items()):
+        if value is not None:
+            conditions.append('{} = ?'.format(column))
+            parameters.append(value)
+    return ' AND '.join(conditions), parameters
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
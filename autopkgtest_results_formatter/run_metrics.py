@@ -0,0 +1,148 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+_PROMETHEUS_PREFIX = 'autopkgtest_results_formatter'
+
+_default_metrics = None
+_default_metrics_lock = threading.Lock()
+
+
+def get_default_metrics():
+    """Return the metrics shared by the objects that don't get one."""
+    global _default_metrics
+    with _default_metrics_lock:
+        if not _default_metrics:
+            _default_metrics = Metrics()
+        return _default_metrics
+
+
+class Metrics():
+    """The timers and counters of the stages of a run.
+
+    The timers add up the time of every execution of a stage, so when a stage
+    runs in multiple threads, its time can be longer than the run. They also
+    count the executions.
+
+    It can be shared by multiple threads.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._seconds = collections.Counter()
+        self._calls = collections.Counter()
+        self._counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def time(self, name):
+        """Measure the time of a stage, as a context manager.
+
+        :param str name: The name of the timer.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._seconds[name] += elapsed
+                self._calls[name] += 1
+
+    def count(self, name, value=1):
+        """Increase a counter.
+
+        :param str name: The name of the counter.
+        :param int value: The value to add to the counter.
+        """
+        with self._lock:
+            self._counters[name] += value
+
+    def to_dict(self):
+        """Return the metrics as a dictionary.
+
+        :return dict: A dictionary with the timers, with the seconds and
+            calls of each one, and the counters.
+        """
+        with self._lock:
+            return {
+                'timers': {
+                    name: {'seconds': self._seconds[name],
+                           'calls': self._calls[name]}
+                    for name in self._seconds},
+                'counters': dict(self._counters)
+            }
+
+    def get_summary(self):
+        """Return a human readable summary of the metrics."""
+        metrics = self.to_dict()
+        lines = []
+        for name, timer in sorted(metrics['timers'].items()):
+            lines.append('{}: {:.3f}s in {} calls'.format(
+                name, timer['seconds'], timer['calls']))
+        for name, value in sorted(metrics['counters'].items()):
+            lines.append('{}: {}'.format(name, value))
+        return '\n'.join(lines)
+
+    def write_json(self, path):
+        """Write the metrics to a JSON file.
+
+        :param str path: The path to the file.
+        """
+        _write_atomically(
+            path, json.dumps(self.to_dict(), indent=2, sort_keys=True))
+
+    def write_prometheus(self, path):
+        """Write the metrics to a file in the Prometheus text format.
+
+        It can be read by the textfile collector of the node exporter. The
+        file is replaced atomically, so the collector never reads it half
+        written.
+
+        :param str path: The path to the file. It must end with .prom to be
+            read by the collector.
+        """
+        metrics = self.to_dict()
+        lines = []
+        for name, timer in sorted(metrics['timers'].items()):
+            lines += _get_prometheus_gauge(
+                '{}_seconds'.format(name), timer['seconds'])
+            lines += _get_prometheus_gauge(
+                '{}_calls'.format(name), timer['calls'])
+        for name, value in sorted(metrics['counters'].items()):
+            lines += _get_prometheus_gauge(name, value)
+        _write_atomically(path, ''.join(lines))
+
+
+def _get_prometheus_gauge(name, value):
+    full_name = '{}_{}'.format(_PROMETHEUS_PREFIX, name)
+    return [
+        '# TYPE {} gauge\n'.format(full_name),
+        '{} {}\n'.format(full_name, value)]
+
+
+def _write_atomically(path, contents):
+    temp_path = '{}.tmp'.format(path)
+    with open(temp_path, 'w') as metrics_file:
+        metrics_file.write(contents)
+    os.replace(temp_path, path)
@@ -0,0 +1,226 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the throughput of the formatter against a local fake server.
+
+The server serves a synthetic index and synthetic result archives, so the
+measures don't depend on the network, and they can be compared between
+commits. For example:
+
+    python3 -m autopkgtest_results_formatter.tests.benchmarks \
+        --entries 100 1000 --size 10240 --output benchmark.json
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tarfile
+import time
+
+from autopkgtest_results_formatter import (
+    http_client,
+    results_formatter,
+    run_metrics
+)
+from autopkgtest_results_formatter.tests import fixture_setup
+
+
+_DAYS = ('20170101', '20170102', '20170103')
+_ARCHITECTURES = ('amd64', 'arm64', 'armhf', 'i386', 'ppc64el', 's390x')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the throughput of the formatter')
+    parser.add_argument(
+        '--entries', type=int, nargs='+', default=[100, 1000],
+        help='The numbers of entries of each day in the index to measure')
+    parser.add_argument(
+        '--size', type=int, default=10 * 1024,
+        help='The size of the padding file of each result archive, in bytes')
+    parser.add_argument(
+        '--pull-requests', type=float, default=0.5,
+        help='The fraction of the entries that are pull requests')
+    parser.add_argument(
+        '--workers', type=int, default=8,
+        help='The number of results to download concurrently')
+    parser.add_argument(
+        '--decode-processes', type=int,
+        help='The number of processes to decode the results')
+    parser.add_argument(
+        '--output', help='The path to the JSON file to write the results')
+    args = parser.parse_args()
+    results = {
+        'commit': _get_commit(),
+        'python': platform.python_version(),
+        'size': args.size,
+        'pull_requests': args.pull_requests,
+        'workers': args.workers,
+        'decode_processes': args.decode_processes,
+        'scales': [
+            run_benchmark(
+                entries=entries, size=args.size,
+                pull_requests=args.pull_requests, workers=args.workers,
+                decode_processes=args.decode_processes)
+            for entries in args.entries]
+    }
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    print(output)
+
+
+def run_benchmark(
+        *, entries, size, pull_requests, workers, decode_processes=None,
+        path=None):
+    """Measure the formatter with a synthetic index.
+
+    The formatter runs as it does from the command line, and the stages are
+    the timers of its metrics. It runs in a new process, so its peak memory
+    doesn't include the server, the archives it serves, nor the previous
+    runs.
+
+    :param int entries: The number of entries of each day in the index.
+    :param int size: The size of the padding file of each result archive,
+        in bytes.
+    :param float pull_requests: The fraction of the entries that are pull
+        requests.
+    :param int workers: The number of results to download concurrently.
+    :param int decode_processes: The number of processes to decode the
+        results. Default is to decode them in the download threads.
+    :param str path: The directory to write the markdown report. Default is
+        a temporary directory.
+    :return dict: The wall time in seconds, the peak RSS in KiB of the
+        process of the formatter, without the decode processes, and the bytes
+        transferred, with the timers and counters of the formatter.
+    """
+    with contextlib.ExitStack() as stack:
+        storage = stack.enter_context(fixture_setup.FakeObjectStorage())
+        if path is None:
+            path = stack.enter_context(fixture_setup.TempCWD()).path
+        _make_results(storage, entries, size, pull_requests)
+        bytes_sent = storage.bytes_sent
+        context = multiprocessing.get_context('spawn')
+        receiver, sender = context.Pipe(duplex=False)
+        # The new process finds the function by the name of its module, that
+        # is not this one when it runs as __main__.
+        benchmarks = importlib.import_module(
+            'autopkgtest_results_formatter.tests.benchmarks.__main__')
+        process = context.Process(
+            target=benchmarks._format, args=(sender,), kwargs={
+                'url': storage.url, 'path': path, 'workers': workers,
+                'decode_processes': decode_processes})
+        process.start()
+        sender.close()
+        try:
+            result = receiver.recv()
+        except EOFError:
+            result = None
+        finally:
+            receiver.close()
+            process.join()
+        if result is None:
+            raise RuntimeError(
+                'The formatter failed with exit code {}'.format(
+                    process.exitcode))
+        result['bytes_transferred'] = storage.bytes_sent - bytes_sent
+    result['entries'] = entries
+    return result
+
+
+def _format(connection, *, url, path, workers, decode_processes):
+    client = http_client.HTTPClient(max_connections_per_host=workers)
+    metrics = run_metrics.Metrics()
+    formatter = results_formatter.ResultsFormatter(
+        destination_path=path, distros=['benchmark'],
+        ppa_user='benchmark', ppa_name='benchmark', days=[_DAYS[1]],
+        base_results_url=url, workers=workers, client=client,
+        metrics=metrics, decode_processes=decode_processes)
+    start = time.perf_counter()
+    try:
+        formatter.format()
+    finally:
+        client.close()
+    seconds = time.perf_counter() - start
+    measures = metrics.to_dict()
+    with connection:
+        connection.send({
+            'seconds': seconds,
+            'peak_rss_kib': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss,
+            'stages': measures['timers'],
+            'counters': measures['counters']
+        })
+
+
+def _make_results(storage, entries, size, pull_requests):
+    index_path = '/autopkgtest-benchmark-benchmark-benchmark'
+    index_lines = []
+    for day in _DAYS:
+        for number in range(entries):
+            architecture = _ARCHITECTURES[number % len(_ARCHITECTURES)]
+            directory = 'benchmark/{}/b/benchmark/{}_000000_{:05}@'.format(
+                architecture, day, number)
+            pull_request = number < entries * pull_requests
+            storage.files['{}/{}/result.tar'.format(
+                index_path, directory)] = (
+                _make_result_tar(number, size, pull_request))
+            for file_name in ('result.tar', 'log.gz', 'artifacts.tar.gz'):
+                index_lines.append('{}/{}\n'.format(directory, file_name))
+    storage.files[index_path] = ''.join(index_lines).encode()
+
+
+def _make_result_tar(number, size, pull_request):
+    test_info = {}
+    if pull_request:
+        test_info['custom_environment'] = ['UPSTREAM_PULL_REQUEST=1']
+    files = (
+        ('exitcode', str(number % 2 * 4)),
+        ('testpkg-version', 'benchmark 1.0'),
+        ('duration', str(number)),
+        ('testinfo.json', json.dumps(test_info)),
+        ('testbed-packages', 'x' * size))
+    contents = io.BytesIO()
+    with tarfile.open(fileobj=contents, mode='w') as tar_file:
+        for name, value in files:
+            data = value.encode()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar_file.addfile(info, io.BytesIO(data))
+    return contents.getvalue()
+
+
+def _get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,7 +14,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import http.server
 import os
+import re
+import socketserver
+import sys
+import threading
+from urllib import parse
 
 import fixtures
 
@@ -30,3 +37,116 @@ class TempCWD(fixtures.TempDir):
         current_dir = os.getcwd()
         self.addCleanup(os.chdir, current_dir)
         os.chdir(self.path)
+
+
+class FakeObjectStorage(fixtures.Fixture):
+    """A local HTTP server that serves the files of a dictionary.
+
+    It keeps the connections alive, and supports the Range, If-Range and
+    If-None-Match request headers.
+
+    :ivar dict files: The contents of the files to serve, in bytes, with the
+        paths as keys.
+    :ivar str url: The URL of the server.
+    :ivar dict failures: The lists of error statuses to return for a path
+        before serving its file.
+    :ivar list requests: The tuples (path, headers) of the requests received.
+    :ivar int connections: The number of connections opened.
+    :ivar int bytes_sent: The number of bytes of files sent.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.files = {}
+        self.failures = {}
+        self.requests = []
+        self.connections = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def setUp(self):
+        super().setUp()
+        server = _ThreadingHTTPServer(
+            ('127.0.0.1', 0), _FakeObjectStorageHandler)
+        server.fake_object_storage = self
+        thread = threading.Thread(
+            target=server.serve_forever, kwargs={'poll_interval': 0.01})
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        self.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    def _count(self, *, connections=0, bytes_sent=0):
+        with self._lock:
+            self.connections += connections
+            self.bytes_sent += bytes_sent
+
+
+class _ThreadingHTTPServer(
+        socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The clients close the connections that they don't read completely.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _FakeObjectStorageHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.fake_object_storage._count(connections=1)
+
+    def do_GET(self):
+        storage = self.server.fake_object_storage
+        path = parse.unquote(parse.urlsplit(self.path).path)
+        storage.requests.append((path, dict(self.headers)))
+        if storage.failures.get(path):
+            self._send(storage.failures[path].pop(0), b'')
+            return
+        if path not in storage.files:
+            self._send(404, b'')
+            return
+        contents = storage.files[path]
+        etag = '"{}"'.format(hashlib.sha256(contents).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, b'', {'ETag': etag})
+            return
+        match = re.fullmatch(
+            r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if not match or (if_range is not None and if_range != etag):
+            self._send(200, contents, {'ETag': etag})
+            return
+        first = int(match.group(1))
+        last = min(int(match.group(2) or len(contents) - 1),
+                   len(contents) - 1)
+        if first >= len(contents):
+            self._send(416, b'')
+            return
+        self._send(206, contents[first:last + 1], {
+            'ETag': etag,
+            'Content-Range': 'bytes {}-{}/{}'.format(
+                first, last, len(contents))})
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except ConnectionError:
+            # The client stopped reading.
+            return
+        self.server.fake_object_storage._count(bytes_sent=len(body))
+
+    def log_message(self, format, *args):
+        pass
@@ -16,8 +16,8 @@
 
 import testtools
 from testtools.matchers import (
-    DirExists,
     Equals,
+    FileExists,
     Not
 )
 
@@ -46,11 +46,10 @@ class ResultEntryTestCase(testtools.TestCase):
         with result_entry.ResultEntry(
                 index_url=TEST_RESULT_INDEX_URL,
                 directory=TEST_RESULT_DIRECTORY_PULL_REQUEST) as entry:
-            entry.is_pull_request()
-            temp_dir = entry._temp_dir
-            self.assertThat(temp_dir, DirExists())
+            result_file_path = entry._download_result()
+            self.assertThat(result_file_path, FileExists())
 
-        self.assertThat(temp_dir, Not(DirExists()))
+        self.assertThat(result_file_path, Not(FileExists()))
 
     def test_is_pull_request(self):
         with result_entry.ResultEntry(
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import fixtures
 import testtools
 
 from autopkgtest_results_formatter.tests import fixture_setup
@@ -26,3 +27,7 @@ class TestCase(testtools.TestCase):
         temp_cwd_fixture = fixture_setup.TempCWD()
         self.useFixture(temp_cwd_fixture)
         self.path = temp_cwd_fixture.path
+        # The fake servers of the tests are reached directly.
+        for name in ('http_proxy', 'https_proxy', 'no_proxy'):
+            self.useFixture(fixtures.EnvironmentVariable(name))
+            self.useFixture(fixtures.EnvironmentVariable(name.upper()))
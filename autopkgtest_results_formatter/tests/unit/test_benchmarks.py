@@ -0,0 +1,56 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from testtools.matchers import (
+    Equals,
+    FileExists
+)
+
+from autopkgtest_results_formatter.tests.benchmarks import (
+    __main__ as benchmarks
+)
+from autopkgtest_results_formatter.tests import unit
+
+
+class BenchmarksTestCase(unit.TestCase):
+
+    def test_run_benchmark_measures_the_formatter(self):
+        result = benchmarks.run_benchmark(
+            entries=4, size=10, pull_requests=0.5, workers=2, path=self.path)
+
+        self.assertThat(result['entries'], Equals(4))
+        self.assertTrue(result['bytes_transferred'])
+        self.assertTrue(result['peak_rss_kib'])
+        self.assertThat(
+            sorted(result['stages']['fetch']), Equals(['calls', 'seconds']))
+        for stage in ('format', 'index_download', 'markdown_write'):
+            self.assertIn(stage, result['stages'])
+        self.assertThat(result['stages']['result_probe']['calls'], Equals(4))
+        self.assertThat(result['counters']['pull_requests'], Equals(2))
+        self.assertThat(result['counters']['markdown_entries'], Equals(2))
+        self.assertThat(
+            os.path.join(self.path, '20170102.md'), FileExists())
+
+    def test_run_benchmark_with_decode_processes(self):
+        result = benchmarks.run_benchmark(
+            entries=4, size=10, pull_requests=0.5, workers=2,
+            decode_processes=1, path=self.path)
+
+        self.assertThat(result['counters']['markdown_entries'], Equals(2))
+        self.assertThat(
+            os.path.join(self.path, '20170102.md'), FileExists())
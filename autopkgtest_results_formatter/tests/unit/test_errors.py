@@ -50,6 +50,39 @@ class ErrorFormattingTestCase(testscenarios.WithScenarios, unit.TestCase):
             'expected_message': (
                 'Failed to do test action: The results index has not been downloaded. '
                 'Use the ResultsIndex class as a context manager.')}),
+        ('DownloadError', {
+            'exception': errors.DownloadError,
+            'kwargs': {'url': 'http://example.com', 'reason': 'test reason'},
+            'expected_message': (
+                'Failed to download http://example.com: test reason.')}),
+        ('DownloadStatusError', {
+            'exception': errors.DownloadStatusError,
+            'kwargs': {'url': 'http://example.com', 'status': 404},
+            'expected_message': (
+                'Failed to download http://example.com: HTTP status 404.')}),
+        ('HostUnavailableError', {
+            'exception': errors.HostUnavailableError,
+            'kwargs': {
+                'url': 'http://example.com/test', 'host': 'example.com',
+                'failures': 5},
+            'expected_message': (
+                'Failed to download http://example.com/test: example.com '
+                'failed 5 times in a row, it will not be used for a '
+                'while.')}),
+        ('ResultReadError', {
+            'exception': errors.ResultReadError,
+            'kwargs': {
+                'url': 'http://example.com/result.tar',
+                'reason': 'test reason'},
+            'expected_message': (
+                'Failed to read http://example.com/result.tar: test '
+                'reason.')}),
+        ('InvalidGroupError', {
+            'exception': errors.InvalidGroupError,
+            'kwargs': {'column': 'test', 'columns': 'distro, architecture'},
+            'expected_message': (
+                'Failed to group the results by test: The results can only '
+                'be grouped by distro, architecture.')}),
     )
 
     def test_error_formatting(self):
@@ -0,0 +1,218 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from testtools.matchers import (
+    Contains,
+    Equals,
+    FileContains,
+    MatchesAll,
+    Not
+)
+
+from autopkgtest_results_formatter import (
+    history_report,
+    results_store
+)
+from autopkgtest_results_formatter.tests import unit
+
+
+def make_record(
+        package, architecture, exitcode, duration, *, distro='testdistro',
+        index_url='http://example.com/autopkgtest-testdistro-user-ppa'):
+    return results_store.StoredRecord(
+        index_url=index_url, distro=distro, architecture=architecture,
+        package=package, day='20170101', identifier='dummy',
+        test_package='dummy', exitcode=exitcode, duration=duration,
+        pull_request=False)
+
+
+class ComputeHistoriesTestCase(unit.TestCase):
+
+    def test_compute_pass_rate_and_flips(self):
+        records = [
+            make_record('testpackage', 'amd64', exitcode, 10)
+            for exitcode in (0, 4, 0, 0, 4)]
+
+        [history] = history_report.compute_histories(records)
+
+        self.assertThat(history.runs, Equals(5))
+        self.assertThat(history.passes, Equals(3))
+        self.assertThat(history.pass_rate, Equals(0.6))
+        self.assertThat(history.flips, Equals(3))
+
+    def test_compute_skips_unknown_exitcodes_in_pass_rate_and_flips(self):
+        records = [
+            make_record('testpackage', 'amd64', exitcode, 10)
+            for exitcode in (0, None, 0)]
+
+        [history] = history_report.compute_histories(records)
+
+        self.assertThat(history.runs, Equals(3))
+        self.assertThat(history.passes, Equals(2))
+        self.assertThat(history.pass_rate, Equals(1))
+        self.assertThat(history.flips, Equals(0))
+
+    def test_compute_without_known_exitcodes(self):
+        records = [make_record('testpackage', 'amd64', None, 10)]
+
+        [history] = history_report.compute_histories(records)
+
+        self.assertThat(history.pass_rate, Equals(None))
+
+    def test_compute_duration_percentiles(self):
+        records = [
+            make_record('testpackage', 'amd64', 0, duration)
+            for duration in range(100, 0, -1)]
+        records.append(make_record('testpackage', 'amd64', 0, None))
+
+        [history] = history_report.compute_histories(records)
+
+        self.assertThat(history.p50_duration, Equals(50))
+        self.assertThat(history.p95_duration, Equals(95))
+
+    def test_compute_groups_by_package_and_architecture(self):
+        records = [
+            make_record('testpackage2', 'amd64', 0, None),
+            make_record('testpackage1', 'i386', 0, None),
+            make_record('testpackage1', 'amd64', 0, None),
+            make_record('testpackage1', 'amd64', 1, None)]
+
+        histories = history_report.compute_histories(records)
+
+        self.assertThat(
+            [(history.package, history.architecture, history.runs,
+              history.p50_duration) for history in histories],
+            Equals([
+                ('testpackage1', 'amd64', 2, None),
+                ('testpackage1', 'i386', 1, None),
+                ('testpackage2', 'amd64', 1, None)]))
+
+    def test_compute_groups_by_distro_and_ppa(self):
+        records = []
+        # The same package always passes in one distro, always fails in
+        # the other, and flips in another PPA, every day.
+        for _ in range(3):
+            records += [
+                make_record(
+                    'testpackage', 'amd64', 0, None, distro='testdistro1',
+                    index_url='http://example.com/testdistro1-user-ppa'),
+                make_record(
+                    'testpackage', 'amd64', 1, None, distro='testdistro2',
+                    index_url='http://example.com/testdistro2-user-ppa'),
+                make_record(
+                    'testpackage', 'amd64', 0, None, distro='testdistro1',
+                    index_url='http://example.com/testdistro1-user-other'),
+                make_record(
+                    'testpackage', 'amd64', 1, None, distro='testdistro1',
+                    index_url='http://example.com/testdistro1-user-other')]
+
+        histories = history_report.compute_histories(records)
+
+        self.assertThat(
+            [(history.index_url, history.distro, history.runs,
+              history.flips) for history in histories],
+            Equals([
+                ('http://example.com/testdistro1-user-other',
+                 'testdistro1', 6, 5),
+                ('http://example.com/testdistro1-user-ppa',
+                 'testdistro1', 3, 0),
+                ('http://example.com/testdistro2-user-ppa',
+                 'testdistro2', 3, 0)]))
+
+
+class HistoryPrinterTestCase(unit.TestCase):
+
+    def test_print_slowest_and_flakiest(self):
+        destination = os.path.join(self.path, 'history.md')
+        histories = [
+            history_report.TestHistory(
+                index_url=None, package='slowpackage', distro='testdistro',
+                architecture='amd64', runs=2,
+                passes=2, pass_rate=1.0, flips=0, p50_duration=100,
+                p95_duration=200),
+            history_report.TestHistory(
+                index_url=None, package='flakypackage', distro='testdistro',
+                architecture='i386', runs=4,
+                passes=2, pass_rate=0.5, flips=3, p50_duration=1,
+                p95_duration=2)]
+
+        history_report.HistoryPrinter(
+            destination_path=destination, first_day='20170101',
+            last_day='20170131', histories=histories).print_report()
+
+        self.assertThat(
+            destination,
+            FileContains(
+                '# 20170101 - 20170131\n'
+                '\n'
+                '## Slowest tests\n'
+                '\n'
+                '| package | distro | architecture | runs | pass rate | flips '
+                '| p50 | p95 |\n'
+                '| --- | --- | --- | ---: | ---: | ---: | ---: | ---: |\n'
+                '| slowpackage | testdistro | amd64 | 2 | 100% | 0 | 100s '
+                '| 200s |\n'
+                '| flakypackage | testdistro | i386 | 4 | 50% | 3 | 1s '
+                '| 2s |\n'
+                '\n'
+                '## Flakiest tests\n'
+                '\n'
+                '| package | distro | architecture | runs | pass rate | flips '
+                '| p50 | p95 |\n'
+                '| --- | --- | --- | ---: | ---: | ---: | ---: | ---: |\n'
+                '| flakypackage | testdistro | i386 | 4 | 50% | 3 | 1s '
+                '| 2s |\n'
+                '\n'))
+
+    def test_print_top(self):
+        destination = os.path.join(self.path, 'history.md')
+        histories = [
+            history_report.TestHistory(
+                index_url=None, package='testpackage{}'.format(index),
+                distro='testdistro', architecture='amd64', runs=1,
+                passes=1, pass_rate=1.0, flips=0,
+                p50_duration=index, p95_duration=index)
+            for index in range(3)]
+
+        history_report.HistoryPrinter(
+            destination_path=destination, first_day='20170101',
+            last_day='20170131', histories=histories, top=2).print_report()
+
+        self.assertThat(
+            destination,
+            FileContains(matcher=MatchesAll(
+                Contains('testpackage2'), Contains('testpackage1'),
+                Not(Contains('testpackage0')), Contains('None.'))))
+
+    def test_print_unknown_pass_rate(self):
+        destination = os.path.join(self.path, 'history.md')
+        histories = [
+            history_report.TestHistory(
+                index_url=None, package='testpackage', distro='testdistro',
+                architecture='amd64', runs=1, passes=0, pass_rate=None,
+                flips=0, p50_duration=10, p95_duration=10)]
+
+        history_report.HistoryPrinter(
+            destination_path=destination, first_day='20170101',
+            last_day='20170131', histories=histories).print_report()
+
+        self.assertThat(
+            destination,
+            FileContains(matcher=Contains(
+                '| testpackage | testdistro | amd64 | 1 | - | 0 | 10s '
+                '| 10s |')))
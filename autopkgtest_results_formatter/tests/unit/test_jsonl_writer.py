@@ -0,0 +1,113 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+
+from testtools.matchers import (
+    Equals,
+    FileExists,
+    Not
+)
+
+from autopkgtest_results_formatter import (
+    errors,
+    jsonl_writer,
+    result_entry
+)
+from autopkgtest_results_formatter.tests import unit
+
+
+class JSONLWriterTestCase(unit.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.destination = os.path.join(self.path, 'test.jsonl')
+        self.entry = result_entry.ResultEntry(
+            index_url='http://example.com',
+            directory='testdistro/testarch/dummy/dummy/testday_testtime_1@')
+        self.entry.restore_record(result_entry.ResultRecord(
+            test_package='test package', exitcode='0', duration='10',
+            pull_request=False))
+
+    def read_records(self):
+        with open(self.destination) as jsonl_file:
+            return [json.loads(line) for line in jsonl_file]
+
+    def test_write_result(self):
+        with jsonl_writer.JSONLWriter(
+                destination_path=self.destination) as writer:
+            writer.write_result(self.entry)
+
+        url = 'http://example.com/{}'.format(self.entry._directory)
+        self.assertThat(self.read_records(), Equals([{
+            'identifier': 'testdistrotestarchtestdaytesttime1',
+            'day': 'testday',
+            'distro': 'testdistro',
+            'architecture': 'testarch',
+            'version': 'test package',
+            'result': True,
+            'duration': '10',
+            'links': {
+                'result': url + '/result.tar',
+                'log': url + '/log.gz',
+                'artifacts': url + '/artifacts.tar.gz'}}]))
+
+    def test_write_failure(self):
+        with jsonl_writer.JSONLWriter(
+                destination_path=self.destination) as writer:
+            writer.write_failure(
+                self.entry,
+                errors.DownloadError(url='test url', reason='test reason'))
+
+        [record] = self.read_records()
+        self.assertThat(
+            record['error'],
+            Equals('Failed to download test url: test reason.'))
+        self.assertFalse('result' in record)
+
+    def test_append(self):
+        for append in (False, True):
+            with jsonl_writer.JSONLWriter(
+                    destination_path=self.destination,
+                    append=append) as writer:
+                writer.write_result(self.entry)
+
+        self.assertThat(len(self.read_records()), Equals(2))
+
+    def test_append_does_not_write_failures(self):
+        with jsonl_writer.JSONLWriter(
+                destination_path=self.destination, append=True) as writer:
+            writer.write_failure(
+                self.entry,
+                errors.DownloadError(url='test url', reason='test reason'))
+
+        self.assertThat(self.destination, Not(FileExists()))
+
+    def test_replace(self):
+        for _ in range(2):
+            with jsonl_writer.JSONLWriter(
+                    destination_path=self.destination) as writer:
+                writer.write_result(self.entry)
+
+        self.assertThat(len(self.read_records()), Equals(1))
+
+    def test_skip_does_not_write(self):
+        with jsonl_writer.JSONLWriter(
+                destination_path=self.destination) as writer:
+            writer.skip(self.entry)
+
+        self.assertThat(self.destination, Not(FileExists()))
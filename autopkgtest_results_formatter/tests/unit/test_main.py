@@ -0,0 +1,218 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import sys
+import warnings
+from unittest import mock
+
+import fixtures
+import testscenarios
+from testtools.matchers import (
+    Contains,
+    Equals,
+    FileContains,
+    FileExists,
+    MatchesAll,
+    Not
+)
+
+from autopkgtest_results_formatter import (
+    __main__ as main_module,
+    result_entry,
+    results_formatter,
+    results_index,
+    results_store
+)
+from autopkgtest_results_formatter.tests import unit
+
+
+class BaseMainTestCase(unit.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.stderr = io.StringIO()
+        self.useFixture(fixtures.MonkeyPatch('sys.stderr', self.stderr))
+        patcher = mock.patch.object(main_module, 'run')
+        self.mock_run = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def call_main(self, *args):
+        with mock.patch.object(
+                sys, 'argv', ['autopkgtest_results_formatter'] + list(args)):
+            main_module.main()
+
+
+class MainTestCase(BaseMainTestCase):
+
+    def test_day(self):
+        self.call_main('--distros', 'testdistro', '--day', '20170101')
+
+        self.assertThat(
+            self.mock_run.call_args[0],
+            Equals((None, ['testdistro'], ['20170101'])))
+
+    def test_range(self):
+        self.call_main(
+            '--distros', 'testdistro', '--from', '20171231', '--to',
+            '20180102')
+
+        self.assertThat(
+            self.mock_run.call_args[0][2],
+            Equals(['20171231', '20180101', '20180102']))
+
+    def test_last_days(self):
+        self.call_main('--distros', 'testdistro', '--last-days', '2')
+
+        self.assertThat(self.mock_run.call_args[0][2], Equals(None))
+        self.assertThat(
+            self.mock_run.call_args[1]['last_days'], Equals(2))
+
+
+class MainErrorTestCase(testscenarios.WithScenarios, BaseMainTestCase):
+
+    scenarios = (
+        ('day and from', {
+            'args': ['--day', '20170101', '--from', '20170101'],
+            'expected_error': 'not allowed with argument'}),
+        ('no day', {
+            'args': [],
+            'expected_error': 'one of the arguments --day --from'}),
+        ('invalid day', {
+            'args': ['--day', '2017-01-01'],
+            'expected_error': "invalid day '2017-01-01'"}),
+        ('invalid to', {
+            'args': ['--from', '20170101', '--to', '20170132'],
+            'expected_error': "invalid day '20170132'"}),
+        ('to without from', {
+            'args': ['--day', '20170101', '--to', '20170102'],
+            'expected_error': '--to requires --from'}),
+        ('to before from', {
+            'args': ['--from', '20170102', '--to', '20170101'],
+            'expected_error': '--to is before --from'}),
+        ('last days and day', {
+            'args': ['--day', '20170101', '--last-days', '2'],
+            'expected_error': 'not allowed with argument'}),
+        ('no last days', {
+            'args': ['--last-days', '0'],
+            'expected_error': '--last-days must be at least 1'}),
+    )
+
+    def test_error(self):
+        self.assertRaises(
+            SystemExit, self.call_main, '--distros', 'testdistro',
+            *self.args)
+
+        self.mock_run.assert_not_called()
+        self.assertThat(
+            self.stderr.getvalue(), Contains(self.expected_error))
+
+
+class RunTestCase(unit.TestCase):
+
+    def test_run_with_a_single_day_is_deprecated(self):
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', io.StringIO()))
+        with mock.patch.object(
+                main_module.results_formatter, 'ResultsFormatter'
+                ) as mock_formatter:
+            with warnings.catch_warnings(record=True) as caught_warnings:
+                warnings.simplefilter('always')
+                main_module.run(
+                    self.path, ['testdistro'], '20170101', use_cache=False)
+
+        self.assertThat(
+            [warning.category for warning in caught_warnings],
+            Equals([DeprecationWarning]))
+        self.assertThat(
+            mock_formatter.call_args[1]['days'], Equals(['20170101']))
+
+    def test_run_last_days_follow_the_current_day(self):
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', io.StringIO()))
+        with mock.patch.object(
+                main_module, '_get_last_days',
+                return_value=['20170101', '20170102']) as mock_last_days:
+            with mock.patch.object(
+                    main_module.results_formatter, 'ResultsFormatter'
+                    ) as mock_formatter:
+                main_module.run(
+                    self.path, ['testdistro'], None, use_cache=False,
+                    watch_interval=10, last_days=2)
+            self.assertThat(
+                mock_formatter.call_args[1]['days'],
+                Equals(['20170101', '20170102']))
+            # The formatter gets the days again on each poll.
+            mock_last_days.return_value = ['20170102', '20170103']
+            get_days = mock_formatter.return_value.watch.call_args[1][
+                'get_days']
+            self.assertThat(get_days(), Equals(['20170102', '20170103']))
+
+        mock_last_days.assert_called_with(2)
+
+    def test_run_watch_writes_the_metrics_after_each_poll(self):
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', io.StringIO()))
+        metrics_path = os.path.join(self.path, 'metrics.json')
+        with mock.patch.object(
+                main_module.results_formatter, 'ResultsFormatter'
+                ) as mock_formatter:
+            main_module.run(
+                self.path, ['testdistro'], ['20170101'], use_cache=False,
+                metrics_json_path=metrics_path, watch_interval=10)
+            on_poll = mock_formatter.return_value.watch.call_args[1][
+                'on_poll']
+            os.remove(metrics_path)
+            on_poll()
+
+        self.assertThat(metrics_path, FileExists())
+
+    def test_run_writes_a_history_per_ppa(self):
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', io.StringIO()))
+        store_path = os.path.join(self.path, 'results.db')
+        ppas = [
+            results_formatter.PPA(
+                user='testuser', name='testppa{}'.format(index),
+                distros=['testdistro'])
+            for index in range(2)]
+        with results_store.ResultsStore(path=store_path) as store:
+            for index, ppa in enumerate(ppas):
+                entry = result_entry.ResultEntry(
+                    index_url=results_index.get_index_url(
+                        distro='testdistro', ppa_user=ppa.user,
+                        ppa_name=ppa.name),
+                    directory='testdistro/amd64/t/testpackage{}/'
+                              '20170101_0_1@'.format(index))
+                entry.restore_record(result_entry.ResultRecord(
+                    test_package='test', exitcode='0', duration='1',
+                    pull_request=False))
+                store.add(entry)
+        targets = [
+            (ppa, os.path.join(self.path, ppa.name)) for ppa in ppas]
+        for _, path in targets:
+            os.makedirs(path)
+
+        with mock.patch.object(
+                results_formatter, 'ResultsFormatter') as mock_formatter:
+            mock_formatter.return_value.targets = targets
+            main_module.run(
+                self.path, None, ['20170101'], ppas=ppas, use_cache=False,
+                store_path=store_path, history_days=1)
+
+        for index, (_, path) in enumerate(targets):
+            self.assertThat(
+                os.path.join(path, 'history-20170101-20170101.md'),
+                FileContains(matcher=MatchesAll(
+                    Contains('testpackage{}'.format(index)),
+                    Not(Contains('testpackage{}'.format(1 - index))))))
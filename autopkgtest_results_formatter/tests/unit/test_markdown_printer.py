@@ -18,12 +18,16 @@ import os
 import tarfile
 
 from testtools.matchers import (
+    Contains,
+    Equals,
     FileContains,
     FileExists,
+    MatchesAll,
     Not
 )
 
 from autopkgtest_results_formatter import (
+    errors,
     markdown_printer,
     result_entry
 )
@@ -120,3 +124,113 @@ class MarkDownPrinterTestCase(unit.TestCase):
                 '[artifacts]({url}/artifacts.tar.gz)\n\n'.format(
                     url=expected_url)
             ))
+
+    def test_print_one_failed_download(self):
+        destination = os.path.join(self.path, 'test.md')
+        test_result_dir = (
+            'testdistro/testarch/dummy/dummy/testday_dummy_testid@')
+        entry = result_entry.ResultEntry(
+            index_url='http://example.com', directory=test_result_dir)
+        printer = markdown_printer.MarkdownPrinter(
+            destination_path=destination,
+            result_entries=[],
+            failed_entries=[
+                (entry, errors.DownloadError(
+                    url='test url', reason='test reason'))])
+        printer.print_results()
+
+        expected_url = 'http://example.com/{}'.format(test_result_dir)
+        self.assertThat(
+            destination,
+            FileContains(
+                '# testday\n'
+                '\n'
+                '## testdistro\n'
+                '\n'
+                '### testarch\n'
+                '\n'
+                ':warning: Failed to download test url: test reason.\n\n'
+                '[result]({url}/result.tar) | '
+                '[log]({url}/log.gz) | '
+                '[artifacts]({url}/artifacts.tar.gz)\n\n'.format(
+                    url=expected_url)
+            ))
+
+
+class MarkdownWriterTestCase(unit.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.destination = os.path.join(self.path, 'test.md')
+
+    def make_entry(self, directory, test_package):
+        entry = result_entry.ResultEntry(
+            index_url='http://example.com', directory=directory)
+        entry.restore_record(result_entry.ResultRecord(
+            test_package=test_package, exitcode='0', duration='1',
+            pull_request=False))
+        return entry
+
+    def test_write_entries_grouped_in_index_order(self):
+        first = self.make_entry(
+            'xenial/testarch2/dummy/dummy/testday_dummy_1@', 'first')
+        second = self.make_entry(
+            'xenial/testarch1/dummy/dummy/testday_dummy_2@', 'second')
+        third = self.make_entry(
+            'bionic/testarch1/dummy/dummy/testday_dummy_3@', 'third')
+        fourth = self.make_entry(
+            'xenial/testarch2/dummy/dummy/testday_dummy_4@', 'fourth')
+
+        with markdown_printer.MarkdownWriter(
+                destination_path=self.destination,
+                entries=[first, second, third, fourth]) as writer:
+            for entry in (fourth, third, first, second):
+                writer.write_result(entry)
+
+        with open(self.destination) as markdown_file:
+            contents = markdown_file.read()
+        # The distros and the architectures are not sorted, they are in the
+        # order of their first entries.
+        self.assertThat(
+            [line for line in contents.splitlines()
+             if line.startswith('#') or
+             line in ('first', 'second', 'third', 'fourth')],
+            Equals([
+                '# testday', '## xenial', '### testarch2', 'first',
+                'fourth', '### testarch1', 'second', '## bionic',
+                '### testarch1', 'third']))
+
+    def test_write_keeps_entries_until_previous_are_ready(self):
+        first = self.make_entry(
+            'testdistro/testarch/dummy/dummy/testday_dummy_1@', 'first')
+        second = self.make_entry(
+            'testdistro/testarch/dummy/dummy/testday_dummy_2@', 'second')
+        third = self.make_entry(
+            'testdistro/testarch/dummy/dummy/testday_dummy_3@', 'third')
+
+        with markdown_printer.MarkdownWriter(
+                destination_path=self.destination,
+                entries=[first, second, third]) as writer:
+            writer.write_result(first)
+            writer.write_result(third)
+            # The file has the entries ready so far.
+            self.assertThat(
+                self.destination,
+                FileContains(matcher=MatchesAll(
+                    Contains('first'), Not(Contains('third')))))
+            writer.skip(second)
+            self.assertThat(
+                self.destination,
+                FileContains(matcher=MatchesAll(
+                    Contains('third'), Not(Contains('second')))))
+
+    def test_write_only_skipped_entries(self):
+        entry = self.make_entry(
+            'testdistro/testarch/dummy/dummy/testday_dummy_1@', 'test')
+
+        with markdown_printer.MarkdownWriter(
+                destination_path=self.destination,
+                entries=[entry]) as writer:
+            writer.skip(entry)
+
+        self.assertThat(self.destination, Not(FileExists()))
@@ -0,0 +1,85 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+
+import testscenarios
+from testtools.matchers import Equals
+
+from autopkgtest_results_formatter import (
+    report_state,
+    result_entry
+)
+from autopkgtest_results_formatter.tests import unit
+
+
+class ReportStateTestCase(unit.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.state_path = os.path.join(self.path, 'state.json')
+        self.record = result_entry.ResultRecord(
+            test_package='test package', exitcode='0', duration='10',
+            pull_request=False)
+
+    def make_entry(self, directory='test_directory'):
+        return result_entry.ResultEntry(
+            index_url='http://example.com', directory=directory)
+
+    def test_restore_unknown_entry(self):
+        state = report_state.ReportState(path=self.state_path)
+        self.assertFalse(state.restore(self.make_entry()))
+
+    def test_save_and_restore(self):
+        entry = self.make_entry()
+        entry.restore_record(self.record)
+        state = report_state.ReportState(path=self.state_path)
+        state.add(entry)
+        state.save()
+
+        new_state = report_state.ReportState(path=self.state_path)
+        new_entry = self.make_entry()
+        self.assertTrue(new_state.restore(new_entry))
+        self.assertThat(new_entry.record, Equals(self.record))
+        self.assertFalse(
+            new_state.restore(self.make_entry('other_directory')))
+
+
+class InvalidReportStateTestCase(
+        testscenarios.WithScenarios, unit.TestCase):
+
+    scenarios = (
+        ('truncated', {'contents': '{"version": 1, "records": {"http'}),
+        ('not an object', {'contents': '[]'}),
+        ('without version', {'contents': json.dumps({'records': {
+            'http://example.com/test_directory': [
+                'test', '0', '10', False]}})}),
+        ('other version', {'contents': json.dumps({
+            'version': 0, 'records': {}})}),
+        ('other fields', {'contents': json.dumps({
+            'version': 1, 'records': {
+                'http://example.com/test_directory': ['test', '0']}})}),
+    )
+
+    def test_invalid_state_is_empty(self):
+        state_path = os.path.join(self.path, 'state.json')
+        with open(state_path, 'w') as state_file:
+            state_file.write(self.contents)
+
+        state = report_state.ReportState(path=state_path)
+        self.assertFalse(state.restore(result_entry.ResultEntry(
+            index_url='http://example.com', directory='test_directory')))
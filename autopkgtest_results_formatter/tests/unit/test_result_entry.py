@@ -14,15 +14,28 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import io
 import json
 import os
 import tarfile
 from unittest import mock
 
-from testtools.matchers import Equals
+from testtools.matchers import (
+    Equals,
+    HasLength,
+    LessThan
+)
 
-from autopkgtest_results_formatter import result_entry
-from autopkgtest_results_formatter.tests import unit
+from autopkgtest_results_formatter import (
+    errors,
+    http_client,
+    result_entry,
+    results_cache
+)
+from autopkgtest_results_formatter.tests import (
+    fixture_setup,
+    unit
+)
 
 
 class ResultEntryTestCase(unit.TestCase):
@@ -60,6 +73,14 @@ class ResultEntryTestCase(unit.TestCase):
                            'dummy_dummy_dummy')).architecture,
             Equals('test_arch'))
 
+    def test_get_package(self):
+        self.assertThat(
+            result_entry.ResultEntry(
+                index_url='dummy',
+                directory=('dummy/dummy/dummy/test_package/'
+                           'dummy_dummy_dummy')).package,
+            Equals('test_package'))
+
     def test_get_day(self):
         self.assertThat(
             result_entry.ResultEntry(
@@ -77,14 +98,100 @@ class ResultEntryTestCase(unit.TestCase):
             Equals('test_distrotest_archtestdaytesttimetestid'))
 
     def test_download_result_makes_request(self):
-        with mock.patch('urllib.request.urlretrieve') as mock_urlretrieve:
-            with result_entry.ResultEntry(
+        client = mock.Mock()
+        with result_entry.ResultEntry(
+                index_url='http://example.com',
+                directory='test_directory', client=client) as entry:
+            entry._download_result()
+
+        client.retrieve.assert_called_once_with(
+            'http://example.com/test_directory/result.tar', mock.ANY)
+
+    def test_download_result_adds_to_cache(self):
+        entry_dir = self.make_result_tar([])
+        cache = results_cache.ResultsCache(
+            path=os.path.join(self.path, 'cache'))
+
+        with result_entry.ResultEntry(
+                index_url='file://{}'.format(self.path),
+                directory=entry_dir, cache=cache) as entry:
+            result_file_path = entry._download_result()
+
+        self.assertThat(
+            cache.get('file://{}/{}/result.tar'.format(self.path, entry_dir)),
+            Equals(result_file_path))
+
+    def test_download_result_uses_cache(self):
+        cache = results_cache.ResultsCache(
+            path=os.path.join(self.path, 'cache'))
+        cached_file_path = cache.add(
+            'http://example.com/test_directory/result.tar',
+            self.make_result_tar([]) + '/result.tar')
+
+        client = mock.Mock()
+        with result_entry.ResultEntry(
+                index_url='http://example.com',
+                directory='test_directory', cache=cache,
+                client=client) as entry:
+            result_file_path = entry._download_result()
+
+        client.retrieve.assert_not_called()
+        self.assertThat(result_file_path, Equals(cached_file_path))
+
+    def test_init_does_not_create_files(self):
+        with mock.patch('tempfile.mkdtemp') as mock_mkdtemp:
+            with mock.patch('tempfile.mkstemp') as mock_mkstemp:
+                result_entry.ResultEntry(
                     index_url='http://example.com',
-                    directory='test_directory') as entry:
-                entry._download_result()
+                    directory='test_directory')
+
+        mock_mkdtemp.assert_not_called()
+        mock_mkstemp.assert_not_called()
+
+    def test_cleanup_removes_downloaded_result(self):
+        entry_dir = self.make_result_tar([])
+        scratch_path = os.path.join(self.path, 'scratch')
+        os.makedirs(scratch_path)
+
+        with result_entry.ResultEntry(
+                index_url='file://{}'.format(self.path),
+                directory=entry_dir, scratch_path=scratch_path) as entry:
+            result_file_path = entry._download_result()
+            self.assertThat(
+                os.path.dirname(result_file_path), Equals(scratch_path))
+
+        self.assertThat(os.listdir(scratch_path), Equals([]))
+
+    def test_failed_download_removes_file(self):
+        scratch_path = os.path.join(self.path, 'scratch')
+        os.makedirs(scratch_path)
+
+        with result_entry.ResultEntry(
+                index_url='file://{}'.format(self.path),
+                directory='missing', scratch_path=scratch_path,
+                client=http_client.HTTPClient(retries=0)) as entry:
+            self.assertRaises(
+                errors.DownloadError, entry._download_result)
+
+        self.assertThat(os.listdir(scratch_path), Equals([]))
+
+    def test_entries_reuse_the_client_connections(self):
+        storage = self.useFixture(fixture_setup.FakeObjectStorage())
+        client = http_client.HTTPClient()
+        self.addCleanup(client.close)
+        cache = results_cache.ResultsCache(
+            path=os.path.join(self.path, 'cache'))
+        entry_dir = self.make_result_tar([])
+        with open(os.path.join(entry_dir, 'result.tar'), 'rb') as result_tar:
+            contents = result_tar.read()
+        for directory in ('test_directory1', 'test_directory2'):
+            storage.files['/index/{}/result.tar'.format(directory)] = contents
+            with result_entry.ResultEntry(
+                    index_url=storage.url + '/index', directory=directory,
+                    cache=cache, client=client) as entry:
+                entry.fetch()
 
-        mock_urlretrieve.assert_called_once_with(
-            'http://example.com/test_directory/result.tar', filename=mock.ANY)
+        self.assertThat(storage.connections, Equals(1))
 
     def test_is_pull_request(self):
         test_info_file_path = os.path.join(self.path, 'testinfo.json')
@@ -113,6 +220,70 @@ class ResultEntryTestCase(unit.TestCase):
                 directory=entry_dir) as entry:
             self.assertFalse(entry.is_pull_request())
 
+    def make_pull_request_storage(self, files):
+        storage = self.useFixture(fixture_setup.FakeObjectStorage())
+        contents = io.BytesIO()
+        with tarfile.open(fileobj=contents, mode='w') as tar_file:
+            for name, data in files:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar_file.addfile(info, io.BytesIO(data))
+        storage.files['/index/test_directory/result.tar'] = (
+            contents.getvalue())
+        return storage
+
+    def test_is_pull_request_reads_the_beginning_of_the_result(self):
+        storage = self.make_pull_request_storage([
+            ('testinfo.json', json.dumps({
+                'custom_environment': ['UPSTREAM_PULL_REQUEST=1']}).encode()),
+            ('testbed-packages', b'x' * 1024 * 1024)])
+        client = http_client.HTTPClient()
+        self.addCleanup(client.close)
+
+        with result_entry.ResultEntry(
+                index_url=storage.url + '/index', directory='test_directory',
+                client=client) as entry:
+            self.assertTrue(entry.is_pull_request())
+
+        self.assertThat(storage.requests, HasLength(1))
+        self.assertThat(
+            storage.requests[0][1]['Range'], Equals('bytes=0-65535'))
+        self.assertThat(storage.bytes_sent, LessThan(1024 * 1024))
+
+    def test_is_not_pull_request_downloads_the_result(self):
+        storage = self.make_pull_request_storage([
+            ('testinfo.json', b'{}'),
+            ('testbed-packages', b'x' * 1024 * 1024),
+            ('exitcode', b'0')])
+        client = http_client.HTTPClient()
+        self.addCleanup(client.close)
+
+        with result_entry.ResultEntry(
+                index_url=storage.url + '/index', directory='test_directory',
+                client=client) as entry:
+            self.assertFalse(entry.is_pull_request())
+            self.assertTrue(entry.is_success())
+
+        self.assertThat(storage.requests, HasLength(2))
+
+    def test_is_pull_request_uses_cache(self):
+        storage = self.make_pull_request_storage([
+            ('testinfo.json', json.dumps({
+                'custom_environment': ['UPSTREAM_PULL_REQUEST=1']}).encode())])
+        client = http_client.HTTPClient()
+        self.addCleanup(client.close)
+        cache = results_cache.ResultsCache(
+            path=os.path.join(self.path, 'cache'))
+
+        for _ in range(2):
+            with result_entry.ResultEntry(
+                    index_url=storage.url + '/index',
+                    directory='test_directory', cache=cache,
+                    client=client) as entry:
+                self.assertTrue(entry.is_pull_request())
+
+        self.assertThat(storage.requests, HasLength(1))
+
     def test_is_success(self):
         test_exitcode_file_path = os.path.join(self.path, 'exitcode')
         with open(test_exitcode_file_path, 'w') as test_info_file:
@@ -165,6 +336,154 @@ class ResultEntryTestCase(unit.TestCase):
                 entry.get_duration(),
                 Equals('test_duration'))
 
+    def test_get_result_does_not_write_files(self):
+        duration_path = os.path.join(self.path, 'duration')
+        with open(duration_path, 'w') as duration_file:
+            duration_file.write('test_duration')
+        entry_dir = self.make_result_tar(
+            [(duration_path, 'duration')])
+
+        scratch_path = os.path.join(self.path, 'scratch')
+        os.makedirs(scratch_path)
+
+        with result_entry.ResultEntry(
+                index_url='file://{}'.format(self.path),
+                directory=entry_dir, scratch_path=scratch_path) as entry:
+            entry.get_duration()
+            self.assertThat(os.listdir(scratch_path), Equals([]))
+
+    def test_get_result_with_cache_does_not_extract_files(self):
+        duration_path = os.path.join(self.path, 'duration')
+        with open(duration_path, 'w') as duration_file:
+            duration_file.write('test_duration')
+        entry_dir = self.make_result_tar(
+            [(duration_path, 'duration')])
+        cache_path = os.path.join(self.path, 'cache')
+        scratch_path = os.path.join(self.path, 'scratch')
+        os.makedirs(scratch_path)
+
+        with result_entry.ResultEntry(
+                index_url='file://{}'.format(self.path),
+                directory=entry_dir,
+                cache=results_cache.ResultsCache(path=cache_path),
+                scratch_path=scratch_path) as entry:
+            self.assertThat(entry.get_duration(), Equals('test_duration'))
+            self.assertThat(os.listdir(scratch_path), Equals([]))
+
+        self.assertThat(
+            os.listdir(os.path.join(cache_path, 'results')), HasLength(1))
+
+    def test_stream_result_stops_after_needed_members(self):
+        files = []
+        for name in ('testinfo.json', 'testpkg-version', 'exitcode',
+                     'duration', 'testbed-packages'):
+            file_path = os.path.join(self.path, name)
+            with open(file_path, 'w') as file_:
+                file_.write('{}' if name == 'testinfo.json' else 'test')
+            files.append((file_path, name))
+        entry_dir = self.make_result_tar(files)
+
+        with result_entry.ResultEntry(
+                index_url='file://{}'.format(self.path),
+                directory=entry_dir) as entry:
+            with mock.patch(
+                    'autopkgtest_results_formatter.result_entry.'
+                    '_RESULT_MEMBERS', ('testinfo.json', 'exitcode')):
+                with mock.patch.object(
+                        tarfile.TarFile, 'next', autospec=True,
+                        side_effect=tarfile.TarFile.next) as mock_next:
+                    entry.fetch()
+
+        # The last two members and the end of the archive are not read.
+        self.assertThat(mock_next.call_count, LessThan(5))
+
+    def test_get_result_with_relative_member_names(self):
+        duration_path = os.path.join(self.path, 'duration')
+        with open(duration_path, 'w') as duration_file:
+            duration_file.write('test_duration')
+        entry_dir = self.make_result_tar(
+            [(duration_path, './duration')])
+
+        with result_entry.ResultEntry(
+                index_url='file://{}'.format(self.path),
+                directory=entry_dir) as entry:
+            self.assertThat(entry.get_duration(), Equals('test_duration'))
+
+    def test_record_is_read_once(self):
+        duration_path = os.path.join(self.path, 'duration')
+        with open(duration_path, 'w') as duration_file:
+            duration_file.write('test_duration')
+        entry_dir = self.make_result_tar(
+            [(duration_path, 'duration')])
+
+        with result_entry.ResultEntry(
+                index_url='file://{}'.format(self.path),
+                directory=entry_dir) as entry:
+            with mock.patch.object(
+                    entry, '_stream_result',
+                    wraps=entry._stream_result) as mock_stream_result:
+                entry.is_pull_request()
+                entry.is_success()
+                entry.get_test_package()
+                entry.get_duration()
+
+        self.assertThat(mock_stream_result.call_count, Equals(1))
+        self.assertThat(
+            entry.record,
+            Equals(result_entry.ResultRecord(
+                test_package=None, exitcode=None, duration='test_duration',
+                pull_request=False)))
+
+    def test_record_with_decode_reads_the_complete_result(self):
+        duration_path = os.path.join(self.path, 'duration')
+        with open(duration_path, 'w') as duration_file:
+            duration_file.write('test_duration')
+        entry_dir = self.make_result_tar(
+            [(duration_path, 'duration')])
+        with open(os.path.join(
+                self.path, entry_dir, 'result.tar'), 'rb') as result_file:
+            result_data = result_file.read()
+        scratch_path = os.path.join(self.path, 'scratch')
+        os.makedirs(scratch_path)
+        mock_decode = mock.Mock(side_effect=result_entry.parse_result)
+
+        with result_entry.ResultEntry(
+                index_url='file://{}'.format(self.path),
+                directory=entry_dir, scratch_path=scratch_path,
+                decode=mock_decode) as entry:
+            self.assertThat(entry.get_duration(), Equals('test_duration'))
+            # The downloaded result is removed after it is read.
+            self.assertThat(os.listdir(scratch_path), Equals([]))
+
+        mock_decode.assert_called_once_with(result_data)
+
+    def test_parse_result(self):
+        result_data = io.BytesIO()
+        with tarfile.open(fileobj=result_data, mode='w') as result_tar:
+            for name, value in (
+                    ('testinfo.json', json.dumps({'custom_environment': [
+                        'UPSTREAM_PULL_REQUEST=1']})),
+                    ('testpkg-version', 'test version'),
+                    ('exitcode', '0'),
+                    ('duration', '10')):
+                data = value.encode()
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                result_tar.addfile(info, io.BytesIO(data))
+
+        self.assertThat(
+            result_entry.parse_result(result_data.getvalue()),
+            Equals(result_entry.ResultRecord(
+                test_package='test version', exitcode='0', duration='10',
+                pull_request=True)))
+
+    def test_record_is_immutable(self):
+        record = result_entry.ResultRecord(
+            test_package='test', exitcode='0', duration='1',
+            pull_request=False)
+        self.assertRaises(AttributeError, setattr, record, 'exitcode', '1')
+        self.assertRaises(AttributeError, getattr, record, '__dict__')
+
     def test_get_links(self):
         entry = result_entry.ResultEntry(
             index_url='http://example.com', directory='test_directory')
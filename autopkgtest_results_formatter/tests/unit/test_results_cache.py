@@ -0,0 +1,134 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import threading
+
+import fixtures
+from testtools.matchers import (
+    Equals,
+    FileContains,
+    FileExists,
+    Is,
+    Not
+)
+
+from autopkgtest_results_formatter import results_cache
+from autopkgtest_results_formatter.tests import unit
+
+
+class ResultsCacheTestCase(unit.TestCase):
+
+    def make_file(self, name, contents):
+        file_path = os.path.join(self.path, name)
+        with open(file_path, 'w') as file_:
+            file_.write(contents)
+        return file_path
+
+    def test_default_path_uses_xdg_cache_home(self):
+        self.useFixture(
+            fixtures.EnvironmentVariable('XDG_CACHE_HOME', '/test/cache'))
+        self.assertThat(
+            results_cache.get_default_path(),
+            Equals('/test/cache/autopkgtest_results_formatter'))
+
+    def test_get_missing_counts_miss(self):
+        cache = results_cache.ResultsCache(path=self.path)
+        self.assertThat(cache.get('http://example.com/test'), Is(None))
+        self.assertThat((cache.hits, cache.misses), Equals((0, 1)))
+
+    def test_add_and_get_counts_hit(self):
+        cache = results_cache.ResultsCache(path=self.path)
+        cached_file_path = cache.add(
+            'http://example.com/test', self.make_file('test', 'test'))
+
+        self.assertThat(
+            cache.get('http://example.com/test'), Equals(cached_file_path))
+        self.assertThat(cached_file_path, FileContains('test'))
+        self.assertThat((cache.hits, cache.misses), Equals((1, 0)))
+
+    def test_add_evicts_least_recently_used(self):
+        cache = results_cache.ResultsCache(path=self.path, max_size=10)
+        first_path = cache.add(
+            'http://example.com/first', self.make_file('first', 'first'))
+        cache.release(first_path)
+        os.utime(first_path, (0, 0))
+        second_path = cache.add(
+            'http://example.com/second', self.make_file('second', 'secnd'))
+        cache.release(second_path)
+        os.utime(second_path, (1, 1))
+        # Use the first file so the second is the least recently used.
+        cache.release(cache.get('http://example.com/first'))
+        third_path = cache.add(
+            'http://example.com/third', self.make_file('third', 'third'))
+
+        self.assertThat(first_path, FileExists())
+        self.assertThat(second_path, Not(FileExists()))
+        self.assertThat(third_path, FileExists())
+
+    def test_add_does_not_evict_archives_in_use(self):
+        cache = results_cache.ResultsCache(path=self.path, max_size=10)
+        cache.release(cache.add(
+            'http://example.com/first', self.make_file('first', 'first')))
+        got_path = threading.Event()
+        added = threading.Event()
+        contents = []
+
+        def _read():
+            file_path = cache.get('http://example.com/first')
+            got_path.set()
+            added.wait()
+            with open(file_path) as file_:
+                contents.append(file_.read())
+            cache.release(file_path)
+
+        reader = threading.Thread(target=_read)
+        reader.start()
+        got_path.wait()
+        # Another thread adds archives over the maximum size while the first
+        # one is being read.
+        for name in ('second', 'third'):
+            cache.release(cache.add(
+                'http://example.com/{}'.format(name),
+                self.make_file(name, name)))
+        added.set()
+        reader.join()
+
+        self.assertThat(contents, Equals(['first']))
+        # Once it is released, it can be evicted.
+        first_path = cache.get('http://example.com/first')
+        cache.release(first_path)
+        os.utime(first_path, (0, 0))
+        cache.release(cache.add(
+            'http://example.com/fourth', self.make_file('fourth', 'forth')))
+        self.assertThat(first_path, Not(FileExists()))
+
+    def test_get_unknown_pull_request(self):
+        cache = results_cache.ResultsCache(path=self.path)
+        self.assertThat(
+            cache.get_pull_request('http://example.com/test'), Is(None))
+
+    def test_save_and_get_pull_request(self):
+        cache = results_cache.ResultsCache(path=self.path)
+        cache.save_pull_request('http://example.com/pull_request', True)
+        cache.save_pull_request('http://example.com/not_pull_request', False)
+
+        new_cache = results_cache.ResultsCache(path=self.path)
+        self.assertTrue(
+            new_cache.get_pull_request('http://example.com/pull_request'))
+        self.assertThat(
+            new_cache.get_pull_request('http://example.com/not_pull_request'),
+            Is(False))
@@ -0,0 +1,616 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import json
+import os
+import tarfile
+import warnings
+from unittest import mock
+
+from testtools.matchers import (
+    Contains,
+    DirExists,
+    Equals,
+    FileContains,
+    FileExists,
+    LessThan,
+    MatchesAll,
+    Not
+)
+
+from autopkgtest_results_formatter import (
+    http_client,
+    markdown_printer,
+    result_entry,
+    results_formatter,
+    results_index,
+    results_store,
+    run_metrics
+)
+from autopkgtest_results_formatter.tests import unit
+
+
+class ResultsFormatterTestCase(unit.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.destination = os.path.join(self.path, 'destination')
+        os.makedirs(self.destination)
+        self.results_path = os.path.join(self.path, 'results')
+        self.index_paths = {}
+        patcher = mock.patch.object(
+            results_index.ResultsIndex, '_download_index', autospec=True,
+            side_effect=lambda index: self.index_paths[
+                os.path.basename(index.url)])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_result_entry(
+            self, directory, *, pull_request=False, exitcode='0',
+            ppa='testuser-testppa'):
+        distro = directory.split('/')[0]
+        index_name = 'autopkgtest-{}-{}'.format(distro, ppa)
+        entry_path = os.path.join(self.results_path, index_name, directory)
+        os.makedirs(entry_path)
+        test_info = {}
+        if pull_request:
+            test_info['custom_environment'] = ['UPSTREAM_PULL_REQUEST=1']
+        files = (
+            ('testinfo.json', json.dumps(test_info)),
+            ('exitcode', exitcode),
+            ('testpkg-version', 'testpackage testversion'),
+            ('duration', '10'))
+        with tarfile.open(
+                os.path.join(entry_path, 'result.tar'), 'w') as tar_file:
+            for name, value in files:
+                data = value.encode()
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar_file.addfile(info, io.BytesIO(data))
+        index_path = self.index_paths.setdefault(
+            index_name, os.path.join(self.path, '{}.index'.format(index_name)))
+        with open(index_path, 'a') as index_file:
+            index_file.write('{}/result.tar\n'.format(directory))
+
+    def make_formatter(self, distros, *, days=('20170101',), **kwargs):
+        return results_formatter.ResultsFormatter(
+            destination_path=self.destination, distros=distros,
+            ppa_user='testuser', ppa_name='testppa', days=days,
+            base_results_url='file://{}'.format(self.results_path),
+            **kwargs)
+
+    def test_format_skips_pull_requests(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00002@',
+            pull_request=True)
+
+        self.make_formatter(['testdistro']).format()
+
+        destination = os.path.join(self.destination, '20170101.md')
+        self.assertThat(destination, FileContains(matcher=Contains('00001')))
+        self.assertThat(
+            destination, FileContains(matcher=Not(Contains('00002'))))
+
+    def test_format_fetches_all_entries_with_workers(self):
+        for identifier in range(10):
+            self.make_result_entry(
+                'testdistro/testarch/t/testpackage/'
+                '20170101_000000_{:05}@'.format(identifier))
+
+        with mock.patch.object(
+                result_entry.ResultEntry, 'fetch',
+                autospec=True) as mock_fetch:
+            with mock.patch.object(
+                    result_entry.ResultEntry, 'is_pull_request',
+                    return_value=False):
+                self.make_formatter(['testdistro'], workers=3).format()
+
+        self.assertThat(mock_fetch.call_count, Equals(10))
+
+    def test_format_does_not_fetch_pull_requests(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00002@',
+            pull_request=True)
+
+        with mock.patch.object(
+                result_entry.ResultEntry, 'fetch', autospec=True,
+                side_effect=result_entry.ResultEntry.fetch) as mock_fetch:
+            self.make_formatter(['testdistro']).format()
+
+        self.assertThat(
+            [call[0][0].identifier for call in mock_fetch.call_args_list],
+            Equals(['testdistrotestarch2017010100000000001']))
+
+    def test_format_with_parallel_indexes_merges_distros(self):
+        self.make_result_entry(
+            'testdistro1/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_result_entry(
+            'testdistro2/testarch/t/testpackage/20170101_000000_00002@')
+
+        self.make_formatter(
+            ['testdistro1', 'testdistro2'], parallel_indexes=True).format()
+
+        destination = os.path.join(self.destination, '20170101.md')
+        self.assertThat(
+            destination,
+            FileContains(matcher=MatchesAll(
+                Contains('## testdistro1'), Contains('## testdistro2'))))
+
+    def test_parallel_indexes_are_exited_on_error(self):
+        self.make_result_entry(
+            'testdistro1/testarch/t/testpackage/20170101_000000_00001@')
+        formatter = self.make_formatter(
+            ['testdistro1', 'testdistro2'], parallel_indexes=True)
+
+        with mock.patch.object(
+                results_index.ResultsIndex, '__exit__', autospec=True,
+                return_value=False) as mock_exit:
+            self.assertRaises(KeyError, formatter.format)
+
+        self.assertThat(mock_exit.call_count, Equals(1))
+
+    def test_incremental_format_only_fetches_new_entries(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_formatter(['testdistro'], incremental=True).format()
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00002@')
+
+        with mock.patch.object(
+                result_entry.ResultEntry, 'fetch', autospec=True,
+                side_effect=result_entry.ResultEntry.fetch) as mock_fetch:
+            self.make_formatter(['testdistro'], incremental=True).format()
+
+        self.assertThat(
+            [call[0][0].identifier for call in mock_fetch.call_args_list],
+            Equals(['testdistrotestarch2017010100000000002']))
+        destination = os.path.join(self.destination, '20170101.md')
+        self.assertThat(
+            destination,
+            FileContains(matcher=MatchesAll(
+                Contains('00001'), Contains('00002'))))
+
+    def test_incremental_format_appends_new_entries_to_jsonl(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00002@',
+            pull_request=True)
+        self.make_formatter(
+            ['testdistro'], incremental=True, jsonl=True).format()
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00003@')
+        self.make_formatter(
+            ['testdistro'], incremental=True, jsonl=True).format()
+
+        with open(os.path.join(self.destination, '20170101.jsonl')) as jsonl:
+            identifiers = [json.loads(line)['identifier'] for line in jsonl]
+        self.assertThat(identifiers, Equals([
+            'testdistrotestarch2017010100000000001',
+            'testdistrotestarch2017010100000000003']))
+
+    def test_incremental_format_writes_restored_entries_to_new_jsonl(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_formatter(['testdistro'], incremental=True).format()
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00002@')
+        self.make_formatter(
+            ['testdistro'], incremental=True, jsonl=True).format()
+
+        with open(os.path.join(self.destination, '20170101.jsonl')) as jsonl:
+            identifiers = [json.loads(line)['identifier'] for line in jsonl]
+        self.assertThat(identifiers, Equals([
+            'testdistrotestarch2017010100000000001',
+            'testdistrotestarch2017010100000000002']))
+
+    def test_incremental_format_does_not_append_failures_to_jsonl(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_formatter(
+            ['testdistro'], incremental=True, jsonl=True).format()
+        with open(self.index_paths[
+                'autopkgtest-testdistro-testuser-testppa'], 'a') as index:
+            # An entry without result archive.
+            index.write(
+                'testdistro/testarch/t/testpackage/'
+                '20170101_000000_00002@/result.tar\n')
+        for _ in range(2):
+            self.make_formatter(
+                ['testdistro'], incremental=True, jsonl=True,
+                client=http_client.HTTPClient(retries=0)).format()
+
+        with open(os.path.join(self.destination, '20170101.jsonl')) as jsonl:
+            identifiers = [json.loads(line)['identifier'] for line in jsonl]
+        self.assertThat(identifiers, Equals([
+            'testdistrotestarch2017010100000000001']))
+
+    def test_format_adds_entries_to_store(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@',
+            exitcode='4')
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00002@',
+            pull_request=True)
+
+        store_path = os.path.join(self.path, 'results.db')
+        with results_store.ResultsStore(path=store_path) as store:
+            self.make_formatter(['testdistro'], store=store).format()
+
+        with results_store.ResultsStore(path=store_path) as store:
+            records = list(store.iter_records(
+                '20170101', '20170101', include_pull_requests=True))
+        self.assertThat(
+            [(record.identifier, record.pull_request) for record in records],
+            Equals([
+                ('testdistrotestarch2017010100000000001', False),
+                ('testdistrotestarch2017010100000000002', True)]))
+        self.assertThat(records[0].exitcode, Equals(4))
+
+    def test_format_measures_the_stages(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00002@',
+            pull_request=True)
+        metrics = run_metrics.Metrics()
+
+        self.make_formatter(['testdistro'], metrics=metrics).format()
+
+        metrics_dict = metrics.to_dict()
+        self.assertThat(
+            sorted(metrics_dict['timers']),
+            Equals(['fetch', 'format', 'index_download', 'index_scan',
+                    'markdown_write', 'result_probe']))
+        self.assertThat(
+            {name: value for name, value in metrics_dict['counters'].items()
+             if not name.endswith('_bytes')},
+            Equals({
+                'index_entries': 2, 'pull_requests': 1,
+                'markdown_entries': 1}))
+        self.assertTrue(metrics_dict['counters']['index_file_bytes'])
+        self.assertTrue(metrics_dict['counters']['result_bytes'])
+
+    def test_watch_only_processes_new_entries(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170102_000000_00002@')
+
+        def _add_entry(interval):
+            self.make_result_entry(
+                'testdistro/testarch/t/testpackage/20170101_000000_00003@')
+
+        with mock.patch('time.sleep', side_effect=_add_entry) as mock_sleep:
+            with mock.patch.object(
+                    markdown_printer.MarkdownWriter, '__init__',
+                    autospec=True,
+                    side_effect=markdown_printer.MarkdownWriter.__init__
+                    ) as mock_writer:
+                with mock.patch.object(
+                        result_entry.ResultEntry, 'fetch', autospec=True,
+                        side_effect=result_entry.ResultEntry.fetch
+                        ) as mock_fetch:
+                    self.make_formatter(
+                        ['testdistro'], days=['20170101', '20170102']
+                    ).watch(interval=10, polls=1)
+
+        mock_sleep.assert_called_once_with(10)
+        fetched = [
+            call[0][0].identifier for call in mock_fetch.call_args_list]
+        # The entries of the first poll are fetched concurrently.
+        self.assertThat(
+            sorted(fetched[:2]),
+            Equals(['testdistrotestarch2017010100000000001',
+                    'testdistrotestarch2017010200000000002']))
+        self.assertThat(
+            fetched[2:], Equals(['testdistrotestarch2017010100000000003']))
+        # The report of the second day is not written again.
+        self.assertThat(
+            [os.path.basename(call[1]['destination_path'])
+             for call in mock_writer.call_args_list],
+            Equals(['20170101.md', '20170102.md', '20170101.md']))
+        self.assertThat(
+            os.path.join(self.destination, '20170101.md'),
+            FileContains(matcher=MatchesAll(
+                Contains('00001'), Contains('00003'))))
+
+    def test_watch_follows_the_days(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170102_000000_00002@')
+        get_days = mock.Mock(side_effect=[['20170101'], ['20170102']])
+
+        with mock.patch('time.sleep'):
+            self.make_formatter(['testdistro']).watch(
+                interval=10, polls=1, get_days=get_days)
+
+        self.assertThat(get_days.call_count, Equals(2))
+        self.assertThat(
+            os.path.join(self.destination, '20170101.md'),
+            FileContains(matcher=Contains('00001')))
+        self.assertThat(
+            os.path.join(self.destination, '20170102.md'),
+            FileContains(matcher=Contains('00002')))
+
+    def test_watch_calls_on_poll_after_each_poll(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+        on_poll = mock.Mock()
+
+        with mock.patch('time.sleep'):
+            self.make_formatter(['testdistro']).watch(
+                interval=10, polls=2, on_poll=on_poll)
+
+        self.assertThat(on_poll.call_count, Equals(3))
+
+    def test_watch_counts_pull_requests_once(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@',
+            pull_request=True)
+
+        def _add_entry(interval):
+            self.make_result_entry(
+                'testdistro/testarch/t/testpackage/20170101_000000_00002@')
+
+        metrics = run_metrics.Metrics()
+        with mock.patch('time.sleep', side_effect=_add_entry):
+            self.make_formatter(['testdistro'], metrics=metrics).watch(
+                interval=10, polls=1)
+
+        self.assertThat(
+            metrics.to_dict()['counters']['pull_requests'], Equals(1))
+
+    def test_format_days_writes_a_report_per_day(self):
+        self.make_result_entry(
+            'testdistro1/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_result_entry(
+            'testdistro1/testarch/t/testpackage/20170102_000000_00002@')
+        self.make_result_entry(
+            'testdistro2/testarch/t/testpackage/20170102_000000_00003@')
+
+        with mock.patch.object(
+                results_index.ResultsIndex, 'filter_by_days', autospec=True,
+                side_effect=results_index.ResultsIndex.filter_by_days
+                ) as mock_filter:
+            self.make_formatter(
+                ['testdistro1', 'testdistro2'],
+                days=['20170101', '20170102', '20170103']).format()
+
+        self.assertThat(mock_filter.call_count, Equals(2))
+        self.assertThat(
+            os.path.join(self.destination, '20170101.md'),
+            FileContains(matcher=Contains('00001')))
+        self.assertThat(
+            os.path.join(self.destination, '20170102.md'),
+            FileContains(matcher=MatchesAll(
+                Contains('00002'), Contains('00003'),
+                Not(Contains('00001')))))
+        self.assertThat(
+            os.path.join(self.destination, '20170103.md'), Not(FileExists()))
+
+    def test_format_keeps_the_order_of_the_distros(self):
+        self.make_result_entry(
+            'testdistro1/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_result_entry(
+            'testdistro2/testarch/t/testpackage/20170101_000000_00002@')
+
+        self.make_formatter(['testdistro2', 'testdistro1']).format()
+
+        with open(os.path.join(self.destination, '20170101.md')) as report:
+            contents = report.read()
+        self.assertThat(
+            [line for line in contents.splitlines()
+             if line.startswith('## ')],
+            Equals(['## testdistro2', '## testdistro1']))
+
+    def test_format_ppas_writes_a_report_tree_per_ppa(self):
+        self.make_result_entry(
+            'testdistro1/testarch/t/testpackage/20170101_000000_00001@',
+            ppa='testuser1-testppa1')
+        self.make_result_entry(
+            'testdistro2/testarch/t/testpackage/20170101_000000_00002@',
+            ppa='testuser1-testppa1')
+        self.make_result_entry(
+            'testdistro1/testarch/t/testpackage/20170101_000000_00003@',
+            ppa='testuser2-testppa2')
+
+        formatter = results_formatter.ResultsFormatter(
+            destination_path=self.destination,
+            ppas=[
+                results_formatter.PPA(
+                    user='testuser1', name='testppa1',
+                    distros=['testdistro1', 'testdistro2']),
+                results_formatter.PPA(
+                    user='testuser2', name='testppa2',
+                    distros=['testdistro1'])],
+            days=['20170101'],
+            base_results_url='file://{}'.format(self.results_path))
+        with mock.patch.object(
+                results_formatter.ResultsFormatter, '_fetch', autospec=True,
+                side_effect=results_formatter.ResultsFormatter._fetch
+                ) as mock_fetch:
+            formatter.format()
+
+        # The entries of all the PPAs are fetched by the same workers.
+        self.assertThat(mock_fetch.call_count, Equals(1))
+        self.assertThat(
+            os.path.join(self.destination, 'testuser1', 'testppa1',
+                         '20170101.md'),
+            FileContains(matcher=MatchesAll(
+                Contains('00001'), Contains('00002'),
+                Not(Contains('00003')))))
+        self.assertThat(
+            os.path.join(self.destination, 'testuser2', 'testppa2',
+                         '20170101.md'),
+            FileContains(matcher=MatchesAll(
+                Contains('00003'), Not(Contains('00001')))))
+        self.assertThat(
+            os.path.join(self.destination, '20170101.md'), Not(FileExists()))
+
+    def test_format_with_decode_processes(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00002@',
+            exitcode='1')
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00003@',
+            pull_request=True)
+
+        metrics = run_metrics.Metrics()
+
+        # The beginning of the archives is not enough to know if they are
+        # pull requests, so the complete archives are decoded.
+        with mock.patch.object(result_entry, '_PULL_REQUEST_PROBE_SIZE', 512):
+            self.make_formatter(
+                ['testdistro'], decode_processes=2, metrics=metrics).format()
+
+        self.assertThat(
+            metrics.to_dict()['timers']['result_extraction']['calls'],
+            Equals(3))
+        self.assertThat(
+            os.path.join(self.destination, '20170101.md'),
+            FileContains(matcher=MatchesAll(
+                Contains(':white_check_mark: passed'),
+                Contains(':x: failed'), Not(Contains('00003')))))
+
+    def test_format_with_deprecated_day(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            warnings.simplefilter('always')
+            formatter = results_formatter.ResultsFormatter(
+                destination_path=self.destination, distros=['testdistro'],
+                ppa_user='testuser', ppa_name='testppa', day='20170101',
+                base_results_url='file://{}'.format(self.results_path))
+        formatter.format()
+
+        self.assertThat(
+            [warning.category for warning in caught_warnings],
+            Equals([DeprecationWarning]))
+        self.assertThat(
+            os.path.join(self.destination, '20170101.md'),
+            FileContains(matcher=Contains('00001')))
+
+    def test_days_string_raises_error(self):
+        self.assertRaises(
+            TypeError, self.make_formatter, ['testdistro'], days='20170101')
+
+    def test_format_reports_invalid_results(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00002@')
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00003@')
+        entries_path = os.path.join(
+            self.results_path, 'autopkgtest-testdistro-testuser-testppa',
+            'testdistro/testarch/t/testpackage')
+        # A corrupt archive.
+        with open(os.path.join(
+                entries_path, '20170101_000000_00002@',
+                'result.tar'), 'wb') as result_file:
+            result_file.write(b'not a tar file' * 100)
+        # An archive with an invalid testinfo.json.
+        with tarfile.open(os.path.join(
+                entries_path, '20170101_000000_00003@',
+                'result.tar'), 'w') as tar_file:
+            info = tarfile.TarInfo('testinfo.json')
+            info.size = 3
+            tar_file.addfile(info, io.BytesIO(b'{{{'))
+
+        self.make_formatter(['testdistro']).format()
+
+        self.assertThat(
+            os.path.join(self.destination, '20170101.md'),
+            FileContains(matcher=MatchesAll(
+                Contains(':white_check_mark: passed'),
+                Contains(
+                    ':warning: Failed to read file://{}/'
+                    '20170101_000000_00002@/result.tar'.format(
+                        entries_path)),
+                Contains('20170101_000000_00003@/result.tar: Expecting'))))
+
+    def test_interrupted_format_does_not_fetch_pending_entries(self):
+        for number in range(50):
+            self.make_result_entry(
+                'testdistro/testarch/t/testpackage/'
+                '20170101_000000_{:05}@'.format(number))
+
+        with mock.patch.object(
+                markdown_printer.MarkdownWriter, 'write_result',
+                side_effect=KeyboardInterrupt):
+            with mock.patch.object(
+                    result_entry.ResultEntry, 'fetch', autospec=True,
+                    side_effect=result_entry.ResultEntry.fetch
+                    ) as mock_fetch:
+                self.assertRaises(
+                    KeyboardInterrupt,
+                    self.make_formatter(['testdistro'], workers=2).format)
+
+        # Only the entries that were being downloaded when the first one
+        # was written.
+        self.assertThat(mock_fetch.call_count, LessThan(10))
+
+    def test_format_removes_scratch_directory(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+
+        self.make_formatter(['testdistro']).format()
+
+        index = results_index.ResultsIndex._download_index.call_args[0][0]
+        self.assertThat(index._scratch_path, Not(DirExists()))
+
+    def test_format_reports_failed_downloads(self):
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00001@')
+        self.make_result_entry(
+            'testdistro/testarch/t/testpackage/20170101_000000_00002@')
+        result_tar_path = os.path.join(
+            self.results_path, 'autopkgtest-testdistro-testuser-testppa',
+            'testdistro/testarch/t/testpackage/20170101_000000_00002@',
+            'result.tar')
+        os.rename(result_tar_path, result_tar_path + '.tmp')
+        client = http_client.HTTPClient(retries=0)
+
+        self.make_formatter(
+            ['testdistro'], incremental=True, client=client).format()
+
+        destination = os.path.join(self.destination, '20170101.md')
+        self.assertThat(
+            destination,
+            FileContains(matcher=MatchesAll(
+                Contains(':white_check_mark: passed'),
+                Contains(':warning: Failed to download'))))
+        # The failed entry is retried in the next run.
+        os.rename(result_tar_path + '.tmp', result_tar_path)
+        with mock.patch.object(
+                result_entry.ResultEntry, 'fetch', autospec=True,
+                side_effect=result_entry.ResultEntry.fetch) as mock_fetch:
+            self.make_formatter(
+                ['testdistro'], incremental=True, client=client).format()
+        self.assertThat(mock_fetch.call_count, Equals(1))
+        self.assertThat(
+            destination,
+            FileContains(matcher=Not(Contains(':warning:'))))
@@ -14,18 +14,38 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import email
+import io
 import os
 from unittest import mock
 
 from testtools import ExpectedException
-from testtools.matchers import Equals
+from testtools.matchers import (
+    Equals,
+    HasLength
+)
 
 from autopkgtest_results_formatter import (
     errors,
+    http_client,
     result_entry,
+    results_cache,
     results_index
 )
-from autopkgtest_results_formatter.tests import unit
+from autopkgtest_results_formatter.tests import (
+    fixture_setup,
+    unit
+)
+
+
+class FakeResponse(io.BytesIO):
+
+    def __init__(self, contents, *, status=200, headers=None):
+        super().__init__(contents)
+        self.status = status
+        self.headers = email.message.Message()
+        for name, value in (headers or {}).items():
+            self.headers[name] = value
 
 
 class TestResultsIndexTestCase(unit.TestCase):
@@ -47,16 +67,16 @@ class TestResultsIndexTestCase(unit.TestCase):
         self.assertThat(error.action, Equals('read index'))
 
     def test_download_makes_request(self):
-        with mock.patch('urllib.request.urlretrieve') as mock_urlretrieve:
-            with results_index.ResultsIndex(
-                    distro='testdistro', ppa_user='testuser',
-                    ppa_name='testppa') as index:
-                pass
+        client = mock.Mock()
+        with results_index.ResultsIndex(
+                distro='testdistro', ppa_user='testuser',
+                ppa_name='testppa', client=client):
+            pass
 
-        mock_urlretrieve.assert_called_once_with(
+        client.retrieve.assert_called_once_with(
             'https://objectstorage.prodstack4-5.canonical.com/v1/'
             'AUTH_77e2ada1e7a84929a74ba3b87153c0ac/'
-            'autopkgtest-testdistro-testuser-testppa')
+            'autopkgtest-testdistro-testuser-testppa', mock.ANY)
 
     def test_read(self):
         test_index_file_path = os.path.join(
@@ -72,7 +92,28 @@ class TestResultsIndexTestCase(unit.TestCase):
                 index.read(),
                 Equals('testentry1\ntestentry2\n'))
 
-    def test_filter_by_day(self):
+    def test_iter_entries_without_context_raises_error(self):
+        index = results_index.ResultsIndex(
+            distro='dummy', ppa_user='dummy', ppa_name='dummy')
+        error = self.assertRaises(
+            errors.ResultsIndexNotDownloadedError, list, index.iter_entries())
+        self.assertThat(error.action, Equals('iterate index'))
+
+    def test_iter_entries(self):
+        test_index_file_path = os.path.join(
+            self.path, 'autopkgtest-testdistro-testuser-testppa')
+        with open(test_index_file_path, 'w') as test_index_file:
+            test_index_file.write('testentry1\n\n')
+            test_index_file.write('testentry2\n')
+
+        with results_index.ResultsIndex(
+                distro='testdistro', ppa_user='testuser', ppa_name='testppa',
+                base_results_url='file://{}'.format(self.path)) as index:
+            self.assertThat(
+                list(index.iter_entries()),
+                Equals(['testentry1', 'testentry2']))
+
+    def make_index(self):
         test_index_file_path = os.path.join(
             self.path, 'autopkgtest-testdistro-testuser-testppa')
         with open(test_index_file_path, 'w') as test_index_file:
@@ -103,6 +144,8 @@ class TestResultsIndexTestCase(unit.TestCase):
                 'artifacts.tar.gz\n'
             )
 
+    def test_filter_by_day(self):
+        self.make_index()
         result = []
         with results_index.ResultsIndex(
                 distro='testdistro', ppa_user='testuser', ppa_name='testppa',
@@ -122,3 +165,275 @@ class TestResultsIndexTestCase(unit.TestCase):
                     directory=('testdistro/testarch1/t/testpackage/'
                                '20170101_654321_12345@'))
             ]))
+
+    def test_filter_by_days(self):
+        self.make_index()
+        with results_index.ResultsIndex(
+                distro='testdistro', ppa_user='testuser', ppa_name='testppa',
+                base_results_url='file://{}'.format(self.path)) as index:
+            result = index.filter_by_days({'20171231', '20000101', '20170102'})
+
+        def make_entry(day_time):
+            return result_entry.ResultEntry(
+                index_url=index.url,
+                directory=(
+                    'testdistro/testarch1/t/testpackage/{}_12345@'.format(
+                        day_time)))
+
+        self.assertThat(
+            result,
+            Equals({
+                '20000101': [make_entry('20000101_123456')],
+                '20170102': [],
+                '20171231': [make_entry('20171231_123456')],
+            }))
+        self.assertThat(
+            list(result), Equals(['20000101', '20170102', '20171231']))
+
+    def test_filter_by_days_with_range(self):
+        self.make_index()
+        with results_index.ResultsIndex(
+                distro='testdistro', ppa_user='testuser', ppa_name='testppa',
+                base_results_url='file://{}'.format(self.path)) as index:
+            result = index.filter_by_days(range(20170101, 20170132))
+
+        self.assertThat(result['20170101'], HasLength(2))
+        self.assertThat(
+            sum(len(entries) for entries in result.values()), Equals(2))
+
+    def test_filter_by_day_with_architecture(self):
+        self.make_index()
+        test_index_file_path = os.path.join(
+            self.path, 'autopkgtest-testdistro-testuser-testppa')
+        with open(test_index_file_path, 'a') as test_index_file:
+            test_index_file.write(
+                'testdistro/testarch2/t/testpackage/20170101_111111_12345@/'
+                'result.tar\n')
+
+        with results_index.ResultsIndex(
+                distro='testdistro', ppa_user='testuser', ppa_name='testppa',
+                base_results_url='file://{}'.format(self.path)) as index:
+            result = list(
+                index.filter_by_day('20170101', architecture='testarch2'))
+
+        self.assertThat(
+            result,
+            Equals([
+                result_entry.ResultEntry(
+                    index_url=index.url,
+                    directory=('testdistro/testarch2/t/testpackage/'
+                               '20170101_111111_12345@'))]))
+
+    def test_filter_by_range(self):
+        self.make_index()
+        with results_index.ResultsIndex(
+                distro='testdistro', ppa_user='testuser', ppa_name='testppa',
+                base_results_url='file://{}'.format(self.path)) as index:
+            result = index.filter_by_range('20161231', '20171231')
+
+        self.assertThat(list(result), Equals(['20170101', '20171231']))
+        self.assertThat(result['20170101'], HasLength(2))
+        self.assertThat(result['20171231'], HasLength(1))
+
+    def test_filter_without_context_raises_error(self):
+        index = results_index.ResultsIndex(
+            distro='dummy', ppa_user='dummy', ppa_name='dummy')
+        error = self.assertRaises(
+            errors.ResultsIndexNotDownloadedError,
+            index.filter_by_days, ['20170101'])
+        self.assertThat(error.action, Equals('filter index'))
+
+    def test_index_is_scanned_once(self):
+        self.make_index()
+        with results_index.ResultsIndex(
+                distro='testdistro', ppa_user='testuser', ppa_name='testppa',
+                base_results_url='file://{}'.format(self.path)) as index:
+            with mock.patch.object(
+                    results_index, '_ENTRY_BYTES_PATTERN',
+                    wraps=results_index._ENTRY_BYTES_PATTERN) as mock_pattern:
+                index.filter_by_days(['20170101'])
+                index.filter_by_days(['20171231'])
+                index.filter_by_range('20000101', '20171231')
+
+        self.assertThat(mock_pattern.fullmatch.call_count, Equals(12))
+
+    def test_refresh_without_context_raises_error(self):
+        index = results_index.ResultsIndex(
+            distro='testdistro', ppa_user='testuser', ppa_name='testppa')
+        error = self.assertRaises(
+            errors.ResultsIndexNotDownloadedError, index.refresh)
+        self.assertThat(error.action, Equals('refresh index'))
+
+    def test_failed_refresh_keeps_previous_index(self):
+        self.make_index()
+        with results_index.ResultsIndex(
+                distro='testdistro', ppa_user='testuser', ppa_name='testppa',
+                base_results_url='file://{}'.format(self.path),
+                client=http_client.HTTPClient(retries=0)) as index:
+            os.remove('autopkgtest-testdistro-testuser-testppa')
+            self.assertRaises(errors.DownloadError, index.refresh)
+            self.assertThat(
+                list(index.filter_by_day('20170101')), HasLength(2))
+
+
+class CachedResultsIndexTestCase(unit.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = results_cache.ResultsCache(
+            path=os.path.join(self.path, 'cache'))
+        self.client = mock.Mock()
+        self.index = results_index.ResultsIndex(
+            distro='testdistro', ppa_user='testuser', ppa_name='testppa',
+            base_results_url='http://example.com', cache=self.cache,
+            client=self.client)
+        self.index_file_path = self.cache.get_index_file_path(self.index.url)
+
+    def make_local_index(self, contents, validators):
+        with open(self.index_file_path, 'w') as index_file:
+            index_file.write(contents)
+        self.cache.save_index_validators(self.index.url, validators)
+
+    def test_first_download_keeps_index_and_validators(self):
+        response = FakeResponse(
+            b'testentry1\n', headers={'ETag': '"test"'})
+        self.client.open.return_value = response
+        with self.index:
+            self.assertThat(self.index.read(), Equals('testentry1\n'))
+
+        self.client.open.assert_called_once_with(self.index.url, headers={})
+        self.assertThat(
+            self.cache.load_index_validators(self.index.url),
+            Equals({'etag': '"test"'}))
+
+    def test_not_modified_uses_local_index(self):
+        self.make_local_index(
+            'testentry1\n',
+            {'etag': '"test"', 'last_modified': 'test date'})
+        self.client.open.return_value = FakeResponse(b'', status=304)
+        with self.index:
+            self.assertThat(self.index.read(), Equals('testentry1\n'))
+
+        self.client.open.assert_called_once_with(
+            self.index.url,
+            headers={
+                'If-None-Match': '"test"',
+                'If-Modified-Since': 'test date',
+                'Range': 'bytes=0-'})
+
+    def test_partial_content_appends_to_local_index(self):
+        self.make_local_index('testentry1\n', {'etag': '"old"'})
+        response = FakeResponse(
+            b'testentry1\ntestentry2\n', status=206,
+            headers={'Content-Range': 'bytes 0-21/22', 'ETag': '"new"'})
+        self.client.open.return_value = response
+        with self.index:
+            self.assertThat(
+                self.index.read(), Equals('testentry1\ntestentry2\n'))
+
+        self.assertThat(
+            self.cache.load_index_validators(self.index.url),
+            Equals({'etag': '"new"'}))
+
+    def test_partial_content_not_matching_downloads_full_index(self):
+        self.make_local_index('testentry1\n', {})
+        responses = [
+            # The last byte is the same, but the rest of the tail is not.
+            FakeResponse(
+                b'testentry3\ntestentry2\n', status=206,
+                headers={'Content-Range': 'bytes 0-21/22'}),
+            FakeResponse(b'testentry3\ntestentry2\n')]
+        self.client.open.side_effect = responses
+        with self.index:
+            self.assertThat(
+                self.index.read(), Equals('testentry3\ntestentry2\n'))
+
+    def test_large_local_index_checks_its_tail(self):
+        contents = ''.join(
+            'testentry{:05}\n'.format(number) for number in range(1000))
+        self.make_local_index(contents, {'etag': 'W/"test"'})
+        self.client.open.return_value = FakeResponse(b'', status=304)
+        with self.index:
+            pass
+
+        self.client.open.assert_called_once_with(
+            self.index.url,
+            headers={
+                'If-None-Match': 'W/"test"',
+                'Range': 'bytes={}-'.format(len(contents) - 4096)})
+
+    def test_refresh_scans_only_appended_lines(self):
+        first_line = (
+            b'testdistro/testarch/t/testpackage/20170101_0_1@/log.gz\n')
+        second_line = (
+            b'testdistro/testarch/t/testpackage/20170101_0_2@/log.gz\n')
+        self.client.open.side_effect = [
+            FakeResponse(first_line),
+            FakeResponse(
+                first_line + second_line, status=206,
+                headers={'Content-Range': 'bytes 0-{}/{}'.format(
+                    len(first_line + second_line) - 1,
+                    len(first_line + second_line))})]
+        with self.index:
+            self.assertThat(
+                list(self.index.filter_by_day('20170101')), HasLength(1))
+            with mock.patch.object(
+                    results_index, '_ENTRY_BYTES_PATTERN',
+                    wraps=results_index._ENTRY_BYTES_PATTERN) as mock_pattern:
+                self.index.refresh()
+                self.assertThat(
+                    [entry.identifier for entry in
+                     self.index.filter_by_day('20170101')],
+                    Equals(['testdistrotestarch2017010101',
+                            'testdistrotestarch2017010102']))
+
+        # Only the appended line was scanned.
+        self.assertThat(mock_pattern.fullmatch.call_count, Equals(1))
+
+    def test_refresh_scans_replaced_index_again(self):
+        self.client.open.side_effect = [
+            FakeResponse(
+                b'testdistro/testarch/t/testpackage/20170101_0_1@/log.gz\n'),
+            FakeResponse(b'', status=416),
+            FakeResponse(
+                b'testdistro/testarch/t/testpackage/20170101_0_2@/log.gz\n')]
+        with self.index:
+            list(self.index.filter_by_day('20170101'))
+            self.index.refresh()
+            self.assertThat(
+                [entry.identifier for entry in
+                 self.index.filter_by_day('20170101')],
+                Equals(['testdistrotestarch2017010102']))
+
+
+class ServedResultsIndexTestCase(unit.TestCase):
+
+    def test_refresh_of_grown_index_transfers_only_appended_bytes(self):
+        storage = self.useFixture(fixture_setup.FakeObjectStorage())
+        index_path = '/autopkgtest-testdistro-testuser-testppa'
+        lines = [
+            'testdistro/testarch/t/testpackage/20170101_0_{}@/log.gz\n'.format(
+                number).encode()
+            for number in range(200)]
+        storage.files[index_path] = b''.join(lines[:100])
+        client = http_client.HTTPClient()
+        self.addCleanup(client.close)
+        with results_index.ResultsIndex(
+                distro='testdistro', ppa_user='testuser', ppa_name='testppa',
+                base_results_url=storage.url, client=client,
+                cache=results_cache.ResultsCache(
+                    path=os.path.join(self.path, 'cache'))) as index:
+            self.assertThat(
+                list(index.filter_by_day('20170101')), HasLength(100))
+            storage.files[index_path] = b''.join(lines)
+            bytes_sent = storage.bytes_sent
+            index.refresh()
+            self.assertThat(
+                list(index.filter_by_day('20170101')), HasLength(200))
+
+        # The tail of the local copy that is checked, and the new lines.
+        self.assertThat(
+            storage.bytes_sent - bytes_sent,
+            Equals(results_index._INDEX_CHECK_SIZE +
+                   len(b''.join(lines[100:]))))
+        self.assertNotIn('If-Range', storage.requests[-1][1])
@@ -0,0 +1,233 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sqlite3
+from unittest import mock
+
+from testtools.matchers import Equals
+
+from autopkgtest_results_formatter import (
+    errors,
+    result_entry,
+    results_store
+)
+from autopkgtest_results_formatter.tests import unit
+
+
+class ResultsStoreTestCase(unit.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store_path = os.path.join(self.path, 'results.db')
+
+    def make_entry(
+            self, directory, *, exitcode='0', duration='10',
+            pull_request=False, index_url='http://example.com'):
+        entry = result_entry.ResultEntry(
+            index_url=index_url, directory=directory)
+        entry.restore_record(result_entry.ResultRecord(
+            test_package='testpackage testversion', exitcode=exitcode,
+            duration=duration, pull_request=pull_request))
+        return entry
+
+    def add_entries(self, entries):
+        with results_store.ResultsStore(path=self.store_path) as store:
+            for entry in entries:
+                store.add(entry)
+
+    def test_iter_records_between_days(self):
+        self.add_entries([
+            self.make_entry('testdistro/amd64/t/testpackage/20170101_0_1@'),
+            self.make_entry(
+                'testdistro/amd64/t/testpackage/20170102_0_2@',
+                exitcode='4', duration=None),
+            self.make_entry('testdistro/amd64/t/testpackage/20170103_0_3@')])
+
+        with results_store.ResultsStore(path=self.store_path) as store:
+            records = list(store.iter_records('20170102', '20170103'))
+
+        self.assertThat(records, Equals([
+            results_store.StoredRecord(
+                index_url='http://example.com', distro='testdistro',
+                architecture='amd64', package='testpackage', day='20170102',
+                identifier='testdistroamd642017010202',
+                test_package='testpackage testversion', exitcode=4,
+                duration=None, pull_request=False),
+            results_store.StoredRecord(
+                index_url='http://example.com', distro='testdistro',
+                architecture='amd64', package='testpackage', day='20170103',
+                identifier='testdistroamd642017010303',
+                test_package='testpackage testversion', exitcode=0,
+                duration=10, pull_request=False)]))
+
+    def test_iter_records_filters_columns(self):
+        self.add_entries([
+            self.make_entry('testdistro/amd64/t/testpackage/20170101_0_1@'),
+            self.make_entry('testdistro/i386/t/testpackage/20170101_0_2@'),
+            self.make_entry('testdistro/i386/t/otherpackage/20170101_0_3@')])
+
+        with results_store.ResultsStore(path=self.store_path) as store:
+            records = list(store.iter_records(
+                '20170101', '20170101', architecture='i386',
+                package='testpackage'))
+
+        self.assertThat(
+            [record.identifier for record in records],
+            Equals(['testdistroi3862017010102']))
+
+    def test_iter_records_filters_index_url(self):
+        self.add_entries([
+            self.make_entry('testdistro/amd64/t/testpackage/20170101_0_1@'),
+            self.make_entry(
+                'testdistro/amd64/t/testpackage/20170101_0_2@',
+                index_url='http://example.com/other')])
+
+        with results_store.ResultsStore(path=self.store_path) as store:
+            records = list(store.iter_records(
+                '20170101', '20170101', index_url='http://example.com/other'))
+
+        self.assertThat(
+            [record.identifier for record in records],
+            Equals(['testdistroamd642017010102']))
+
+    def test_old_store_gets_index_urls(self):
+        connection = sqlite3.connect(self.store_path)
+        connection.executescript(
+            'CREATE TABLE results (url TEXT PRIMARY KEY, distro TEXT, '
+            'architecture TEXT, package TEXT, day TEXT, identifier TEXT, '
+            'test_package TEXT, exitcode INTEGER, duration INTEGER, '
+            'pull_request INTEGER);'
+            "INSERT INTO results VALUES ('http://example.com/index/"
+            "testdistro/amd64/t/testpackage/20170101_0_1@', 'testdistro', "
+            "'amd64', 'testpackage', '20170101', 'testid', 'test', 0, 1, "
+            '0);')
+        connection.commit()
+        connection.close()
+
+        with results_store.ResultsStore(path=self.store_path) as store:
+            [record] = store.iter_records('20170101', '20170101')
+
+        self.assertThat(
+            record.index_url, Equals('http://example.com/index'))
+
+    def test_add_replaces_entry(self):
+        directory = 'testdistro/amd64/t/testpackage/20170101_0_1@'
+        self.add_entries([self.make_entry(directory, exitcode='1')])
+        self.add_entries([self.make_entry(directory, exitcode='0')])
+
+        with results_store.ResultsStore(path=self.store_path) as store:
+            records = list(store.iter_records('20170101', '20170101'))
+
+        self.assertThat(
+            [record.exitcode for record in records], Equals([0]))
+
+    def test_get_stats_excludes_pull_requests(self):
+        self.add_entries([
+            self.make_entry('testdistro/amd64/t/testpackage/20170101_0_1@'),
+            self.make_entry(
+                'testdistro/amd64/t/testpackage/20170101_0_2@',
+                exitcode='4', duration='30'),
+            self.make_entry(
+                'testdistro/i386/t/testpackage/20170101_0_3@',
+                exitcode='1', duration='20'),
+            self.make_entry(
+                'testdistro/i386/t/testpackage/20170101_0_4@',
+                exitcode='1', pull_request=True)])
+
+        with results_store.ResultsStore(path=self.store_path) as store:
+            stats = store.get_stats('20170101', '20170101')
+
+        self.assertThat(stats, Equals([
+            results_store.ResultStats(
+                group=('amd64',), runs=2, failures=1, failure_rate=0.5,
+                mean_duration=20.0),
+            results_store.ResultStats(
+                group=('i386',), runs=1, failures=1, failure_rate=1.0,
+                mean_duration=20.0)]))
+
+    def test_get_stats_without_groups(self):
+        self.add_entries([
+            self.make_entry('testdistro/amd64/t/testpackage/20170101_0_1@'),
+            self.make_entry(
+                'testdistro/i386/t/testpackage/20170101_0_2@',
+                exitcode='1')])
+
+        with results_store.ResultsStore(path=self.store_path) as store:
+            stats = store.get_stats('20170101', '20170101', group_by=())
+            empty_stats = store.get_stats('20170201', '20170201', group_by=())
+
+        self.assertThat(stats, Equals([
+            results_store.ResultStats(
+                group=(), runs=2, failures=1, failure_rate=0.5,
+                mean_duration=10.0)]))
+        self.assertThat(empty_stats, Equals([]))
+
+    def test_get_stats_with_unknown_exitcodes(self):
+        self.add_entries([
+            self.make_entry(
+                'testdistro/amd64/t/testpackage/20170101_0_1@',
+                exitcode='1'),
+            self.make_entry(
+                'testdistro/amd64/t/testpackage/20170101_0_2@',
+                exitcode=None),
+            self.make_entry(
+                'testdistro/i386/t/testpackage/20170101_0_3@',
+                exitcode=None)])
+
+        with results_store.ResultsStore(path=self.store_path) as store:
+            stats = store.get_stats('20170101', '20170101')
+
+        self.assertThat(stats, Equals([
+            results_store.ResultStats(
+                group=('amd64',), runs=2, failures=1, failure_rate=1.0,
+                mean_duration=10.0),
+            results_store.ResultStats(
+                group=('i386',), runs=1, failures=0, failure_rate=None,
+                mean_duration=10.0)]))
+
+    def test_add_commits_periodically(self):
+        with mock.patch.object(results_store, '_COMMIT_INTERVAL', 2):
+            with results_store.ResultsStore(path=self.store_path) as store:
+                for identifier in range(3):
+                    store.add(self.make_entry(
+                        'testdistro/amd64/t/testpackage/'
+                        '20170101_0_{}@'.format(identifier)))
+                with results_store.ResultsStore(
+                        path=self.store_path) as other_store:
+                    records = list(
+                        other_store.iter_records('20170101', '20170101'))
+
+        self.assertThat(len(records), Equals(2))
+
+    def test_interrupted_run_keeps_entries(self):
+        def _add_and_interrupt():
+            with results_store.ResultsStore(path=self.store_path) as store:
+                store.add(self.make_entry(
+                    'testdistro/amd64/t/testpackage/20170101_0_1@'))
+                raise KeyboardInterrupt()
+
+        self.assertRaises(KeyboardInterrupt, _add_and_interrupt)
+
+        with results_store.ResultsStore(path=self.store_path) as store:
+            records = list(store.iter_records('20170101', '20170101'))
+        self.assertThat(len(records), Equals(1))
+
+    def test_get_stats_with_invalid_group_raises_error(self):
+        with results_store.ResultsStore(path=self.store_path) as store:
+            self.assertRaises(
+                errors.InvalidGroupError, store.get_stats,
+                '20170101', '20170101', group_by=('url',))
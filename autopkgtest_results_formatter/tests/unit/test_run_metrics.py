@@ -0,0 +1,85 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+from unittest import mock
+
+from testtools.matchers import (
+    Equals,
+    FileContains
+)
+
+from autopkgtest_results_formatter import run_metrics
+from autopkgtest_results_formatter.tests import unit
+
+
+class MetricsTestCase(unit.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.metrics = run_metrics.Metrics()
+        patcher = mock.patch(
+            'time.perf_counter', side_effect=[10.0, 11.5, 20.0, 20.5])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for _ in range(2):
+            with self.metrics.time('test_timer'):
+                pass
+        self.metrics.count('test_counter')
+        self.metrics.count('test_counter', 10)
+
+    def test_to_dict(self):
+        self.assertThat(self.metrics.to_dict(), Equals({
+            'timers': {'test_timer': {'seconds': 2.0, 'calls': 2}},
+            'counters': {'test_counter': 11}}))
+
+    def test_timer_measures_failed_stages(self):
+        metrics = run_metrics.Metrics()
+        with mock.patch('time.perf_counter', side_effect=[0.0, 1.0]):
+            with self.assertRaises(ValueError):
+                with metrics.time('test_timer'):
+                    raise ValueError()
+
+        self.assertThat(
+            metrics.to_dict()['timers'],
+            Equals({'test_timer': {'seconds': 1.0, 'calls': 1}}))
+
+    def test_get_summary(self):
+        self.assertThat(
+            self.metrics.get_summary(),
+            Equals('test_timer: 2.000s in 2 calls\ntest_counter: 11'))
+
+    def test_write_json(self):
+        path = os.path.join(self.path, 'metrics.json')
+        self.metrics.write_json(path)
+
+        with open(path) as metrics_file:
+            self.assertThat(
+                json.load(metrics_file), Equals(self.metrics.to_dict()))
+
+    def test_write_prometheus(self):
+        path = os.path.join(self.path, 'metrics.prom')
+        self.metrics.write_prometheus(path)
+
+        self.assertThat(path, FileContains(
+            '# TYPE autopkgtest_results_formatter_test_timer_seconds gauge\n'
+            'autopkgtest_results_formatter_test_timer_seconds 2.0\n'
+            '# TYPE autopkgtest_results_formatter_test_timer_calls gauge\n'
+            'autopkgtest_results_formatter_test_timer_calls 2\n'
+            '# TYPE autopkgtest_results_formatter_test_counter gauge\n'
+            'autopkgtest_results_formatter_test_counter 11\n'))
+        self.assertThat(os.listdir(self.path), Equals(['metrics.prom']))